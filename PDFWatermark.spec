@@ -3,11 +3,12 @@ from PyInstaller.utils.hooks import collect_all
 
 datas = []
 binaries = []
-hiddenimports = []
+# PyMuPDF 与 Pillow 在代码中延迟导入（watermark_lazy），静态分析看不到，需显式列出
+hiddenimports = ['fitz', 'PIL.Image', 'PIL.ImageTk', 'PIL.ImageEnhance']
 tmp_ret = collect_all('fitz')
 datas += tmp_ret[0]; binaries += tmp_ret[1]; hiddenimports += tmp_ret[2]
-tmp_ret = collect_all('PIL')
-datas += tmp_ret[0]; binaries += tmp_ret[1]; hiddenimports += tmp_ret[2]
+# Pillow 交给 PyInstaller 自带的 hook 按需收集，不再打包全部图像插件和 Qt 等可选依赖，
+# 单文件程序启动时需要解压的内容更少
 
 
 a = Analysis(
@@ -19,7 +20,7 @@ a = Analysis(
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
-    excludes=[],
+    excludes=['numpy', 'matplotlib', 'IPython', 'PyQt5', 'PyQt6', 'PySide2', 'PySide6'],
     noarchive=False,
     optimize=2,
 )
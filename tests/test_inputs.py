@@ -0,0 +1,59 @@
+import os
+
+import pytest
+
+from watermark_inputs import PdfWalker, glob_base, walk_pdfs
+
+def touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, "wb").close()
+
+@pytest.fixture
+def tree(tmp_path):
+    for rel in ["top.pdf", "a/report.pdf", "b/report.pdf", "b/c/deep.PDF", "b/notes.txt", "skip/x.pdf"]:
+        touch(str(tmp_path / rel))
+    return str(tmp_path)
+
+def rels(paths, root):
+    return sorted(os.path.relpath(p, root).replace(os.sep, "/") for p in paths)
+
+def test_walk_pdfs_recursive_and_filters(tree):
+    assert rels(walk_pdfs(tree), tree) == ["top.pdf"]
+    assert rels(walk_pdfs(tree, recursive=True, exclude=["skip"]), tree) == \
+        ["a/report.pdf", "b/c/deep.PDF", "b/report.pdf", "top.pdf"]
+    assert rels(walk_pdfs(tree, recursive=True, include=["report.pdf"]), tree) == ["a/report.pdf", "b/report.pdf"]
+
+def test_walker_counts_and_skips(tree):
+    totals = []
+    walker = PdfWalker([tree], recursive=True, skip=lambda p: os.path.basename(os.path.dirname(p)) == "skip", on_done=totals.append)
+    assert len(list(walker)) == 4
+    assert walker.done and walker.found == 4 and totals == [4]
+    assert walker.count() == 4
+
+def test_glob_base():
+    assert glob_base("docs/**/*.pdf") == "docs"
+    assert glob_base("*.pdf") == os.curdir
+    assert glob_base("a/b*/c/*.pdf") == "a"
+
+def test_output_root(tree):
+    a, b = os.path.join(tree, "a"), os.path.join(tree, "b")
+    assert PdfWalker([os.path.join(a, "report.pdf")]).output_root is None
+    assert PdfWalker([tree]).output_root == os.path.abspath(tree)
+    assert PdfWalker([a, b]).output_root == os.path.abspath(tree)
+    assert PdfWalker([os.path.join(tree, "**", "*.pdf")]).output_root == os.path.abspath(tree)
+
+def test_recursive_outputs_do_not_collide(tree, tmp_path):
+    engine = pytest.importorskip("watermark_engine")
+    out = str(tmp_path / "out")
+    walker = PdfWalker([tree], recursive=True)
+    outputs = [engine.get_output_path(p, out, "_wm", walker.output_root) for p in walker]
+    assert len(set(outputs)) == len(outputs)
+    assert os.path.join(out, "a", "report_wm.pdf") in outputs
+    assert os.path.join(out, "top_wm.pdf") in outputs
+    # 直接给出的文件、以及不在输入目录下的文件仍写在输出目录下
+    assert engine.get_output_path(os.path.join(tree, "a", "report.pdf"), out, "_wm") == \
+        os.path.join(out, "report_wm.pdf")
+    assert engine.get_output_path("/elsewhere/x.pdf", out, "_wm", tree) == os.path.join(out, "x_wm.pdf")
+    # 保存在原目录时不受影响
+    assert engine.get_output_path(os.path.join(tree, "a", "report.pdf"), engine.DEFAULT_OUTPUT_DIR, "_wm", tree) == \
+        os.path.join(tree, "a", "report_wm.pdf")
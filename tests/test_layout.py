@@ -0,0 +1,62 @@
+import pytest
+
+from watermark_layout import _axis, grid_positions, text_extent, text_stamp_size, wm_positions
+
+def test_axis_covers_closed_interval():
+    assert _axis(0, 10, 0, 30) == [(0, 0), (1, 10), (2, 20), (3, 30)]
+    assert _axis(5, 10, -20, 20) == [(-2, -15), (-1, -5), (0, 5), (1, 15)]
+    assert _axis(0, 10, 1, 9) == []
+
+def test_grid_positions_plain_grid():
+    points = grid_positions(100, 50, 50, 50)
+    assert sorted(points) == sorted((x, y) for x in (0, 50, 100) for y in (0, 50))
+
+def test_grid_positions_keep_partially_visible_stamps():
+    # 20 x 20 的水印中心在页面外 10 点以内时仍有一半可见
+    points = grid_positions(100, 100, 30, 30, stamp_w=20, stamp_h=20, offset_x=-5, offset_y=-5)
+    xs = sorted({x for x, _ in points})
+    assert xs == [-5, 25, 55, 85]
+    assert all(-10 <= x <= 110 and -10 <= y <= 110 for x, y in points)
+
+def test_grid_positions_stagger_offsets_odd_rows():
+    points = grid_positions(100, 40, 40, 40, stagger=True)
+    rows = {}
+    for x, y in points:
+        rows.setdefault(y, []).append(x)
+    assert sorted(rows[0]) == [0, 40, 80]
+    assert sorted(rows[40]) == [20, 60, 100]
+
+def test_wm_positions_single_point_without_grid():
+    assert wm_positions(100, 100, {"x": 12, "y": 34}) == [(12, 34)]
+
+def old_grid_count(page_w, page_h, gap_x, gap_y):
+    # 共用布局之前导出时的格点循环
+    return len(range(0, int(page_w + gap_x), int(gap_x))) * len(range(0, int(page_h + gap_y), int(gap_y)))
+
+def test_text_extent_follows_rotation():
+    assert text_extent(100, 10, 0) == pytest.approx((0, -3, 100, 10))
+    assert text_extent(100, 10, 90) == pytest.approx((-10, 0, 3, 100))
+    assert text_extent(100, 10, 180) == pytest.approx((-100, -10, 0, 3))
+    assert text_extent(100, 10, 270) == pytest.approx((-3, -100, 10, 0))
+
+@pytest.mark.parametrize("angle", [0, 90, 180, 270])
+def test_text_grid_not_larger_than_old_loop(angle):
+    # A4、间距 150、30 点的 "CONFIDENTIAL"（约 190 点宽）
+    extent = text_extent(190, 30, angle)
+    points = grid_positions(595, 842, 150, 150, extent=extent)
+    # 旋转 180 度时文字从格点向左延伸，页面右侧之外的一列也有可见部分（旧循环漏画了这一列）
+    extra_column = len(range(0, 842 + 150, 150)) if angle == 180 else 0
+    assert len(points) <= old_grid_count(595, 842, 150, 150) + extra_column
+    # 以插入点为中心的正方形估计下约 99 格
+    square = text_stamp_size("CONFIDENTIAL", 30) * 2
+    assert len(points) < len(grid_positions(595, 842, 150, 150, square, square)) / 2
+    # 保留的格点都与页面相交
+    x0, y0, x1, y1 = extent
+    assert all(x + x1 > 0 and x + x0 < 595 and y + y1 > 0 and y + y0 < 842 for x, y in points)
+
+def test_text_grid_keeps_every_visible_cell():
+    extent = text_extent(190, 30, 90)
+    x0, y0, x1, y1 = extent
+    visible = {(i * 40, j * 40) for i in range(-20, 40) for j in range(-20, 40)
+               if i * 40 + x1 >= 0 and i * 40 + x0 <= 300 and j * 40 + y1 >= 0 and j * 40 + y0 <= 200}
+    assert set(grid_positions(300, 200, 40, 40, extent=extent)) == visible
@@ -1,19 +1,34 @@
+import sys
+import time
+_START = time.perf_counter() # 启动计时起点，用于基准测试中的启动耗时
+
+if __name__ == "__main__":
+    # 打包后的多进程子进程从这里接管，必须最先执行
+    import multiprocessing
+    multiprocessing.freeze_support()
+
+    # --- 命令行模式 (python -m watermark batch ...)：不加载 tkinter，可在无显示器的服务器上运行 ---
+    if len(sys.argv) > 1:
+        from watermark_engine import main
+        sys.exit(main())
+
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk, colorchooser, font
 import os
-import sys
 import json
 import threading
-import webbrowser
+import contextlib
 import math
-from io import BytesIO
-from PIL import Image, ImageTk, ImageEnhance
+from watermark_lazy import (lazy_import, font_set_signature, load_cached_fonts, save_cached_fonts)
 
 # --- 依赖库检查 ---
 def check_imports():
+    # 只确认依赖已安装，模块本身在第一次使用时才加载
     try:
-        global fitz
-        import fitz  # PyMuPDF
+        global fitz, Image, ImageTk
+        fitz = lazy_import("fitz")  # PyMuPDF
+        Image = lazy_import("PIL.Image")
+        ImageTk = lazy_import("PIL.ImageTk")
         return True
     except ImportError as e:
         try:
@@ -28,11 +43,20 @@ if not check_imports():
     sys.exit(1)
 
 # --- 核心配置 ---
-def get_config_path():
-    # 将配置文件存放在用户主目录下，避免在程序目录生成
-    return os.path.join(os.path.expanduser("~"), ".pdf_watermark_settings.json")
-
-CONFIG_FILE = get_config_path()
+from watermark_engine import (CONFIG_FILE, IMAGE_FORMATS, SAVE_PROFILES, DEFAULT_SAVE_PROFILE, OUTPUT_MODES, normalize_template,
+                              prepare_watermarks, parse_page_range, iter_batch, is_output_path)
+from watermark_inputs import PdfWalker, PathCursor
+from watermark_journal import BatchJournal, DEFAULT_JOURNAL_FILE, job_hash
+from watermark_parallel import iter_batch_parallel, DEFAULT_SHARD_THRESHOLD
+from watermark_cache import AssetCache
+from watermark_layout import text_stamp_size, wm_positions
+from watermark_report import RunReport
+from watermark_plan import plan_batch, format_plan
+from watermark_progress import ProgressReporter, JobControl, POLL_INTERVAL_MS, format_progress
+from watermark_preview import (DEFAULT_PAGE_CACHE_MB, FRAME_MS, RENDER_LOCK, RENDER_RETRY_MS, RenderLockedControl,
+                               try_acquire_render_lock, TILE_SIZE, zoom_to_dpi, page_geometry,
+                               needs_tiles, render_page, render_tile, PageRenderCache, PagePrefetcher,
+                               SpriteCache, make_sprite, make_sprite_base, make_fast_sprite, composite_grid)
 
 # --- 通用滚动框架组件 ---
 def unified_mouse_wheel_bind(widget):
@@ -93,12 +117,23 @@ class AdvancedWatermarkApp:
         self.root.minsize(800, 600)
         
         # --- 核心数据 ---
-        self.pdf_files = []
+        self.input_source = None # PdfWalker：选中的文件列表，或待遍历的文件夹
+        self.file_cursor = None  # 预览翻页时按需从 input_source 中取出文件
+        self.input_count = None  # 后台统计的文件总数，统计完成前为 None
         self.current_pdf_idx = 0
         self.current_doc = None
+        self.current_pdf_path = None
         self.current_page_idx = 0
         self.total_pages = 0
         self.current_pdf_img = None 
+        self.bg_key = None # 当前背景对应的 (文件, 页码, dpi)
+        self.bg_tiles = {} # 瓦片模式下已放到画布上的 {(列, 行): PhotoImage}
+        self.tk_wm_images = {} # 画布上各水印使用的 {水印序号或阵列图层标签: PhotoImage}
+        self._redraw_job = None
+        self._render_retry_job = None # 渲染锁被批处理占用时的重绘任务
+        self._pending_doc_path = None # 等待渲染锁时最后一次要打开的文件
+        self._dirty_wms = set() # 等待下一帧重绘的水印序号，None 表示全部
+        self.redraw_stats = {"count": 0, "total_ms": 0.0, "last_ms": 0.0, "max_ms": 0.0}
         self.pt_to_canvas_scale = 1.0    
         
         # 多水印支持
@@ -113,6 +148,9 @@ class AdvancedWatermarkApp:
         self.grid_mode_var = tk.BooleanVar(value=False)
         self.grid_gap_x_var = tk.DoubleVar(value=100)
         self.grid_gap_y_var = tk.DoubleVar(value=100)
+        self.grid_offset_x_var = tk.DoubleVar(value=0)
+        self.grid_offset_y_var = tk.DoubleVar(value=0)
+        self.grid_stagger_var = tk.BooleanVar(value=False)
         
         self.watermark_path = tk.StringVar()
         self.scale_var = tk.DoubleVar(value=1.0)
@@ -125,12 +163,37 @@ class AdvancedWatermarkApp:
         self.custom_range_var = tk.StringVar(value="")
         self.output_dir_var = tk.StringVar(value="原文件目录")
         self.output_suffix_var = tk.StringVar(value="_marked")
+        self.workers_var = tk.IntVar(value=1)
+        self.shard_threshold_var = tk.IntVar(value=DEFAULT_SHARD_THRESHOLD)
+        self.shared_stamp_var = tk.BooleanVar(value=False)
+        self.image_dpi_var = tk.StringVar(value="原始")
+        self.image_format_var = tk.StringVar(value="PNG")
+        self.save_profile_var = tk.StringVar(value=DEFAULT_SAVE_PROFILE)
+        self.output_mode_var = tk.StringVar(value="rewrite")
+        self.resume_var = tk.BooleanVar(value=False)
+        self.recursive_var = tk.BooleanVar(value=True)
+        self.include_var = tk.StringVar(value="") # 逗号分隔的文件名模式，如 2024-*.pdf
+        self.exclude_var = tk.StringVar(value="")
+        self.memory_limit_var = tk.IntVar(value=0) # 处理时的内存上限 (MB)，0 表示不限
         self.status_var = tk.StringVar(value="准备就绪")
+        self.redraw_time_var = tk.StringVar(value="")
+        self.plan_var = tk.StringVar(value="") # 预扫描得到的文件数、页数和预计耗时
         self.page_info_var = tk.StringVar(value="0 / 0")
 
         self.last_output_path = "" # 记录最后一次生成的文件或目录
+        self.asset_cache = AssetCache() # 预处理后的图片水印磁盘缓存
+        self.preview_cache_mb = DEFAULT_PAGE_CACHE_MB
         self.load_config()
+        # 预览页面位图缓存与相邻页后台预取
+        self.page_cache = PageRenderCache(self.preview_cache_mb)
+        self.prefetcher = PagePrefetcher(self.page_cache)
+        self.sprite_cache = SpriteCache()
         self.setup_ui()
+        # 字体缓存在后台线程中读取（只涉及文件），Tk 调用留在主线程
+        self.available_fonts = None
+        self._font_cache = None
+        threading.Thread(target=self._read_font_cache, daemon=True).start()
+        self.root.after(POLL_INTERVAL_MS, self.poll_fonts)
         
         if self.watermark_path.get() and os.path.exists(self.watermark_path.get()):
             try: self.current_wm_img = Image.open(self.watermark_path.get()).convert("RGBA")
@@ -180,7 +243,34 @@ class AdvancedWatermarkApp:
             import subprocess
             subprocess.run(["xdg-open", path])
 
+    def _read_font_cache(self):
+        signature = font_set_signature()
+        self._font_cache = (signature, load_cached_fonts(signature))
+
+    def poll_fonts(self):
+        if self.available_fonts is not None: return
+        if self._font_cache is None:
+            self.root.after(POLL_INTERVAL_MS, self.poll_fonts)
+            return
+        if self._font_cache[1] is None:
+            # 首次运行或字体有增删：窗口已显示，空闲时在主线程枚举一次并写入缓存
+            self.root.after_idle(self.ensure_fonts_loaded)
+        else:
+            self.set_available_fonts(self._font_cache[1])
+
+    def ensure_fonts_loaded(self):
+        if self.available_fonts is not None: return
+        families = sorted(font.families())
+        self.set_available_fonts(families)
+        signature = self._font_cache[0] if self._font_cache else font_set_signature()
+        threading.Thread(target=save_cached_fonts, args=(signature, families), daemon=True).start()
+
+    def set_available_fonts(self, families):
+        self.available_fonts = families
+        self.cb_font.config(values=families)
+
     def open_feedback(self, e=None):
+        import webbrowser
         webbrowser.open("https://v.wjx.cn/vm/QgqYdV1.aspx")
 
     def create_modern_scale(self, parent, label_text, var, from_val, to_val, width=200, is_int=False, command=None):
@@ -238,6 +328,16 @@ class AdvancedWatermarkApp:
         lf_files = tk.LabelFrame(ctrl_frame, text="1. 文件选择", padx=10, pady=5)
         lf_files.pack(fill="x", padx=10, pady=5)
         tk.Button(lf_files, text="选择 PDF (支持多选)", command=self.select_pdfs).pack(fill="x", pady=2)
+        tk.Button(lf_files, text="选择文件夹 (边遍历边处理)", command=self.select_pdf_folder).pack(fill="x", pady=2)
+        folder_frame = tk.Frame(lf_files)
+        folder_frame.pack(fill="x")
+        tk.Checkbutton(folder_frame, text="包含子文件夹", variable=self.recursive_var).pack(side="left")
+        pattern_frame = tk.Frame(lf_files)
+        pattern_frame.pack(fill="x", pady=2)
+        tk.Label(pattern_frame, text="包含:", font=("Arial", 8)).pack(side="left")
+        tk.Entry(pattern_frame, textvariable=self.include_var, width=10).pack(side="left", padx=2)
+        tk.Label(pattern_frame, text="排除:", font=("Arial", 8)).pack(side="left")
+        tk.Entry(pattern_frame, textvariable=self.exclude_var, width=10).pack(side="left", padx=2)
         
         # 文件切换控制
         self.frame_file_switch = tk.Frame(lf_files)
@@ -291,8 +391,9 @@ class AdvancedWatermarkApp:
         fc_frame.pack(fill="x", pady=5)
         
         tk.Label(fc_frame, text="字体:").pack(side="left")
-        self.available_fonts = sorted(font.families())
-        self.cb_font = ttk.Combobox(fc_frame, textvariable=self.wm_font_var, values=self.available_fonts, state="readonly", width=15)
+        # 系统字体列表在后台读取缓存，窗口出现后再填入；展开下拉框时仍未就绪则当场枚举
+        self.cb_font = ttk.Combobox(fc_frame, textvariable=self.wm_font_var, values=[self.wm_font_var.get()],
+                                    state="readonly", width=15, postcommand=self.ensure_fonts_loaded)
         self.cb_font.pack(side="left", padx=5)
         self.cb_font.bind("<<ComboboxSelected>>", lambda e: self.update_wm_from_ui())
         
@@ -315,6 +416,9 @@ class AdvancedWatermarkApp:
         tk.Checkbutton(self.frame_grid_edit, text="开启全屏铺满", variable=self.grid_mode_var, command=self.update_wm_from_ui).pack(anchor="w")
         self.create_modern_scale(self.frame_grid_edit, "横向间距:", self.grid_gap_x_var, 50, 500, is_int=True).pack(fill="x")
         self.create_modern_scale(self.frame_grid_edit, "纵向间距:", self.grid_gap_y_var, 50, 500, is_int=True).pack(fill="x")
+        self.create_modern_scale(self.frame_grid_edit, "横向偏移:", self.grid_offset_x_var, 0, 250, is_int=True).pack(fill="x")
+        self.create_modern_scale(self.frame_grid_edit, "纵向偏移:", self.grid_offset_y_var, 0, 250, is_int=True).pack(fill="x")
+        tk.Checkbutton(self.frame_grid_edit, text="错位排列 (砖墙式)", variable=self.grid_stagger_var, command=self.update_wm_from_ui).pack(anchor="w")
 
         # 位置控制
         lf_pos = tk.LabelFrame(ctrl_frame, text="4. 位置控制", padx=10, pady=5)
@@ -346,6 +450,41 @@ class AdvancedWatermarkApp:
         tk.Button(lf_output, text="选择输出目录", command=self.select_output_dir).pack(fill="x", pady=2)
         tk.Label(lf_output, textvariable=self.output_dir_var, wraplength=250, fg="gray", font=("Arial", 8)).pack()
         tk.Button(lf_output, text="恢复默认 (原目录)", command=self.reset_output_dir, font=("Arial", 7), fg="blue", bd=0, cursor="hand2").pack(anchor="e")
+        
+        workers_frame = tk.Frame(lf_output)
+        workers_frame.pack(fill="x", pady=2)
+        tk.Label(workers_frame, text="并行进程数:").pack(side="left")
+        tk.Spinbox(workers_frame, from_=1, to=os.cpu_count() or 1, textvariable=self.workers_var, width=5).pack(side="left", padx=5)
+        
+        shard_frame = tk.Frame(lf_output)
+        shard_frame.pack(fill="x", pady=2)
+        tk.Label(shard_frame, text="大文件分页并行 (页数≥):").pack(side="left")
+        tk.Spinbox(shard_frame, from_=10, to=100000, increment=100, textvariable=self.shard_threshold_var, width=7).pack(side="left", padx=5)
+        tk.Label(shard_frame, text="fast 保存方案下分片输出更大", fg="gray").pack(side="left")
+        tk.Checkbutton(lf_output, text="共享水印层 (阵列模式显著减小体积)", variable=self.shared_stamp_var).pack(anchor="w")
+        
+        img_enc_frame = tk.Frame(lf_output)
+        img_enc_frame.pack(fill="x", pady=2)
+        tk.Label(img_enc_frame, text="图片水印 DPI:").pack(side="left")
+        ttk.Combobox(img_enc_frame, values=["原始", "300", "150", "96"], textvariable=self.image_dpi_var, width=6).pack(side="left", padx=5)
+        ttk.Combobox(img_enc_frame, values=IMAGE_FORMATS, textvariable=self.image_format_var, state="readonly", width=6).pack(side="left")
+        
+        profile_frame = tk.Frame(lf_output)
+        profile_frame.pack(fill="x", pady=2)
+        tk.Label(profile_frame, text="保存方案:").pack(side="left")
+        ttk.Combobox(profile_frame, values=list(SAVE_PROFILES), textvariable=self.save_profile_var, state="readonly", width=10).pack(side="left", padx=5)
+        
+        mode_frame = tk.Frame(lf_output)
+        mode_frame.pack(fill="x", pady=2)
+        tk.Label(mode_frame, text="输出方式:").pack(side="left")
+        ttk.Combobox(mode_frame, values=OUTPUT_MODES, textvariable=self.output_mode_var, state="readonly", width=10).pack(side="left", padx=5)
+        tk.Label(lf_output, text="incremental: 复制后增量追加，大文件更快；inplace: 直接修改原文件", font=("Arial", 7), fg="gray", wraplength=250, justify="left").pack(anchor="w")
+        tk.Checkbutton(lf_output, text="断点续跑 (跳过已完成的文件)", variable=self.resume_var).pack(anchor="w")
+
+        memory_frame = tk.Frame(lf_output)
+        memory_frame.pack(fill="x", pady=2)
+        tk.Label(memory_frame, text="内存上限 (MB, 0=不限):").pack(side="left")
+        tk.Spinbox(memory_frame, from_=0, to=65536, increment=256, textvariable=self.memory_limit_var, width=7).pack(side="left", padx=5)
 
         # 执行区域
         self.progress = ttk.Progressbar(ctrl_frame, orient="horizontal", mode="determinate")
@@ -353,10 +492,18 @@ class AdvancedWatermarkApp:
         self.btn_run = tk.Button(ctrl_frame, text="开始批量处理", bg="#28a745", fg="black", height=2, font=("微软雅黑", 10, "bold"), command=self.start_processing_thread)
         self.btn_run.pack(fill="x", padx=10, pady=5)
         
+        frame_job = tk.Frame(ctrl_frame)
+        frame_job.pack(fill="x", padx=10, pady=2)
+        self.btn_pause = tk.Button(frame_job, text="⏸ 暂停", state="disabled", command=self.toggle_pause)
+        self.btn_pause.pack(side="left", fill="x", expand=True)
+        self.btn_cancel = tk.Button(frame_job, text="✖ 取消", state="disabled", command=self.cancel_processing)
+        self.btn_cancel.pack(side="left", fill="x", expand=True)
+        
         self.btn_open_folder = tk.Button(ctrl_frame, text="📂 打开输出文件夹", command=self.open_output_folder, font=("Arial", 9))
         self.btn_open_folder.pack(fill="x", padx=10, pady=2)
         
         tk.Label(ctrl_frame, textvariable=self.status_var, wraplength=280, fg="blue").pack(pady=5)
+        tk.Label(ctrl_frame, textvariable=self.plan_var, wraplength=280, fg="gray", font=("Arial", 8)).pack()
 
         # 页脚
         footer_frame = tk.Frame(ctrl_frame)
@@ -379,13 +526,15 @@ class AdvancedWatermarkApp:
         top_bar = tk.Frame(preview_container, height=40, bg="#f8f9fa", pady=5)
         top_bar.pack(side="top", fill="x")
         
-        zoom_frame = self.create_modern_scale(top_bar, "预览缩放:", self.preview_zoom_var, 0.5, 1.5, width=150, command=self.update_preview)
+        zoom_frame = self.create_modern_scale(top_bar, "预览缩放:", self.preview_zoom_var, 0.5, 1.5, width=150, command=self.schedule_preview)
         zoom_frame.pack(side="left", padx=20)
         zoom_frame.config(bg="#f8f9fa")
         for child in zoom_frame.winfo_children():
             try: child.config(bg="#f8f9fa")
             except: pass
         
+        tk.Label(top_bar, textvariable=self.redraw_time_var, bg="#f8f9fa", fg="#999999", font=("Arial", 8)).pack(side="left")
+        
         frame_page = tk.Frame(top_bar, bg="#f8f9fa")
         frame_page.pack(side="right", padx=20)
         tk.Button(frame_page, text="< 上一页", command=lambda: self.change_page(-1)).pack(side="left")
@@ -402,8 +551,8 @@ class AdvancedWatermarkApp:
         self.v_scroll = ttk.Scrollbar(self.canvas_frame, orient="vertical")
         self.h_scroll = ttk.Scrollbar(self.canvas_frame, orient="horizontal")
         self.canvas = tk.Canvas(self.canvas_frame, bg="#808080", 
-                                xscrollcommand=self.h_scroll.set, 
-                                yscrollcommand=self.v_scroll.set,
+                                xscrollcommand=self.on_canvas_xscroll, 
+                                yscrollcommand=self.on_canvas_yscroll,
                                 highlightthickness=0)
         
         self.v_scroll.config(command=self.canvas.yview)
@@ -417,88 +566,263 @@ class AdvancedWatermarkApp:
         self.canvas.bind("<Button-1>", self.on_drag_start)
         self.canvas.bind("<B1-Motion>", self.on_drag_motion)
         self.canvas.bind("<ButtonRelease-1>", self.on_drag_stop)
+        self.canvas.bind("<Configure>", lambda e: self.schedule_tile_update())
         self._drag_data = {"x": 0, "y": 0}
+        self._tile_update_pending = False
         
         # 预览区也支持触控板滚动 (支持垂直和水平)
         unified_mouse_wheel_bind(self.canvas)
 
     # --- 逻辑部分 (保持原有逻辑并优化坐标计算) ---
-    def update_preview(self, _=None):
-        if not self.current_pdf_img: return
+    def update_background(self):
+        """页面背景只在文件、页码或预览缩放改变时重建，修改水印属性不会触及背景"""
+        # 按缩放倍数直接以对应 dpi 渲染，而不是把固定 dpi 的位图再缩放
+        dpi = zoom_to_dpi(self.preview_zoom_var.get())
+        key = (self.current_pdf_path, self.current_page_idx, dpi)
+        if key == self.bg_key: return False
+        if not try_acquire_render_lock():
+            # 批处理线程正在调用 PyMuPDF：界面线程不等待，稍后重绘
+            self.schedule_render_retry()
+            return False
+        try:
+            return self._update_background(key, dpi)
+        finally:
+            RENDER_LOCK.release()
+
+    def _update_background(self, key, dpi):
+        # 调用方已持有 RENDER_LOCK
+        self.bg_key = key
+        self.canvas.delete("background")
+        self.bg_tiles = {}
+        self.tk_bg_img = None
         
-        zoom = self.preview_zoom_var.get()
-        display_w = int(self.current_pdf_img.width * zoom)
-        display_h = int(self.current_pdf_img.height * zoom)
-        self.pt_to_canvas_scale = (display_w / self.vis_pdf_w)
+        pixel_w, pixel_h, self.vis_pdf_w, self.vis_pdf_h = page_geometry(self.current_doc, self.current_page_idx, dpi)
+        self.pt_to_canvas_scale = pixel_w / self.vis_pdf_w
+        self.bg_pixel_size = (pixel_w, pixel_h)
+        self.canvas.config(scrollregion=(0, 0, pixel_w, pixel_h))
         
-        self.tk_bg_img = ImageTk.PhotoImage(self.current_pdf_img.resize((display_w, display_h), Image.Resampling.LANCZOS))
-        self.canvas.delete("all")
+        if needs_tiles(pixel_w, pixel_h):
+            # 大幅面页面：只渲染当前可见的瓦片，滚动时再补齐
+            self.current_pdf_img = None
+            self.update_visible_tiles()
+            return True
+        
+        # 先查渲染缓存，翻回看过的页面、已预取的相邻页面或用过的缩放级别时无需重新渲染
+        item = self.page_cache.get(key)
+        if item is None:
+            item = render_page(self.current_doc, self.current_page_idx, dpi)
+            self.page_cache.put(key, item)
+        self.current_pdf_img = item[0]
+        self.tk_bg_img = ImageTk.PhotoImage(self.current_pdf_img)
         self.canvas.create_image(0, 0, image=self.tk_bg_img, tags="background", anchor="nw")
-        self.canvas.config(scrollregion=(0, 0, display_w, display_h))
+        self.canvas.tag_lower("background")
+        return True
+
+    def update_visible_tiles(self):
+        self._tile_update_pending = False
+        if not self.current_doc or self.bg_key is None or self.tk_bg_img is not None: return
+        if not try_acquire_render_lock():
+            self._tile_update_pending = True
+            self.root.after(RENDER_RETRY_MS, self.update_visible_tiles)
+            return
+        try:
+            self._update_visible_tiles()
+        finally:
+            RENDER_LOCK.release()
+
+    def _update_visible_tiles(self):
+        # 调用方已持有 RENDER_LOCK
+        path, page_idx, dpi = self.bg_key
+        x0, y0 = self.canvas.canvasx(0), self.canvas.canvasy(0)
+        x1, y1 = x0 + self.canvas.winfo_width(), y0 + self.canvas.winfo_height()
+        visible = {(tx, ty) for tx in range(max(0, int(x0 // TILE_SIZE)), int(x1 // TILE_SIZE) + 1)
+                            for ty in range(max(0, int(y0 // TILE_SIZE)), int(y1 // TILE_SIZE) + 1)}
         
-        self.tk_wm_images = []
+        # 移出视野的瓦片从画布上删除，位图仍留在缓存中
+        for tx, ty in [t for t in self.bg_tiles if t not in visible]:
+            self.canvas.delete(f"tile_{tx}_{ty}")
+            del self.bg_tiles[(tx, ty)]
+        
+        added = False
+        for tx, ty in sorted(visible - set(self.bg_tiles)):
+            if tx * TILE_SIZE >= self.bg_pixel_size[0] or ty * TILE_SIZE >= self.bg_pixel_size[1]: continue
+            key = (path, page_idx, dpi, "tile", tx, ty)
+            item = self.page_cache.get(key)
+            if item is None:
+                item = render_tile(self.current_doc, page_idx, dpi, tx, ty)
+                self.page_cache.put(key, item)
+            self.bg_tiles[(tx, ty)] = ImageTk.PhotoImage(item[0])
+            self.canvas.create_image(tx * TILE_SIZE, ty * TILE_SIZE, image=self.bg_tiles[(tx, ty)],
+                                     tags=("background", f"tile_{tx}_{ty}"), anchor="nw")
+            added = True
+        if added: self.canvas.tag_lower("background")
+
+    def schedule_render_retry(self):
+        """渲染锁被批处理占用时，RENDER_RETRY_MS 毫秒后重绘预览（多次请求合并为一次）"""
+        if self._render_retry_job is None:
+            self._render_retry_job = self.root.after(RENDER_RETRY_MS, self._retry_render)
+
+    def _retry_render(self):
+        self._render_retry_job = None
+        self.update_preview()
 
-        for i, wm in enumerate(self.watermarks):
-            tag = f"wm_{i}"
+    def schedule_tile_update(self):
+        if self.tk_bg_img is None and not self._tile_update_pending:
+            self._tile_update_pending = True
+            self.root.after_idle(self.update_visible_tiles)
+
+    def on_canvas_xscroll(self, *args):
+        self.h_scroll.set(*args)
+        self.schedule_tile_update()
+
+    def on_canvas_yscroll(self, *args):
+        self.v_scroll.set(*args)
+        self.schedule_tile_update()
+
+    def schedule_preview(self, wm_idx=None):
+        """登记需要重绘的水印（为空表示全部），同一帧内的多次变化合并为一次重绘"""
+        if wm_idx is None or wm_idx < 0: self._dirty_wms = None
+        elif self._dirty_wms is not None: self._dirty_wms.add(wm_idx)
+        if self._redraw_job is None:
+            self._redraw_job = self.root.after(FRAME_MS, self.flush_preview)
+
+    def flush_preview(self):
+        self._redraw_job = None
+        self.update_preview(self._dirty_wms)
+
+    def update_preview(self, wm_indices=None):
+        """重绘预览；wm_indices 给出时只重建这些水印的画布对象，其余对象保持不动"""
+        if self._redraw_job is not None:
+            self.root.after_cancel(self._redraw_job)
+            self._redraw_job = None
+        self._dirty_wms = set()
+        if not self.current_doc: return
+        t0 = time.perf_counter()
+        
+        # 背景变化（换页、缩放）时所有水印的画布坐标都要重算
+        if self.update_background() or wm_indices is None:
+            self.canvas.delete("watermark")
+            self.tk_wm_images = {}
+            wm_indices = range(len(self.watermarks))
+        for i in sorted(wm_indices):
+            if i < len(self.watermarks): self.draw_watermark(i)
+        self.draw_selection()
+        
+        ms = (time.perf_counter() - t0) * 1000
+        st = self.redraw_stats
+        st["count"] += 1
+        st["total_ms"] += ms
+        st["last_ms"] = ms
+        st["max_ms"] = max(st["max_ms"], ms)
+        self.redraw_time_var.set(f"重绘 {ms:.1f} ms")
+
+    def get_wm_sprite(self, wm, size, fast=False):
+        """返回图片水印的 PhotoImage；fast 为 True 时由缓存的小底图快速变换，不进入缓存"""
+        img = wm['img_obj']
+        if fast:
+            base_key = ("base", id(img), round(wm['opacity'], 3))
+            item = self.sprite_cache.get(base_key)
+            if item is None:
+                item = (make_sprite_base(img, wm['opacity']), None, img)
+                self.sprite_cache.put(base_key, item)
+            return ImageTk.PhotoImage(make_fast_sprite(item[0], size, wm['angle']))
+        
+        return self._sprite_item(wm, size)[1]
+
+    def _sprite_item(self, wm, size):
+        img = wm['img_obj']
+        key = (id(img), size, wm['angle'], round(wm['opacity'], 3))
+        item = self.sprite_cache.get(key)
+        if item is None:
+            sprite = make_sprite(img, size, wm['angle'], wm['opacity'])
+            item = (sprite, ImageTk.PhotoImage(sprite), img)
+            self.sprite_cache.put(key, item)
+        return item
+
+    def get_grid_overlay(self, wm, size, centers):
+        """阵列水印合成为一张整页透明图层，参数和页面不变时直接取缓存"""
+        key = ("grid", id(wm['img_obj']), size, wm['angle'], round(wm['opacity'], 3),
+               self.bg_pixel_size, tuple(centers))
+        item = self.sprite_cache.get(key)
+        if item is None:
+            overlay = composite_grid(self._sprite_item(wm, size)[0], centers, self.bg_pixel_size)
+            item = (overlay, ImageTk.PhotoImage(overlay), wm['img_obj'])
+            self.sprite_cache.put(key, item)
+        return item[1]
+
+    def draw_watermark(self, i, fast=False):
+        wm = self.watermarks[i]
+        tag = f"wm_{i}"
+        layer = f"layer_{i}" # 该水印的全部画布对象，含阵列合成图层
+        grid_tag = f"wmgrid_{i}"
+        # 拖动手柄时只更新锚点格，阵列图层保留到松开鼠标
+        self.canvas.delete(tag if fast else layer)
+        if not fast: self.tk_wm_images.pop(grid_tag, None)
+        self.tk_wm_images.pop(i, None)
+        
+        # 绘制位置 (阵列模式或单点模式) 与导出共用同一布局，页面外的格点已剔除
+        if wm['type'] == 'image':
+            # 渲染图片水印
+            wm_scale = wm['scale']
+            wm_w = int(wm['img_obj'].width * wm_scale * self.pt_to_canvas_scale)
+            wm_h = int(wm['img_obj'].height * wm_scale * self.pt_to_canvas_scale)
+            positions = wm_positions(self.vis_pdf_w, self.vis_pdf_h, wm,
+                                     wm['img_obj'].width * wm_scale, wm['img_obj'].height * wm_scale, wm['angle'])
             
-            # 计算绘制位置 (阵列模式或单点模式)
-            positions = []
-            if wm.get('grid_mode'):
-                # 阵列模式：铺满全屏
-                gap_x = wm.get('grid_gap_x', 150)
-                gap_y = wm.get('grid_gap_y', 150)
-                # 从 -gap 开始，确保边缘也被覆盖
-                for cur_x in range(0, int(self.vis_pdf_w + gap_x), int(gap_x)):
-                    for cur_y in range(0, int(self.vis_pdf_h + gap_y), int(gap_y)):
-                        positions.append((cur_x, cur_y))
-            else:
-                # 单点模式
-                positions.append((wm['x'], wm['y']))
-
-            if wm['type'] == 'image':
-                # 渲染图片水印
-                wm_scale = wm['scale']
-                wm_w = int(wm['img_obj'].width * wm_scale * self.pt_to_canvas_scale)
-                wm_h = int(wm['img_obj'].height * wm_scale * self.pt_to_canvas_scale)
+            if wm_w > 0 and wm_h > 0:
+                # 贴图按 (图片, 像素尺寸, 角度, 透明度) 缓存，像素尺寸已包含预览缩放
+                tk_img = self.get_wm_sprite(wm, (wm_w, wm_h), fast)
+                self.tk_wm_images[i] = tk_img # 保持引用
+                centers = [(pos_x * self.pt_to_canvas_scale, (self.vis_pdf_h - pos_y) * self.pt_to_canvas_scale)
+                           for pos_x, pos_y in positions]
                 
-                if wm_w > 0 and wm_h > 0:
-                    wm_edit = wm['img_obj'].resize((wm_w, wm_h), Image.Resampling.LANCZOS).rotate(wm['angle'], expand=True)
-                    alpha = wm['opacity']
-                    r, g, b, a = wm_edit.split()
-                    wm_edit.putalpha(ImageEnhance.Brightness(a).enhance(alpha))
-                    tk_img = ImageTk.PhotoImage(wm_edit)
-                    self.tk_wm_images.append(tk_img) # 保持引用
-                    
-                    for pos_x, pos_y in positions:
-                        vx = pos_x * self.pt_to_canvas_scale
-                        vy = (self.vis_pdf_h - pos_y) * self.pt_to_canvas_scale
-                        self.canvas.create_image(vx, vy, image=tk_img, tags=("watermark", tag))
-            else:
-                # 渲染文字水印
-                font_size = int(30 * wm['scale'] * self.pt_to_canvas_scale)
-                for pos_x, pos_y in positions:
-                    vx = pos_x * self.pt_to_canvas_scale
-                    vy = (self.vis_pdf_h - pos_y) * self.pt_to_canvas_scale
-                    self.canvas.create_text(vx, vy, text=wm['content'], font=(wm.get('font', 'Arial'), font_size), 
-                                           fill=wm.get('color', '#FF0000'), angle=wm['angle'], 
-                                           stipple="gray50" if wm['opacity'] < 0.8 else "", 
-                                           tags=("watermark", tag))
-            
-            if i == self.selected_wm_idx:
-                bbox = self.canvas.bbox(tag)
-                if bbox:
-                    # 绘制选择框
-                    self.canvas.create_rectangle(bbox, outline="red", dash=(4,4), tags="selection_box")
-                    
-                    # 只为图片水印添加交互手柄
-                    if wm['type'] == 'image':
-                        x1, y1, x2, y2 = bbox
-                        # 1. 缩放手柄 (右下角)
-                        self.canvas.create_rectangle(x2-5, y2-5, x2+5, y2+5, fill="#007bff", outline="white", tags=("handle", "handle_resize"))
-                        # 2. 旋转手柄 (正上方延伸)
-                        mid_x = (x1 + x2) / 2
-                        self.canvas.create_line(mid_x, y1, mid_x, y1-20, fill="#28a745", tags="handle")
-                        self.canvas.create_oval(mid_x-6, y1-26, mid_x+6, y1-14, fill="#28a745", outline="white", tags=("handle", "handle_rotate"))
+                if wm.get('grid_mode') and len(centers) > 1 and self.tk_bg_img is not None:
+                    # 阵列：离页面中心最近的一格作为锚点，单独成为可点选、带手柄的对象；
+                    # 其余格合成到一张图层上，画布对象数不随格数增长。瓦片模式的大幅面页面不合成。
+                    mid_x, mid_y = self.bg_pixel_size[0] / 2, self.bg_pixel_size[1] / 2
+                    anchor = min(range(len(centers)), key=lambda k: (centers[k][0] - mid_x) ** 2 + (centers[k][1] - mid_y) ** 2)
+                    if not (fast and self.canvas.find_withtag(grid_tag)):
+                        overlay = self.get_grid_overlay(wm, (wm_w, wm_h), centers[:anchor] + centers[anchor+1:])
+                        self.tk_wm_images[grid_tag] = overlay
+                        self.canvas.create_image(0, 0, image=overlay, anchor="nw", tags=("watermark", grid_tag, layer))
+                    centers = [centers[anchor]]
+                
+                for vx, vy in centers:
+                    self.canvas.create_image(vx, vy, image=tk_img, tags=("watermark", tag, layer))
+        else:
+            # 渲染文字水印
+            font_size = int(30 * wm['scale'] * self.pt_to_canvas_scale)
+            size = text_stamp_size(wm['content'], 30 * wm['scale'])
+            positions = wm_positions(self.vis_pdf_w, self.vis_pdf_h, wm, size, size)
+            for pos_x, pos_y in positions:
+                vx = pos_x * self.pt_to_canvas_scale
+                vy = (self.vis_pdf_h - pos_y) * self.pt_to_canvas_scale
+                self.canvas.create_text(vx, vy, text=wm['content'], font=(wm.get('font', 'Arial'), font_size), 
+                                       fill=wm.get('color', '#FF0000'), angle=wm['angle'], 
+                                       stipple="gray50" if wm['opacity'] < 0.8 else "", 
+                                       tags=("watermark", tag, layer))
+        
+        # 重建的对象会排到最上层，需放回后一个水印之下以保持叠放顺序
+        if i + 1 < len(self.watermarks) and self.canvas.find_withtag(f"layer_{i+1}"):
+            self.canvas.tag_lower(layer, f"layer_{i+1}")
+
+    def draw_selection(self):
+        self.canvas.delete("selection_box", "handle")
+        if not 0 <= self.selected_wm_idx < len(self.watermarks): return
+        bbox = self.canvas.bbox(f"wm_{self.selected_wm_idx}")
+        if not bbox: return
+        # 绘制选择框
+        self.canvas.create_rectangle(bbox, outline="red", dash=(4,4), tags="selection_box")
+        
+        # 只为图片水印添加交互手柄
+        if self.watermarks[self.selected_wm_idx]['type'] == 'image':
+            x1, y1, x2, y2 = bbox
+            # 1. 缩放手柄 (右下角)
+            self.canvas.create_rectangle(x2-5, y2-5, x2+5, y2+5, fill="#007bff", outline="white", tags=("handle", "handle_resize"))
+            # 2. 旋转手柄 (正上方延伸)
+            mid_x = (x1 + x2) / 2
+            self.canvas.create_line(mid_x, y1, mid_x, y1-20, fill="#28a745", tags="handle")
+            self.canvas.create_oval(mid_x-6, y1-26, mid_x+6, y1-14, fill="#28a745", outline="white", tags=("handle", "handle_rotate"))
 
     def on_drag_start(self, e):
         cx = self.canvas.canvasx(e.x)
@@ -517,9 +841,9 @@ class AdvancedWatermarkApp:
                     return
                 elif "handle_rotate" in tags:
                     self.active_handle = "rotate"
-                    wm = self.watermarks[self.selected_wm_idx]
-                    vx = wm['x'] * self.pt_to_canvas_scale
-                    vy = (self.vis_pdf_h - wm['y']) * self.pt_to_canvas_scale
+                    # 以画布上选中对象的中心为轴：阵列模式下手柄画在锚点格上，而不是 wm['x'], wm['y'] 处
+                    x1, y1, x2, y2 = self.canvas.bbox(f"wm_{self.selected_wm_idx}")
+                    vx, vy = (x1 + x2) / 2, (y1 + y2) / 2
                     self._drag_data["center_x"] = vx
                     self._drag_data["center_y"] = vy
                     self._drag_data["start_angle"] = math.degrees(math.atan2(cy - vy, cx - vx))
@@ -561,17 +885,9 @@ class AdvancedWatermarkApp:
             # 仅更新滑块数值显示
             self.scale_var.set(round(new_scale, 2))
             
-            # 实时更新手柄位置，让用户看到反馈
-            self.canvas.delete("handle")
-            self.canvas.delete("selection_box")
-            bbox = self.canvas.bbox(tag)
-            if bbox:
-                x1, y1, x2, y2 = bbox
-                self.canvas.create_rectangle(bbox, outline="red", dash=(4,4), tags="selection_box")
-                self.canvas.create_rectangle(x2-5, y2-5, x2+5, y2+5, fill="#007bff", outline="white", tags=("handle", "handle_resize"))
-                mid_x = (x1 + x2) / 2
-                self.canvas.create_line(mid_x, y1, mid_x, y1-20, fill="#28a745", tags="handle")
-                self.canvas.create_oval(mid_x-6, y1-26, mid_x+6, y1-14, fill="#28a745", outline="white", tags=("handle", "handle_rotate"))
+            # 用低质量贴图实时显示新尺寸，松开鼠标后再高质量重绘
+            self.draw_watermark(self.selected_wm_idx, fast=True)
+            self.draw_selection()
             
         elif self.active_handle == "rotate":
             dx = cx - self._drag_data["center_x"]
@@ -582,22 +898,14 @@ class AdvancedWatermarkApp:
             wm['angle'] = int(new_angle)
             self.angle_var.set(int(new_angle))
             
-            # 实时更新旋转手柄位置
-            self.canvas.delete("handle")
-            self.canvas.delete("selection_box")
-            bbox = self.canvas.bbox(tag)
-            if bbox:
-                x1, y1, x2, y2 = bbox
-                self.canvas.create_rectangle(bbox, outline="red", dash=(4,4), tags="selection_box")
-                self.canvas.create_rectangle(x2-5, y2-5, x2+5, y2+5, fill="#007bff", outline="white", tags=("handle", "handle_resize"))
-                mid_x = (x1 + x2) / 2
-                self.canvas.create_line(mid_x, y1, mid_x, y1-20, fill="#28a745", tags="handle")
-                self.canvas.create_oval(mid_x-6, y1-26, mid_x+6, y1-14, fill="#28a745", outline="white", tags=("handle", "handle_rotate"))
+            # 实时显示旋转效果并更新手柄位置
+            self.draw_watermark(self.selected_wm_idx, fast=True)
+            self.draw_selection()
             
         elif self.active_handle == "move":
             dx, dy = cx - self._drag_data["x"], cy - self._drag_data["y"]
             tag = f"wm_{self.selected_wm_idx}"
-            self.canvas.move(tag, dx, dy)
+            self.canvas.move(f"layer_{self.selected_wm_idx}", dx, dy)
             self.canvas.move("selection_box", dx, dy)
             self.canvas.move("handle", dx, dy)
             
@@ -612,9 +920,9 @@ class AdvancedWatermarkApp:
             self._drag_data["y"] = cy
 
     def on_drag_stop(self, e):
-        # 拖拽结束，进行一次完整重绘以确保质量
+        # 拖拽结束，重绘该水印以确保质量
         if self.active_handle in ["resize", "rotate", "move"]:
-            self.update_preview()
+            self.update_preview({self.selected_wm_idx})
         self.active_handle = None
 
     # --- 后续通用方法 (复用之前的逻辑) ---
@@ -629,36 +937,92 @@ class AdvancedWatermarkApp:
     def select_pdfs(self):
         files = filedialog.askopenfilenames(filetypes=[("PDF Files", "*.pdf")])
         if files:
-            self.pdf_files = list(files)
-            self.current_pdf_idx = 0
-            self.update_file_info_label()
-            self.load_pdf_doc(self.pdf_files[0])
+            self.set_input_source(PdfWalker(files))
+
+    def select_pdf_folder(self):
+        folder = filedialog.askdirectory()
+        if not folder: return
+        split = lambda text: [p.strip() for p in text.replace("，", ",").split(",") if p.strip()]
+        # 这里的跳过规则只用于预览和计数；开始处理时按当时的输出设置重新生成
+        output_dir, suffix = self.output_dir_var.get(), self.output_suffix_var.get()
+        self.set_input_source(PdfWalker([folder], self.recursive_var.get(), split(self.include_var.get()),
+                                        split(self.exclude_var.get()),
+                                        skip=lambda p: is_output_path(p, output_dir, suffix)))
+
+    def set_input_source(self, source):
+        """切换输入：只取出第一个文件用于预览，文件总数在后台统计，不在界面中列出全部文件"""
+        cursor = PathCursor(source)
+        first = cursor.get(0)
+        if first is None:
+            messagebox.showwarning("提示", "没有找到符合条件的 PDF 文件")
+            return
+        self.input_source, self.file_cursor = source, cursor
+        self.current_pdf_idx = 0
+        self.input_count = len(source.inputs) if source.is_listing else None
+        if self.input_count is None:
+            threading.Thread(target=self._count_inputs, args=(source,), daemon=True).start()
+            self.root.after(POLL_INTERVAL_MS, self._poll_input_count, source)
+        self.update_file_info_label()
+        self.load_pdf_doc(first)
+
+    def _count_inputs(self, source):
+        # 后台线程：独立遍历一次，只计数不保存路径
+        source.counted = source.count()
+
+    def _poll_input_count(self, source):
+        if source is not self.input_source: return # 已切换到其他输入
+        if getattr(source, "counted", None) is None:
+            self.root.after(POLL_INTERVAL_MS * 5, self._poll_input_count, source)
+            return
+        self.input_count = source.counted
+        self.update_file_info_label()
 
     def update_file_info_label(self):
-        if self.pdf_files:
-            fname = os.path.basename(self.pdf_files[self.current_pdf_idx])
-            self.lbl_pdf_info.config(text=f"文件 ({self.current_pdf_idx + 1}/{len(self.pdf_files)}):\n{fname}", fg="blue")
+        if self.file_cursor:
+            fname = os.path.basename(self.file_cursor.get(self.current_pdf_idx))
+            total = self.input_count if self.input_count is not None else f"{self.file_cursor.known}+ 统计中"
+            self.lbl_pdf_info.config(text=f"文件 ({self.current_pdf_idx + 1}/{total}):\n{fname}", fg="blue")
         else:
             self.lbl_pdf_info.config(text="未加载", fg="gray")
 
     def change_file(self, delta):
-        if not self.pdf_files: return
+        if not self.file_cursor: return
         new_idx = self.current_pdf_idx + delta
-        if 0 <= new_idx < len(self.pdf_files):
+        path = self.file_cursor.get(new_idx) if new_idx >= 0 else None
+        if path:
             self.current_pdf_idx = new_idx
             self.update_file_info_label()
-            self.load_pdf_doc(self.pdf_files[self.current_pdf_idx])
+            self.load_pdf_doc(path)
 
     def load_pdf_doc(self, path):
-        if self.current_doc: self.current_doc.close()
+        self._pending_doc_path = path
+        if not try_acquire_render_lock():
+            # 批处理线程正在调用 PyMuPDF：稍后再打开，期间只保留最后一次选择的文件
+            self.root.after(RENDER_RETRY_MS, self._retry_load_pdf_doc, path)
+            return
         try:
-            self.current_doc = fitz.open(path)
+            if self.current_doc: self.current_doc.close()
+            self.current_doc = None
+            try: self.current_doc = fitz.open(path)
+            except Exception as e: error = e
+            else: error = None
+        finally:
+            RENDER_LOCK.release()
+        if error is not None:
+            messagebox.showerror("错误", f"无法打开PDF: {error}")
+            return
+        try:
+            self.current_pdf_path = path
+            self.bg_key = None
             self.total_pages = self.current_doc.page_count
             self.current_page_idx = 0
             self.update_page_info_label()
             self.render_current_page_preview()
         except Exception as e: messagebox.showerror("错误", f"无法打开PDF: {e}")
 
+    def _retry_load_pdf_doc(self, path):
+        if path == self._pending_doc_path: self.load_pdf_doc(path)
+
     def update_page_info_label(self):
         self.page_info_var.set(f" / {self.total_pages}")
         self.entry_page.delete(0, tk.END); self.entry_page.insert(0, str(self.current_page_idx + 1))
@@ -678,13 +1042,11 @@ class AdvancedWatermarkApp:
 
     def render_current_page_preview(self):
         if not self.current_doc: return
-        page = self.current_doc.load_page(self.current_page_idx)
-        pix = page.get_pixmap(dpi=144)
-        self.current_pdf_img = Image.open(BytesIO(pix.tobytes("ppm")))
-        rot = page.rotation
-        rect = page.rect
-        self.vis_pdf_w, self.vis_pdf_h = (rect.height, rect.width) if rot % 180 == 90 else (rect.width, rect.height)
         self.update_preview()
+        
+        # 按当前缩放级别后台预取前后两页（渲染锁被占用时背景尚未更新，不能取 bg_key）
+        self.prefetcher.request(self.current_pdf_path, [self.current_page_idx + 1, self.current_page_idx - 1],
+                                zoom_to_dpi(self.preview_zoom_var.get()))
 
     def pick_color(self):
         color = colorchooser.askcolor(initialcolor=self.wm_color_var.get())[1]
@@ -706,7 +1068,7 @@ class AdvancedWatermarkApp:
             temp_wms.append(w)
             
         if not hasattr(self, 'all_templates'): self.all_templates = {}
-        self.all_templates[name] = temp_wms
+        self.all_templates[name] = {"watermarks": temp_wms, "save_profile": self.save_profile_var.get()}
         self.update_template_cb()
         messagebox.showinfo("成功", f"模板 '{name}' 已保存")
 
@@ -714,8 +1076,12 @@ class AdvancedWatermarkApp:
         name = self.cb_templates.get()
         if not name or name not in self.all_templates: return
         
+        template = normalize_template(self.all_templates[name])
+        if template.get("save_profile") in SAVE_PROFILES:
+            self.save_profile_var.set(template["save_profile"])
+        
         self.watermarks = []
-        for w_data in self.all_templates[name]:
+        for w_data in template["watermarks"]:
             w = w_data.copy()
             if w['type'] == 'image' and os.path.exists(w['path']):
                 w['img_obj'] = Image.open(w['path']).convert("RGBA")
@@ -751,6 +1117,9 @@ class AdvancedWatermarkApp:
                 "grid_mode": False,
                 "grid_gap_x": 150,
                 "grid_gap_y": 150,
+                "grid_offset_x": 0,
+                "grid_offset_y": 0,
+                "grid_stagger": False,
                 "img_obj": Image.open(f).convert("RGBA")
             }
             self.watermarks.append(wm)
@@ -770,6 +1139,9 @@ class AdvancedWatermarkApp:
             "grid_mode": False,
             "grid_gap_x": 150,
             "grid_gap_y": 150,
+            "grid_offset_x": 0,
+            "grid_offset_y": 0,
+            "grid_stagger": False,
             "color": "#FF0000",
             "font": "Arial"
         }
@@ -804,6 +1176,9 @@ class AdvancedWatermarkApp:
         self.grid_mode_var.set(wm.get('grid_mode', False))
         self.grid_gap_x_var.set(wm.get('grid_gap_x', 150))
         self.grid_gap_y_var.set(wm.get('grid_gap_y', 150))
+        self.grid_offset_x_var.set(wm.get('grid_offset_x', 0))
+        self.grid_offset_y_var.set(wm.get('grid_offset_y', 0))
+        self.grid_stagger_var.set(wm.get('grid_stagger', False))
         
         if wm['type'] == 'image':
             self.watermark_path.set(wm['path'])
@@ -828,18 +1203,23 @@ class AdvancedWatermarkApp:
         wm['grid_mode'] = self.grid_mode_var.get()
         wm['grid_gap_x'] = self.grid_gap_x_var.get()
         wm['grid_gap_y'] = self.grid_gap_y_var.get()
+        wm['grid_offset_x'] = self.grid_offset_x_var.get()
+        wm['grid_offset_y'] = self.grid_offset_y_var.get()
+        wm['grid_stagger'] = self.grid_stagger_var.get()
         if wm['type'] == 'text':
             wm['content'] = self.wm_text_var.get()
             wm['color'] = self.wm_color_var.get()
             wm['font'] = self.wm_font_var.get()
         
-        # 更新列表显示名
+        # 更新列表显示名（仅在名称变化时）
         name = f"图: {os.path.basename(wm['path'])}" if wm['type'] == 'image' else f"文: {wm['content']}"
-        self.wm_listbox.delete(self.selected_wm_idx)
-        self.wm_listbox.insert(self.selected_wm_idx, name)
-        self.wm_listbox.selection_set(self.selected_wm_idx)
+        if self.wm_listbox.get(self.selected_wm_idx) != name:
+            self.wm_listbox.delete(self.selected_wm_idx)
+            self.wm_listbox.insert(self.selected_wm_idx, name)
+            self.wm_listbox.selection_set(self.selected_wm_idx)
         
-        self.update_preview()
+        # 滑块拖动和连续输入只登记变化，下一帧统一重绘这一个水印
+        self.schedule_preview(self.selected_wm_idx)
 
     def select_watermark(self):
         f = filedialog.askopenfilename(filetypes=[("Images", "*.png *.jpg *.jpeg")])
@@ -895,6 +1275,16 @@ class AdvancedWatermarkApp:
                     self.custom_range_var.set(data.get("custom_range", ""))
                     self.output_dir_var.set(data.get("output_dir", "原文件目录"))
                     self.output_suffix_var.set(data.get("output_suffix", "_marked"))
+                    self.workers_var.set(data.get("workers", 1))
+                    self.shard_threshold_var.set(data.get("shard_threshold", DEFAULT_SHARD_THRESHOLD))
+                    self.shared_stamp_var.set(data.get("shared_stamp", False))
+                    self.image_dpi_var.set(data.get("image_dpi", "原始"))
+                    self.image_format_var.set(data.get("image_format", "PNG"))
+                    self.save_profile_var.set(data.get("save_profile", DEFAULT_SAVE_PROFILE))
+                    self.output_mode_var.set(data.get("output_mode", "rewrite"))
+                    self.resume_var.set(data.get("resume", False))
+                    self.memory_limit_var.set(data.get("memory_limit_mb", 0))
+                    self.preview_cache_mb = data.get("preview_cache_mb", DEFAULT_PAGE_CACHE_MB)
                     self.all_templates = data.get("templates", {})
                     self.update_template_cb()
             except: pass
@@ -909,6 +1299,16 @@ class AdvancedWatermarkApp:
             "custom_range": self.custom_range_var.get(),
             "output_dir": self.output_dir_var.get(),
             "output_suffix": self.output_suffix_var.get(),
+            "workers": self.workers_var.get(),
+            "shard_threshold": self.shard_threshold_var.get(),
+            "shared_stamp": self.shared_stamp_var.get(),
+            "image_dpi": self.image_dpi_var.get(),
+            "image_format": self.image_format_var.get(),
+            "save_profile": self.save_profile_var.get(),
+            "output_mode": self.output_mode_var.get(),
+            "resume": self.resume_var.get(),
+            "memory_limit_mb": self.memory_limit_var.get(),
+            "preview_cache_mb": self.preview_cache_mb,
             "templates": getattr(self, 'all_templates', {})
         }
         try:
@@ -917,162 +1317,185 @@ class AdvancedWatermarkApp:
         except: pass
 
     def on_closing(self):
-        if self.current_doc: self.current_doc.close()
+        self.prefetcher.close()
+        # 批处理仍在运行时不久等，文档随进程退出释放
+        if RENDER_LOCK.acquire(timeout=1):
+            try:
+                if self.current_doc: self.current_doc.close()
+            finally:
+                RENDER_LOCK.release()
         self.save_config()
         self.root.destroy()
 
     def start_processing_thread(self):
-        if not self.pdf_files or not self.watermark_path.get():
+        if not self.input_source or not self.watermark_path.get():
             messagebox.showwarning("提示", "请先选择PDF文件和水印图片")
             return
+        if self.output_mode_var.get() == "inplace" and \
+           not messagebox.askyesno("确认", "inplace 模式会直接修改原文件，确定继续吗？"):
+            return
         self.btn_run.config(state="disabled")
-        threading.Thread(target=self.process_files, daemon=True).start()
-
-    def hex_to_rgb(self, hex_color):
-        hex_color = hex_color.lstrip('#')
-        return tuple(int(hex_color[i:i+2], 16)/255.0 for i in (0, 2, 4))
-
-    def get_pdf_font_name(self, font_family, text):
-        # 检查是否包含中文字符，若包含则强制使用内置中文字库防止模糊或乱码
-        has_chinese = any('\u4e00' <= char <= '\u9fff' for char in text)
-        if has_chinese:
-            return "china-s"
-            
-        mapping = {
-            "Arial": "helv",
-            "Helvetica": "helv",
-            "Times New Roman": "tirom",
-            "Courier New": "cour",
-            "Verdana": "helv",
-            "Georgia": "tirom"
-        }
-        return mapping.get(font_family, "helv")
+        self.btn_pause.config(state="normal", text="⏸ 暂停")
+        self.btn_cancel.config(state="normal")
+        self.progress["value"] = 0
+        self.plan_var.set("")
+        try: memory_limit = self.memory_limit_var.get()
+        except: memory_limit = 0
+        if memory_limit > 0:
+            # 限制内存时先释放预览占用的页面位图和水印贴图，翻页时会按需重新渲染
+            self.page_cache.clear()
+            self.sprite_cache.clear()
+        # 处理线程只向事件流写入进度，界面控件全部在主循环中更新
+        self.reporter = ProgressReporter(self.input_count)
+        self.job_control = JobControl()
+        threading.Thread(target=self.process_files, args=(self.reporter, self.job_control), daemon=True).start()
+        self.root.after(POLL_INTERVAL_MS, self.poll_progress)
+
+    def toggle_pause(self):
+        if self.job_control.paused:
+            self.job_control.resume()
+            self.btn_pause.config(text="⏸ 暂停")
+            self.status_var.set("继续处理...")
+        else:
+            self.job_control.pause()
+            self.btn_pause.config(text="▶ 继续")
+            self.status_var.set("已暂停（当前页面完成后停下）")
 
-    def process_files(self):
-        # 预编译所有水印数据
-        processed_wms = []
-        for wm in self.watermarks:
-            if wm['type'] == 'image':
-                # 图片水印预处理：不再预先 resize，保留原始分辨率以防模糊
-                wm_pil = wm['img_obj'].copy()
-                ws, wa, wo = wm['scale'], wm['angle'], wm['opacity']
-                
-                # 使用高质量的双三次插值进行旋转
-                wm_pil = wm_pil.rotate(wa, expand=True, resample=Image.Resampling.BICUBIC)
-                
-                r, g, b, a = wm_pil.split()
-                wm_pil.putalpha(ImageEnhance.Brightness(a).enhance(wo))
-                
-                img_byte_arr = BytesIO()
-                wm_pil.save(img_byte_arr, format='PNG', optimize=True)
-                
-                processed_wms.append({
-                    "type": "image",
-                    "data": img_byte_arr.getvalue(),
-                    "display_w": wm_pil.width * ws,
-                    "display_h": wm_pil.height * ws,
-                    "x": wm['x'],
-                    "y": wm['y'],
-                    "grid_mode": wm.get('grid_mode', False),
-                    "grid_gap_x": wm.get('grid_gap_x', 150),
-                    "grid_gap_y": wm.get('grid_gap_y', 150)
-                })
+    def cancel_processing(self):
+        if not messagebox.askyesno("确认", "确定要取消批量处理吗？已完成的文件会保留，正在处理的文件不会写出。"):
+            return
+        self.job_control.cancel()
+        self.btn_pause.config(state="disabled")
+        self.btn_cancel.config(state="disabled")
+        self.status_var.set("正在取消...")
+
+    def poll_progress(self):
+        for ev in self.reporter.drain():
+            if ev["type"] == "status":
+                if ev.get("plan"): self.plan_var.set(ev["text"])
+                else: self.status_var.set(ev["text"])
+            elif ev["type"] == "finished":
+                self.btn_run.config(state="normal")
+                self.btn_pause.config(state="disabled", text="⏸ 暂停")
+                self.btn_cancel.config(state="disabled")
+                if ev.get("error"):
+                    self.status_var.set(ev["error"])
+                    return
+                lines = [f"成功处理 {ev['count']} 个文件"]
+                if ev["failed"]: lines.append(f"失败 {ev['failed']} 个")
+                if ev["files_skipped"]: lines.append(f"跳过已完成 {ev['files_skipped']} 个")
+                if ev["failed"] and ev.get("report"): lines.append(f"失败原因见运行报告: {ev['report']}")
+                if ev["cancelled"]:
+                    if ev["total_files"] is None: lines.append("其余文件未处理")
+                    else: lines.append(f"取消后未处理 {ev['total_files'] - ev['count'] - ev['failed'] - ev['files_skipped']} 个")
+                    self.status_var.set("已取消")
+                    messagebox.showinfo("已取消", "\n".join(lines))
+                else:
+                    self.progress["value"] = 100
+                    self.status_var.set("处理完成")
+                    messagebox.showinfo("完成", "，".join(lines))
+                return
             else:
-                # 文字水印 (使用 PyMuPDF 的 insert_text)
-                processed_wms.append({
-                    "type": "text",
-                    "content": wm['content'],
-                    "size": 30 * wm['scale'],
-                    "opacity": wm['opacity'],
-                    "angle": wm['angle'],
-                    "color": self.hex_to_rgb(wm.get('color', '#FF0000')),
-                    "font": self.get_pdf_font_name(wm.get('font', 'Arial'), wm['content']),
-                    "x": wm['x'],
-                    "y": wm['y'],
-                    "grid_mode": wm.get('grid_mode', False),
-                    "grid_gap_x": wm.get('grid_gap_x', 150),
-                    "grid_gap_y": wm.get('grid_gap_y', 150)
-                })
+                if ev["type"] == "file_done" and ev["ok"]:
+                    # 记录最后一次导出的目录与生成的文件路径
+                    self.last_output_dir = os.path.dirname(ev["output"])
+                    self.last_output_path = ev["output"]
+                if ev["fraction"] is not None: self.progress["value"] = ev["fraction"] * 100
+                self.status_var.set(format_progress(ev))
+        self.root.after(POLL_INTERVAL_MS, self.poll_progress)
+
+    def process_files(self, reporter, control):
+        # 预编译所有水印数据
+        try: image_dpi = float(self.image_dpi_var.get())
+        except: image_dpi = None # "原始"：保留原始分辨率
+        report = RunReport(settings={"inputs": self.input_source.inputs, "image_dpi": image_dpi,
+                                     "image_format": self.image_format_var.get()})
+        try:
+            start = time.perf_counter()
+            processed_wms = prepare_watermarks(self.watermarks, self.asset_cache, image_dpi, self.image_format_var.get())
+            report.add_stage("prepare_seconds", time.perf_counter() - start)
+        except Exception as e:
+            reporter.finish(error=f"水印预处理失败: {e}")
+            return
 
         mode = self.range_mode_var.get()
         output_dir = self.output_dir_var.get()
         suffix = self.output_suffix_var.get()
-        custom = set()
-        # ... (custom 范围逻辑保持不变)
-        if mode == "指定页面":
-            try:
-                for p in self.custom_range_var.get().replace("，", ",").split(","):
-                    if "-" in p:
-                        a, b = p.split("-")
-                        custom.update(range(int(a), int(b)+1))
-                    elif p.strip(): custom.add(int(p))
-            except: pass
+        custom = parse_page_range(self.custom_range_var.get()) if mode == "指定页面" else set()
         
-        count = 0
-        for i, path in enumerate(self.pdf_files):
-            try:
-                self.status_var.set(f"正在处理: {os.path.basename(path)}")
-                doc = fitz.open(path)
-                for page_idx in range(len(doc)):
-                    if mode == "全部页面" or \
-                       (mode == "奇数页" and (page_idx+1)%2!=0) or \
-                       (mode == "偶数页" and (page_idx+1)%2==0) or \
-                       (mode == "指定页面" and (page_idx+1) in custom):
-                        page = doc.load_page(page_idx)
-                        page_w, page_h = page.rect.width, page.rect.height
-                        
-                        for pwm in processed_wms:
-                            # 计算所有要绘制的位置
-                            pos_list = []
-                            if pwm.get('grid_mode'):
-                                gx, gy = pwm['grid_gap_x'], pwm['grid_gap_y']
-                                for ix in range(0, int(page_w + gx), int(gx)):
-                                    for iy in range(0, int(page_h + gy), int(gy)):
-                                        pos_list.append((ix, iy))
-                            else:
-                                pos_list.append((pwm['x'], pwm['y']))
-
-                            for px, py in pos_list:
-                                if pwm['type'] == 'image':
-                                    # 保持原始分辨率的高质量插入
-                                    rect_x0 = px - pwm['display_w']/2
-                                    rect_y0 = (page_h - py) - pwm['display_h']/2
-                                    page.insert_image(fitz.Rect(rect_x0, rect_y0, rect_x0 + pwm['display_w'], rect_y0 + pwm['display_h']), 
-                                                   stream=pwm['data'])
-                                else:
-                                    # 插入矢量文字水印
-                                    page.insert_text((px, page_h - py), 
-                                                   pwm['content'], 
-                                                   fontsize=pwm['size'], 
-                                                   color=pwm['color'], 
-                                                   fontname=pwm['font'],
-                                                   rotate=pwm['angle'],
-                                                   fill_opacity=pwm['opacity'])
-                
-                # 计算保存路径
-                base_name = os.path.basename(os.path.splitext(path)[0])
-                final_name = base_name + suffix + ".pdf"
-                
-                if output_dir == "原文件目录":
-                    out_dir = os.path.dirname(path)
-                    save_path = os.path.join(out_dir, final_name)
-                else:
-                    out_dir = output_dir
-                    save_path = os.path.join(out_dir, final_name)
-                
-                # 记录最后一次导出的目录
-                self.last_output_dir = out_dir
-                
-                doc.save(save_path)
-                doc.close()
-                self.last_output_path = save_path # 记录最后生成的文件路径
-                count += 1
-            except Exception as e: print(f"失败: {e}")
-            self.progress["value"] = (i+1)/len(self.pdf_files)*100
+        try: workers = max(1, self.workers_var.get())
+        except: workers = 1
+        try: shard_threshold = max(1, self.shard_threshold_var.get())
+        except: shard_threshold = DEFAULT_SHARD_THRESHOLD
+        options = {"shared_stamp": self.shared_stamp_var.get(), "save_profile": self.save_profile_var.get(),
+                   "output_mode": self.output_mode_var.get()}
+        try: memory_limit = self.memory_limit_var.get()
+        except: memory_limit = 0
+        if memory_limit > 0: options["memory_limit"] = memory_limit * 1024 * 1024
+        report.settings.update(options, mode=mode, workers=workers, output_dir=output_dir, suffix=suffix)
         
-        self.status_var.set("处理完成")
-        self.btn_run.config(state="normal")
-        messagebox.showinfo("完成", f"成功处理 {count} 个文件")
+        journal = None
+        # 处理时重新遍历输入，遍历到的文件立即开始处理，遍历结束后补上总文件数
+        # 跳过的输出文件按当前的输出目录和后缀判断，选择文件夹之后修改过设置也不会给输出再加水印
+        paths = PdfWalker(self.input_source.inputs, self.input_source.recursive, self.input_source.include,
+                          self.input_source.exclude, skip=lambda p: is_output_path(p, output_dir, suffix),
+                          on_done=reporter.set_total)
+        is_listing = paths.is_listing
+        # 文件夹中的文件在输出目录中保留子目录结构
+        options["input_root"] = paths.output_root
+        if self.resume_var.get():
+            # 断点续跑：跳过内容和设置都未变、输出仍在的文件
+            journal = BatchJournal(DEFAULT_JOURNAL_FILE, job_hash(processed_wms, mode, custom, output_dir, suffix, options))
+            paths = journal.filter(paths, reporter.file_skipped)
+
+        # 选中的文件先预扫描页数、页面尺寸和体积，显示预计耗时；多进程时最大的文件先处理。
+        # 文件夹输入不预扫描，以免在开始处理前遍历整棵目录树
+        shard = ()
+        if is_listing:
+            reporter.status("正在预扫描文件...")
+            start = time.perf_counter()
+            paths = list(paths)
+            plan = plan_batch(paths, mode, custom, workers, shard_threshold,
+                              can_shard=options["output_mode"] == "rewrite", lock=RENDER_LOCK,
+                              processed_wms=processed_wms, shared_stamp=options["shared_stamp"])
+            report.add_stage("plan_seconds", time.perf_counter() - start)
+            reporter.status(f"计划: {format_plan(plan)}", plan=True)
+            if workers > 1:
+                paths = [f["path"] for f in plan["files"]]
+                shard = plan["shard"]
+        
+        count = failed = 0
+        try:
+            if workers > 1:
+                # 多进程模式：结果按完成顺序返回，超大文件按页面分片并行
+                reporter.status(f"正在使用 {workers} 个进程处理...")
+                results = iter_batch_parallel(paths, processed_wms, mode, custom, output_dir, suffix,
+                                              workers=workers, shard_threshold=shard_threshold,
+                                              progress=reporter, control=control, shard=shard,
+                                              lock=RENDER_LOCK, **options)
+                lock = contextlib.nullcontext()
+            else:
+                # 单进程时在本线程中调用 PyMuPDF：全程持有渲染锁，每页之间让出给界面和预取线程
+                results = iter_batch(paths, processed_wms, mode, custom, output_dir, suffix,
+                                     progress=reporter, control=RenderLockedControl(control), **options)
+                lock = RENDER_LOCK
+            with lock:
+                for res in results:
+                    report.add(res)
+                    if res.get("cancelled"): continue
+                    if journal: journal.record(res)
+                    if res["ok"]: count += 1
+                    else: failed += 1
+        except Exception as e:
+            reporter.finish(error=f"处理出错: {e}")
+            return
+        finally:
+            if journal: journal.close()
+        # 失败原因和各阶段耗时写入运行报告，不再只打印到控制台
+        report.finish(journal.skipped if journal else 0, control.cancelled)
+        try: report_path = report.write_default()
+        except OSError: report_path = None
+        reporter.finish(count=count, failed=failed, cancelled=control.cancelled, report=report_path)
 
 if __name__ == "__main__":
     # --- Windows 高分屏 (DPI) 适配 ---
@@ -1083,4 +1506,11 @@ if __name__ == "__main__":
         pass
         
     root = tk.Tk(); app = AdvancedWatermarkApp(root)
+    if os.environ.get("PDF_WATERMARK_STARTUP_PROBE"):
+        # 基准测试用：窗口第一次绘制完成后输出启动耗时并退出
+        root.update()
+        print(json.dumps({"window_seconds": time.perf_counter() - _START}), flush=True)
+        app.prefetcher.close()
+        root.destroy()
+        sys.exit(0)
     root.mainloop()
\ No newline at end of file
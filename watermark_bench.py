@@ -0,0 +1,297 @@
+"""基准测试：在本地生成可复现的合成 PDF 语料，按标准场景测量加水印吞吐量、峰值内存和输出体积"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+import platform
+import subprocess
+import multiprocessing
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz  # PyMuPDF
+from PIL import Image, ImageDraw
+
+from watermark_engine import prepare_watermarks, iter_batch
+from watermark_report import RunReport, peak_rss_bytes
+
+DEFAULT_BENCH_DIR = os.path.join(os.path.expanduser("~"), ".pdf_watermark_bench")
+# 吞吐量下降或内存、体积增长超过此比例视为性能回退
+DEFAULT_THRESHOLD = 0.10
+# 语料生成方式改变时递增，已生成的语料随之失效
+CORPUS_VERSION = 1
+
+PAGE_SIZES = {"A4": (595, 842), "Letter": (612, 792), "A3": (842, 1191)}
+
+# 每组语料：文件数、每个文件的页数、页面尺寸、页面旋转角度、内容类型（vector 矢量文字 / scan 整页扫描图）
+CORPORA = {
+    "quick": [
+        {"name": "vector-a4", "files": 2, "pages": 20, "size": "A4", "rotation": 0, "content": "vector"},
+        {"name": "scan-letter", "files": 1, "pages": 5, "size": "Letter", "rotation": 0, "content": "scan"},
+        {"name": "rotated-a3", "files": 1, "pages": 10, "size": "A3", "rotation": 90, "content": "vector"},
+    ],
+    "standard": [
+        {"name": "vector-a4", "files": 20, "pages": 50, "size": "A4", "rotation": 0, "content": "vector"},
+        {"name": "vector-long", "files": 1, "pages": 1000, "size": "A4", "rotation": 0, "content": "vector"},
+        {"name": "scan-letter", "files": 5, "pages": 20, "size": "Letter", "rotation": 0, "content": "scan"},
+        {"name": "rotated-a3", "files": 5, "pages": 30, "size": "A3", "rotation": 90, "content": "vector"},
+        {"name": "rotated-scan", "files": 2, "pages": 20, "size": "A4", "rotation": 270, "content": "scan"},
+    ],
+}
+DEFAULT_CORPUS = "quick"
+
+# 文字水印用 insert_text 绘制，只支持 90 度的整数倍旋转
+_text_wm = {"type": "text", "content": "CONFIDENTIAL", "scale": 1.5, "angle": 90, "opacity": 0.3,
+            "color": "#FF0000", "font": "Arial", "x": 300, "y": 420}
+_image_wm = {"type": "image", "scale": 0.5, "angle": 30, "opacity": 0.4, "x": 300, "y": 420}
+_grid = {"grid_mode": True, "grid_gap_x": 160, "grid_gap_y": 120, "grid_stagger": True}
+
+# 标准场景：水印列表与模板格式相同，图片水印的 path 在运行时指向语料目录中生成的标志图
+SCENARIOS = {
+    "text": [_text_wm],
+    "image": [_image_wm],
+    "grid-text": [dict(_text_wm, scale=0.8, **_grid)],
+    "grid-image": [dict(_image_wm, scale=0.2, **_grid)],
+    "cjk-text": [dict(_text_wm, content="内部资料 严禁外传")],
+}
+
+# --- 语料生成 ---
+def _scan_image(w, h, rng):
+    """模拟扫描页：低分辨率噪声放大后的灰度 JPEG，体积和解码开销接近真实扫描件"""
+    small = Image.frombytes("L", (w // 4, h // 4), rng.randbytes((w // 4) * (h // 4)))
+    out = BytesIO()
+    small.resize((w, h), Image.Resampling.BILINEAR).save(out, format="JPEG", quality=60)
+    return out.getvalue()
+
+def _write_pdf(path, spec, seed):
+    rng = random.Random(seed)
+    w, h = PAGE_SIZES[spec["size"]]
+    doc = fitz.open()
+    try:
+        for i in range(spec["pages"]):
+            page = doc.new_page(width=w, height=h)
+            if spec["content"] == "scan":
+                # 约 100 DPI 的整页图片
+                page.insert_image(page.rect, stream=_scan_image(w * 100 // 72, h * 100 // 72, rng))
+            else:
+                y = 72
+                while y < h - 72:
+                    words = " ".join(rng.choice(("lorem", "ipsum", "dolor", "sit", "amet", "watermark", "page"))
+                                     for _ in range(10))
+                    page.insert_text((72, y), f"{i + 1}. {words}", fontsize=10)
+                    y += 14
+                page.draw_rect(fitz.Rect(60, 60, w - 60, h - 60), color=(0.5, 0.5, 0.5), width=0.5)
+            if spec["rotation"]:
+                page.set_rotation(spec["rotation"])
+        doc.save(path, garbage=1, deflate=True)
+    finally:
+        doc.close()
+
+def _write_logo(path):
+    """带透明通道的标志图，用作图片水印"""
+    img = Image.new("RGBA", (600, 300), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    draw.ellipse((10, 10, 290, 290), fill=(200, 30, 30, 255))
+    draw.rectangle((310, 80, 590, 220), fill=(30, 30, 200, 200))
+    img.save(path, format="PNG")
+
+def generate_corpus(corpus=DEFAULT_CORPUS, base_dir=DEFAULT_BENCH_DIR):
+    """在 base_dir/corpus-<名称> 下生成语料（已存在且规格未变时直接复用），返回语料清单
+
+    所有内容由固定种子生成，同一版本在任何机器上得到相同的文件。
+    """
+    specs = CORPORA[corpus]
+    root = os.path.join(base_dir, f"corpus-{corpus}")
+    manifest_path = os.path.join(root, "manifest.json")
+    wanted = {"version": CORPUS_VERSION, "specs": specs}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if {k: manifest.get(k) for k in wanted} == wanted and \
+           all(os.path.exists(p) for p in manifest["files"] + [manifest["logo"]]):
+            return manifest
+
+    shutil.rmtree(root, ignore_errors=True)
+    os.makedirs(root)
+    files = []
+    for spec in specs:
+        for n in range(spec["files"]):
+            path = os.path.join(root, f"{spec['name']}-{n:03d}.pdf")
+            _write_pdf(path, spec, seed=f"{CORPUS_VERSION}/{spec['name']}/{n}")
+            files.append(path)
+    logo = os.path.join(root, "logo.png")
+    _write_logo(logo)
+    manifest = dict(wanted, files=files, logo=logo,
+                    pages=sum(s["files"] * s["pages"] for s in specs),
+                    bytes=sum(os.path.getsize(p) for p in files))
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+# --- 运行场景 ---
+def _run_scenario(name, files, logo, options):
+    """在独立进程中运行一个场景，峰值内存只反映该场景本身"""
+    watermarks = [dict(wm, path=logo) if wm["type"] == "image" else dict(wm) for wm in SCENARIOS[name]]
+    out_dir = tempfile.mkdtemp(prefix="wm-bench-")
+    try:
+        report = RunReport()
+        start = time.perf_counter()
+        processed_wms = prepare_watermarks(watermarks)
+        report.add_stage("prepare_seconds", time.perf_counter() - start)
+        for res in iter_batch(files, processed_wms, output_dir=out_dir, **options):
+            report.add(res)
+        seconds = time.perf_counter() - start
+        report.finish()
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+    summary = report.summary()
+    counters = summary["counters"]
+    if counters["failed"]:
+        failure = next(f for f in report.files if not f.get("ok"))
+        raise RuntimeError(f"场景 {name} 处理失败: {failure['path']}: {failure.get('error')}")
+    return {
+        "seconds": seconds,
+        "pages": counters["pages"],
+        "pages_per_sec": counters["pages"] / seconds if seconds > 0 else 0.0,
+        "peak_rss_bytes": peak_rss_bytes(),
+        "output_bytes": counters["output_bytes"],
+        "stages": summary["stages"],
+    }
+
+# --- 界面启动耗时 ---
+def measure_startup(timeout=60):
+    """在全新的子进程中测量界面启动耗时（秒）
+
+    import_seconds 为导入界面模块（含依赖检查）的耗时；有显示器时再完整启动一次界面，
+    window_seconds 为窗口首次绘制完成的耗时，process_seconds 为含解释器启动在内的总耗时，
+    没有显示器时这两项为 None。
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    code = "import time; t = time.perf_counter(); import watermark; print(time.perf_counter() - t)"
+    out = subprocess.run([sys.executable, "-c", code], cwd=here, capture_output=True, text=True, timeout=timeout)
+    result = {"import_seconds": float(out.stdout.split()[-1]) if out.returncode == 0 and out.stdout.strip() else None,
+              "window_seconds": None, "process_seconds": None}
+
+    env = dict(os.environ, PDF_WATERMARK_STARTUP_PROBE="1")
+    start = time.perf_counter()
+    try:
+        out = subprocess.run([sys.executable, os.path.join(here, "watermark.py")], cwd=here, env=env,
+                             capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return result
+    if out.returncode == 0 and out.stdout.strip():
+        result["process_seconds"] = time.perf_counter() - start
+        result["window_seconds"] = json.loads(out.stdout.strip().splitlines()[-1])["window_seconds"]
+    return result
+
+def run_benchmark(corpus=DEFAULT_CORPUS, scenarios=None, repeat=1, base_dir=DEFAULT_BENCH_DIR, **options):
+    """生成（或复用）语料并依次运行各场景，返回可保存为基线的结果字典
+
+    每个场景在全新的子进程中运行 repeat 次，取吞吐量最高的一次，减少偶发抖动；
+    界面启动耗时同样测量 repeat 次，每项取最小值。
+    options 原样传给 process_file（如 shared_stamp、save_profile）。
+    """
+    manifest = generate_corpus(corpus, base_dir)
+    ctx = multiprocessing.get_context("spawn")
+    results = {}
+    for name in scenarios or list(SCENARIOS):
+        runs = []
+        for _ in range(max(1, repeat)):
+            with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+                runs.append(pool.submit(_run_scenario, name, manifest["files"], manifest["logo"], options).result())
+        results[name] = max(runs, key=lambda r: r["pages_per_sec"])
+    startup_runs = [measure_startup() for _ in range(max(1, repeat))]
+    startup = {key: min((r[key] for r in startup_runs if r[key] is not None), default=None)
+               for key in startup_runs[0]}
+    return {
+        "corpus": corpus,
+        "corpus_version": CORPUS_VERSION,
+        "corpus_pages": manifest["pages"],
+        "options": options,
+        "environment": {"python": platform.python_version(), "pymupdf": fitz.VersionBind,
+                        "platform": platform.platform(), "cpu_count": os.cpu_count()},
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "scenarios": results,
+        "startup": startup,
+    }
+
+# --- 与基线比较 ---
+def compare_to_baseline(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """返回 [(场景, 指标, 基线值, 本次值, 变化比例, 是否回退), ...]
+
+    吞吐量越高越好，峰值内存和输出体积越低越好；变化超过 threshold 的劣化记为回退。
+    语料或选项不同的结果没有可比性，直接报错。
+    """
+    for key in ("corpus", "corpus_version", "options"):
+        if results.get(key) != baseline.get(key):
+            raise ValueError(f"基线的 {key} 与本次运行不同，无法比较: {baseline.get(key)!r} != {results.get(key)!r}")
+    rows = []
+    for name, cur in results["scenarios"].items():
+        base = baseline["scenarios"].get(name)
+        if not base:
+            continue
+        for metric, higher_is_better in (("pages_per_sec", True), ("peak_rss_bytes", False), ("output_bytes", False)):
+            old, new = base.get(metric), cur.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            regressed = -change > threshold if higher_is_better else change > threshold
+            rows.append((name, metric, old, new, change, regressed))
+    # 启动耗时越低越好
+    for metric, new in results.get("startup", {}).items():
+        old = baseline.get("startup", {}).get(metric)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        rows.append(("startup", metric, old, new, change, change > threshold))
+    return rows
+
+def format_results(results):
+    lines = [f"{'场景':<12}{'页数':>8}{'页/秒':>10}{'峰值内存(MB)':>14}{'输出(MB)':>10}"]
+    for name, r in results["scenarios"].items():
+        rss = f"{r['peak_rss_bytes'] / 1024 / 1024:.0f}" if r["peak_rss_bytes"] else "-"
+        lines.append(f"{name:<12}{r['pages']:>8}{r['pages_per_sec']:>10.1f}{rss:>14}"
+                     f"{r['output_bytes'] / 1024 / 1024:>10.1f}")
+    startup = results.get("startup") or {}
+    fmt = lambda v: f"{v * 1000:.0f} ms" if v is not None else "-（无显示器）"
+    if startup:
+        lines.append(f"启动: 导入 {fmt(startup.get('import_seconds'))}，窗口首次绘制 {fmt(startup.get('window_seconds'))}，"
+                     f"含解释器启动 {fmt(startup.get('process_seconds'))}")
+    return "\n".join(lines)
+
+def run_bench_command(args):
+    print(f"正在准备语料 {args.corpus}（首次运行需要生成）...", flush=True)
+    options = {"shared_stamp": args.shared_stamp, "save_profile": args.save_profile}
+    results = run_benchmark(args.corpus, args.scenario, args.repeat, args.bench_dir or DEFAULT_BENCH_DIR, **options)
+    print(format_results(results))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if not args.baseline:
+        return 0
+    if args.save_baseline or not os.path.exists(args.baseline):
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"已保存基线: {args.baseline}")
+        return 0
+
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    try:
+        rows = compare_to_baseline(results, baseline, args.threshold)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    regressions = 0
+    for name, metric, old, new, change, regressed in rows:
+        mark = "回退" if regressed else ""
+        regressions += regressed
+        print(f"{name:<12}{metric:<16}{old:>14.1f} -> {new:<14.1f}{change:+8.1%} {mark}")
+    if regressions:
+        print(f"发现 {regressions} 项性能回退（阈值 {args.threshold:.0%}）", file=sys.stderr)
+        return 1
+    print(f"与基线相比未发现超过 {args.threshold:.0%} 的回退")
+    return 0
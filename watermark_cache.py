@@ -0,0 +1,96 @@
+"""预处理后的水印素材磁盘缓存：按内容寻址，超过容量时按最近最少使用淘汰"""
+import os
+import hashlib
+import tempfile
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".pdf_watermark_cache")
+DEFAULT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+class AssetCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def make_key(self, img_obj, **params):
+        """由源图像素内容和预处理参数（角度、透明度、编码方式等）生成缓存键"""
+        h = hashlib.sha256()
+        h.update(f"{img_obj.mode}:{img_obj.size}".encode())
+        h.update(img_obj.tobytes())
+        for name in sorted(params):
+            h.update(f"|{name}={params[name]!r}".encode())
+        return h.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key + ".bin")
+
+    def get(self, key):
+        path = self._entry_path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            self.misses += 1
+            return None
+        # 用修改时间记录最近一次使用，供淘汰时排序
+        try: os.utime(path)
+        except OSError: pass
+        self.hits += 1
+        return data
+
+    def put(self, key, data):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # 先写临时文件再改名，多个进程同时写入也不会读到半个文件
+            fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, self._entry_path(key))
+        except OSError:
+            return
+        self.evict()
+
+    def _entries(self):
+        entries = []
+        try:
+            with os.scandir(self.cache_dir) as it:
+                for e in it:
+                    if e.name.endswith(".bin"):
+                        try: st = e.stat()
+                        except OSError: continue
+                        entries.append((st.st_mtime, st.st_size, e.path))
+        except OSError:
+            pass
+        return entries
+
+    def evict(self):
+        """总大小超过上限时，从最久未使用的条目开始删除"""
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                self.evictions += 1
+            except OSError:
+                pass
+
+    def clear(self):
+        for _, _, path in self._entries():
+            try: os.remove(path)
+            except OSError: pass
+
+    def stats(self):
+        entries = self._entries()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "max_bytes": self.max_bytes,
+        }
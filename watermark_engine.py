@@ -0,0 +1,948 @@
+"""PDF 水印核心引擎：不依赖 tkinter，可在无图形界面的服务器上批量运行"""
+import os
+import sys
+import json
+import time
+import shutil
+import signal
+import argparse
+from io import BytesIO
+
+from watermark_lazy import lazy_import
+# PyMuPDF 与 Pillow 导入较慢，推迟到第一次使用时加载，界面窗口可以先显示出来
+Image = lazy_import("PIL.Image")
+ImageEnhance = lazy_import("PIL.ImageEnhance")
+fitz = lazy_import("fitz")  # PyMuPDF
+
+from watermark_cache import AssetCache, DEFAULT_CACHE_DIR, DEFAULT_CACHE_MAX_BYTES
+from watermark_layout import grid_settings, text_extent, wm_positions
+from watermark_progress import JobCancelled, JobControl
+from watermark_report import current_rss_bytes, peak_rss_bytes, reset_peak_rss
+
+# --- 核心配置 ---
+def get_config_path():
+    # 将配置文件存放在用户主目录下，避免在程序目录生成
+    return os.path.join(os.path.expanduser("~"), ".pdf_watermark_settings.json")
+
+CONFIG_FILE = get_config_path()
+
+DEFAULT_OUTPUT_DIR = "原文件目录"
+DEFAULT_SUFFIX = "_marked"
+RANGE_MODES = ["全部页面", "奇数页", "偶数页", "指定页面"]
+# 命令行 --pages 的简写
+CLI_RANGE_MODES = {"all": "全部页面", "odd": "奇数页", "even": "偶数页"}
+
+# 输出保存方案：在体积与保存耗时之间取舍
+SAVE_PROFILES = {
+    # 不做任何清理，保存最快（与早期版本行为一致）
+    "fast": {},
+    # 回收无用对象、压缩所有流并使用对象流
+    "compact": {"garbage": 3, "deflate": True, "deflate_images": True, "deflate_fonts": True,
+                "use_objstms": True},
+    # 在 compact 基础上清理内容流，并请求线性化（浏览器中可先显示首页）；
+    # PyMuPDF 1.28 起不再支持线性化，见 save_document
+    "web": {"garbage": 3, "deflate": True, "deflate_images": True, "deflate_fonts": True,
+            "clean": True, "linear": True},
+}
+DEFAULT_SAVE_PROFILE = "fast"
+
+# 输出方式：rewrite 完整重写；incremental 复制原文件后只追加改动的对象；
+# inplace 直接在原文件末尾追加（会修改原文件，需用户明确选择）
+OUTPUT_MODES = ["rewrite", "incremental", "inplace"]
+
+# 内存上限模式下估算峰值内存的经验系数（偏保守）
+DOC_MEMORY_FACTOR = 1.5             # 页面对象在内存中相对其在文件中体积的倍数
+PAGE_MEMORY_OVERHEAD = 256 * 1024   # 每个加过水印、尚未写出的页面额外占用（内容流、资源字典）
+PAGE_TREE_BYTES = 2 * 1024          # 分段处理时每页常驻的页面树和交叉引用表开销
+DEFAULT_PAGE_WINDOW = 200           # 分段处理时每段最多的页数
+
+class MemoryBudgetExceeded(Exception):
+    """按内存上限分段到每段一页仍放不下的文件"""
+
+# --- 水印预处理 ---
+def hex_to_rgb(hex_color):
+    hex_color = hex_color.lstrip('#')
+    return tuple(int(hex_color[i:i+2], 16)/255.0 for i in (0, 2, 4))
+
+def get_pdf_font_name(font_family, text):
+    # 检查是否包含中文字符，若包含则强制使用内置中文字库防止模糊或乱码
+    has_chinese = any('\u4e00' <= char <= '\u9fff' for char in text)
+    if has_chinese:
+        return "china-s"
+
+    mapping = {
+        "Arial": "helv",
+        "Helvetica": "helv",
+        "Times New Roman": "tirom",
+        "Courier New": "cour",
+        "Verdana": "helv",
+        "Georgia": "tirom"
+    }
+    return mapping.get(font_family, "helv")
+
+def text_width(text, fontname, fontsize):
+    """文字在 insert_text 中的绘制宽度（点），字体不支持测量时按每字一个字号宽估算"""
+    try:
+        return fitz.get_text_length(text, fontname=fontname, fontsize=fontsize)
+    except Exception:
+        return fontsize * len(text)
+
+IMAGE_FORMATS = ["PNG", "JPEG"]
+
+def image_scale_factor(scale, image_dpi=None):
+    """按目标 DPI 计算源图的缩小比例（绘制尺寸 = 像素 × scale 点，1 点 = 1/72 英寸），不放大"""
+    return min(1.0, scale * image_dpi / 72.0) if image_dpi else 1.0
+
+def encode_image_watermark(img_obj, angle, opacity, factor=1.0, image_format="PNG"):
+    """缩放、旋转并调整透明度后编码，返回 (图像数据, 透明蒙版数据或 None, 宽, 高)
+
+    PNG 直接携带透明通道；JPEG 只保存颜色，透明度另存为灰度 PNG 蒙版。
+    """
+    # 未指定目标 DPI 时不预先 resize，保留原始分辨率以防模糊
+    wm_pil = img_obj.copy()
+    if factor < 1.0:
+        new_size = (max(1, round(wm_pil.width * factor)), max(1, round(wm_pil.height * factor)))
+        wm_pil = wm_pil.resize(new_size, Image.Resampling.LANCZOS)
+
+    # 使用高质量的双三次插值进行旋转
+    wm_pil = wm_pil.rotate(angle, expand=True, resample=Image.Resampling.BICUBIC)
+
+    r, g, b, a = wm_pil.split()
+    a = ImageEnhance.Brightness(a).enhance(opacity)
+
+    img_byte_arr = BytesIO()
+    mask = None
+    if image_format == "JPEG":
+        Image.merge("RGB", (r, g, b)).save(img_byte_arr, format='JPEG', quality=85)
+        mask_byte_arr = BytesIO()
+        a.save(mask_byte_arr, format='PNG', optimize=True)
+        mask = mask_byte_arr.getvalue()
+    else:
+        wm_pil.putalpha(a)
+        wm_pil.save(img_byte_arr, format='PNG', optimize=True)
+    return img_byte_arr.getvalue(), mask, wm_pil.width, wm_pil.height
+
+def prepare_watermarks(watermarks, cache=None, image_dpi=None, image_format="PNG"):
+    """将水印列表（与模板格式相同）预编译为可直接写入 PDF 的数据
+
+    传入 AssetCache 时，相同源图和参数的图片水印直接复用缓存中的编码结果。
+    image_dpi 指定图片水印在最终绘制尺寸下的有效分辨率，超出部分在编码前缩小；
+    image_format 为 "PNG" 或 "JPEG"（透明度作为独立蒙版）。
+    """
+    processed_wms = []
+    for wm in watermarks:
+        if wm['type'] == 'image':
+            # 模板中不保存 img_obj，无界面调用时从 path 重新读取
+            img_obj = wm.get('img_obj')
+            if img_obj is None:
+                img_obj = Image.open(wm['path']).convert("RGBA")
+            ws, wa, wo = wm['scale'], wm['angle'], wm['opacity']
+            factor = image_scale_factor(ws, image_dpi)
+
+            data = mask = None
+            if cache is not None:
+                params = {"angle": wa, "opacity": wo, "format": image_format, "optimize": True}
+                if factor < 1.0: params["factor"] = round(factor, 6)
+                key = cache.make_key(img_obj, **params)
+                data = cache.get(key)
+                if data is not None and image_format == "JPEG":
+                    mask = cache.get(key + ".mask")
+                    if mask is None: data = None
+            if data is not None:
+                # 只读取图像头即可得到尺寸
+                img_w, img_h = Image.open(BytesIO(data)).size
+            else:
+                data, mask, img_w, img_h = encode_image_watermark(img_obj, wa, wo, factor, image_format)
+                if cache is not None:
+                    cache.put(key, data)
+                    if mask is not None: cache.put(key + ".mask", mask)
+
+            # 缩小后的像素数换算回原始分辨率下的尺寸，保证绘制大小不变
+            img_w, img_h = img_w / factor, img_h / factor
+
+            processed_wms.append({
+                "type": "image",
+                "data": data,
+                "mask": mask,
+                "display_w": img_w * ws,
+                "display_h": img_h * ws,
+                "x": wm['x'],
+                "y": wm['y'],
+                **grid_settings(wm)
+            })
+        else:
+            # 文字水印 (使用 PyMuPDF 的 insert_text)
+            size = 30 * wm['scale']
+            font = get_pdf_font_name(wm.get('font', 'Arial'), wm['content'])
+            processed_wms.append({
+                "type": "text",
+                "content": wm['content'],
+                "size": size,
+                "width": text_width(wm['content'], font, size),
+                "opacity": wm['opacity'],
+                "angle": wm['angle'],
+                "color": hex_to_rgb(wm.get('color', '#FF0000')),
+                "font": font,
+                "x": wm['x'],
+                "y": wm['y'],
+                **grid_settings(wm)
+            })
+    return processed_wms
+
+# --- 页面范围与输出路径 ---
+def parse_page_range(text):
+    """解析 "1-3,5" 形式的页码（从 1 开始），格式错误的部分被忽略"""
+    custom = set()
+    try:
+        for p in text.replace("，", ",").split(","):
+            if "-" in p:
+                a, b = p.split("-")
+                custom.update(range(int(a), int(b)+1))
+            elif p.strip(): custom.add(int(p))
+    except: pass
+    return custom
+
+def is_page_selected(page_idx, mode, custom=None):
+    return mode == "全部页面" or \
+           (mode == "奇数页" and (page_idx+1)%2!=0) or \
+           (mode == "偶数页" and (page_idx+1)%2==0) or \
+           (mode == "指定页面" and (page_idx+1) in (custom or ()))
+
+def get_output_path(path, output_dir=DEFAULT_OUTPUT_DIR, suffix=DEFAULT_SUFFIX, input_root=None):
+    """输出文件路径；指定输出目录且 path 位于 input_root 之下时，在输出目录中保留其相对子目录
+
+    input_root 为遍历输入目录的起点（见 PdfWalker.output_root），使不同子目录中的同名文件不会互相覆盖。
+    """
+    base_name = os.path.basename(os.path.splitext(path)[0])
+    final_name = base_name + suffix + ".pdf"
+    if output_dir == DEFAULT_OUTPUT_DIR:
+        return os.path.join(os.path.dirname(path), final_name)
+    out_dir = output_dir
+    if input_root:
+        rel = os.path.relpath(os.path.dirname(os.path.abspath(path)), os.path.abspath(input_root))
+        if rel != os.curdir and rel != os.pardir and not rel.startswith(os.pardir + os.sep):
+            out_dir = os.path.join(output_dir, rel)
+    return os.path.join(out_dir, final_name)
+
+def is_output_path(path, output_dir=DEFAULT_OUTPUT_DIR, suffix=DEFAULT_SUFFIX):
+    """path 是否是按这组输出设置写出的文件，遍历输入目录时跳过，避免给输出再加水印"""
+    if output_dir == DEFAULT_OUTPUT_DIR:
+        return bool(suffix) and os.path.splitext(os.path.basename(path))[0].endswith(suffix)
+    return os.path.abspath(path).startswith(os.path.abspath(output_dir) + os.sep)
+
+# --- 写入水印 ---
+def wm_placements(pwm, page_w, page_h):
+    """预编译水印 pwm 在 page_w x page_h 页面上的全部绘制位置（y 轴向上），加水印与预扫描共用"""
+    if pwm['type'] == 'image':
+        # 预编译的图片已经旋转，display_w/h 即外接矩形
+        return wm_positions(page_w, page_h, pwm, pwm['display_w'], pwm['display_h'])
+    # 文字从基线起点沿旋转方向绘制，按实际宽度和方向剔除页面外的格点
+    return wm_positions(page_w, page_h, pwm, extent=text_extent(pwm['width'], pwm['size'], pwm['angle']))
+
+def stamp_page(page, processed_wms, image_xrefs=None, stats=None):
+    """在页面上绘制全部水印
+
+    image_xrefs 是同一文档内共用的 {水印序号: 图片 xref} 字典：
+    每个图片水印只在第一次放置时嵌入，之后直接引用该 xref，
+    不再重复传入 PNG 数据让 PyMuPDF 计算摘要。stats 中累计插入次数与复用次数。
+    """
+    page_w, page_h = page.rect.width, page.rect.height
+    images = texts = 0
+
+    for wm_idx, pwm in enumerate(processed_wms):
+        # 计算所有要绘制的位置（与预览共用布局，完全在页面外的格点已剔除）
+        pos_list = wm_placements(pwm, page_w, page_h)
+
+        for px, py in pos_list:
+            if pwm['type'] == 'image':
+                # 保持原始分辨率的高质量插入
+                rect_x0 = px - pwm['display_w']/2
+                rect_y0 = (page_h - py) - pwm['display_h']/2
+                rect = fitz.Rect(rect_x0, rect_y0, rect_x0 + pwm['display_w'], rect_y0 + pwm['display_h'])
+                xref = image_xrefs.get(wm_idx) if image_xrefs is not None else None
+                if xref:
+                    page.insert_image(rect, xref=xref)
+                    if stats is not None:
+                        stats["images_deduped"] = stats.get("images_deduped", 0) + 1
+                else:
+                    xref = page.insert_image(rect, stream=pwm['data'], mask=pwm.get('mask'))
+                    if image_xrefs is not None:
+                        image_xrefs[wm_idx] = xref
+                images += 1
+            else:
+                # 插入矢量文字水印
+                page.insert_text((px, page_h - py),
+                                 pwm['content'],
+                                 fontsize=pwm['size'],
+                                 color=pwm['color'],
+                                 fontname=pwm['font'],
+                                 rotate=pwm['angle'],
+                                 fill_opacity=pwm['opacity'])
+                texts += 1
+    if stats is not None:
+        stats["images_inserted"] = stats.get("images_inserted", 0) + images
+        stats["texts_inserted"] = stats.get("texts_inserted", 0) + texts
+
+def stamp_pages(doc, page_indices, processed_wms, shared_stamp=False, stats=None, on_page=None, image_xrefs=None):
+    """为 doc 中指定的页面加水印，每完成一页调用一次 on_page()
+
+    shared_stamp 为 True 时，每种页面尺寸只绘制一次完整水印层（含阵列），
+    生成一个 Form XObject，之后每页只引用它一次，输出体积和耗时只随页数增长。
+    stats 中的 page_times 记录每页耗时 [[页码, 秒], ...]。
+    分段处理同一文档时传入同一个 image_xrefs，已嵌入的图片在后续各段继续复用。
+    """
+    page_times = stats.setdefault("page_times", []) if stats is not None else None
+    def page_done(page_idx, start):
+        if page_times is not None: page_times.append([page_idx, time.perf_counter() - start])
+        if on_page: on_page()
+
+    image_xrefs = {} if image_xrefs is None else image_xrefs
+    if not shared_stamp:
+        for page_idx in page_indices:
+            start = time.perf_counter()
+            stamp_page(doc.load_page(page_idx), processed_wms, image_xrefs, stats)
+            page_done(page_idx, start)
+        return
+
+    stamps = fitz.open()
+    stamp_xrefs = {}
+    stamp_pno = {}  # (宽, 高) -> 水印层所在页号
+    try:
+        for page_idx in page_indices:
+            start = time.perf_counter()
+            page = doc.load_page(page_idx)
+            if page.rotation:
+                # 旋转页面的坐标换算与普通页面不同，保持逐个绘制
+                stamp_page(page, processed_wms, image_xrefs, stats)
+                page_done(page_idx, start)
+                continue
+            key = (round(page.rect.width, 2), round(page.rect.height, 2))
+            if key not in stamp_pno:
+                stamp_page(stamps.new_page(width=page.rect.width, height=page.rect.height),
+                           processed_wms, stamp_xrefs, stats)
+                stamp_pno[key] = stamps.page_count - 1
+            # 同一水印层在文档内只嵌入一次，重复引用时 PyMuPDF 会复用其 xref
+            page.show_pdf_page(page.rect, stamps, stamp_pno[key])
+            page_done(page_idx, start)
+    finally:
+        stamps.close()
+
+# --- 保存 ---
+def temp_output_path(save_path, ext="tmp"):
+    """与输出文件同目录的临时文件名，写完后用 os.replace 原子地替换为正式文件
+
+    同一次处理需要多个临时文件时用不同的 ext 区分，如分段处理的工作副本。
+    """
+    return f"{save_path}.{os.getpid()}.{ext}"
+
+FICLONE = 0x40049409 # Linux 的 ioctl(FICLONE)，在 Btrfs / XFS 等文件系统上共享数据块而不复制
+
+def copy_source(path, dst, stats=None):
+    """为增量处理复制原文件：优先写时复制（reflink），其次 os.copy_file_range，最后完整复制
+
+    stats 中记录复制方式 copy_method，以及实际经由本进程或内核复制的字节数 bytes_copied
+    （reflink 时为 0）。copy_file_range 在部分文件系统上也会共享数据块，但无法区分，按全部复制计。
+    """
+    size = os.path.getsize(path)
+    method = copied = None
+    with open(path, "rb") as src, open(dst, "wb") as out:
+        if sys.platform.startswith("linux"):
+            import fcntl
+            try:
+                fcntl.ioctl(out.fileno(), FICLONE, src.fileno())
+                method, copied = "reflink", 0
+            except OSError:
+                pass
+        if method is None and hasattr(os, "copy_file_range"):
+            try:
+                offset = 0
+                while offset < size:
+                    n = os.copy_file_range(src.fileno(), out.fileno(), size - offset, offset, offset)
+                    if n == 0: break
+                    offset += n
+                if offset == size:
+                    method, copied = "copy_file_range", size
+            except OSError:
+                pass
+    if method is None:
+        # 跨文件系统等情况退回为普通复制（覆盖上面可能写了一半的文件）
+        shutil.copyfile(path, dst)
+        method, copied = "copy", size
+    if stats is not None:
+        stats["copy_method"] = method
+        stats["bytes_copied"] = stats.get("bytes_copied", 0) + copied
+    return dst
+
+# 所用 PyMuPDF 是否支持线性化，第一次遇到不支持的报错后置为 False，之后不再尝试
+_linear_supported = True
+
+def _is_linear_unsupported(error):
+    """save(linear=True) 是否因 MuPDF 不再支持线性化而失败（而非磁盘已满、无权限等错误）"""
+    return "lineari" in str(error).lower() # Linearisation / linearization
+
+def save_document(doc, save_path, save_profile=DEFAULT_SAVE_PROFILE, stats=None, min_garbage=0):
+    """按保存方案写出文档，并在 stats 中记录保存耗时和输出体积
+
+    先写入同目录的临时文件再改名，中途退出或保存失败都不会留下半个 PDF。
+    方案要求线性化而 PyMuPDF 不再支持时改为普通输出，stats["linearized"] 为 False；其他保存错误照常抛出。
+    """
+    global _linear_supported
+    opts = dict(SAVE_PROFILES[save_profile])
+    if not _linear_supported: opts.pop("linear", None)
+    opts["garbage"] = max(opts.get("garbage", 0), min_garbage)
+    start = time.perf_counter()
+    linearized = bool(opts.get("linear"))
+    tmp_path = temp_output_path(save_path)
+    try:
+        try:
+            doc.save(tmp_path, **opts)
+        except Exception as e:
+            if not (linearized and _is_linear_unsupported(e)): raise
+            # 新版 MuPDF 已不再支持线性化，此时退回为普通的压缩输出
+            _linear_supported = False
+            opts.pop("linear")
+            linearized = False
+            doc.save(tmp_path, **opts)
+        os.replace(tmp_path, save_path)
+    except BaseException:
+        try: os.remove(tmp_path)
+        except OSError: pass
+        raise
+    if stats is not None:
+        stats["save_profile"] = save_profile
+        stats["save_seconds"] = time.perf_counter() - start
+        stats["output_bytes"] = stats["bytes_written"] = os.path.getsize(save_path)
+        stats["linearized"] = linearized
+    return save_path
+
+def save_incremental(doc, save_path, save_profile=DEFAULT_SAVE_PROFILE, stats=None):
+    """把改动作为增量更新追加到 doc 自身的文件末尾，写入量只与水印大小有关
+
+    无法增量保存的文件（如打开时经过修复）退回为完整重写：先写临时文件，
+    关闭文档后再替换，因此调用方需在 doc.close() 之后调用返回的收尾函数。
+    """
+    if doc.can_save_incrementally():
+        size_before = os.path.getsize(save_path)
+        start = time.perf_counter()
+        doc.saveIncr()
+        if stats is not None:
+            stats["save_profile"] = "incremental"
+            stats["save_seconds"] = time.perf_counter() - start
+            stats["output_bytes"] = os.path.getsize(save_path)
+            stats["bytes_written"] = stats["output_bytes"] - size_before
+        return lambda: None
+
+    tmp_path = temp_output_path(save_path)
+    save_document(doc, tmp_path, save_profile, stats)
+    return lambda: os.replace(tmp_path, save_path)
+
+# --- 内存上限 ---
+def estimate_peak_bytes(file_size, page_count, pages_selected, processed_wms, window=None, base=None):
+    """估算处理一个文件时的进程峰值内存（字节）
+
+    window 为空时整份文档在内存中修改后一次写出；否则每处理 window 页就写出并释放一次。
+    base 为处理前的进程内存，默认取当前值。
+    """
+    if base is None: base = current_rss_bytes() or 0
+    wm_bytes = sum(len(pwm.get('data') or b"") + len(pwm.get('mask') or b"") for pwm in processed_wms)
+    if window is None:
+        doc_bytes = file_size * DOC_MEMORY_FACTOR + pages_selected * PAGE_MEMORY_OVERHEAD
+    else:
+        per_page = file_size / max(1, page_count)
+        doc_bytes = min(window, pages_selected) * (per_page * DOC_MEMORY_FACTOR + PAGE_MEMORY_OVERHEAD) + \
+                    page_count * PAGE_TREE_BYTES
+    # 预编译的水印数据之外，插入时 PyMuPDF 还会再持有一份
+    return int(base + 2 * wm_bytes + doc_bytes)
+
+def plan_page_window(path, processed_wms, mode="全部页面", custom=None, memory_limit=None, base=None):
+    """按内存上限决定处理方式：返回 None 表示整份处理，否则返回每段页数
+
+    分段到每段一页仍超出上限时抛出 MemoryBudgetExceeded。
+    """
+    if not memory_limit:
+        return None
+    with fitz.open(path) as doc:
+        page_count = doc.page_count
+    pages_selected = sum(1 for i in range(page_count) if is_page_selected(i, mode, custom))
+    file_size = os.path.getsize(path)
+    if estimate_peak_bytes(file_size, page_count, pages_selected, processed_wms, base=base) <= memory_limit:
+        return None
+    window = DEFAULT_PAGE_WINDOW
+    while window >= 1:
+        estimate = estimate_peak_bytes(file_size, page_count, pages_selected, processed_wms, window, base)
+        if estimate <= memory_limit:
+            return window
+        window //= 2
+    raise MemoryBudgetExceeded(f"预计峰值内存 {estimate / 1024 / 1024:.0f} MB 超出上限 "
+                               f"{memory_limit / 1024 / 1024:.0f} MB")
+
+def process_file_windowed(path, save_path, page_indices, processed_wms, window, shared_stamp=False,
+                          save_profile=DEFAULT_SAVE_PROFILE, output_mode="rewrite", stats=None, on_page=None):
+    """分段加水印：每处理 window 页就把改动增量追加到工作文件并关闭文档，释放这些页面占用的内存
+
+    工作文件始终是原文件的副本（inplace 时也是，见 copy_source），全部段落完成后才替换输出文件，
+    中途取消或出错时原文件不会只加了一部分水印。rewrite 模式且保存方案需要清理或压缩时，
+    最后再按方案完整写出一次；其他情况直接把工作文件改名为输出文件。
+    stats 中的 bytes_written 为各段实际追加（或重写）的字节数，与 save_incremental 一致；
+    复制工作文件的字节数另记在 bytes_copied 中。
+    """
+    stats = stats if stats is not None else {}
+    # 工作副本不能与 save_document 最终写出时用的临时文件同名，否则会被当作“保存到原文件”
+    work_path = temp_output_path(save_path, "work")
+    image_xrefs = {}
+    open_seconds = stamp_seconds = save_seconds = 0.0
+    bytes_written = 0
+    try:
+        copy_source(path, work_path, stats)
+        for k in range(0, len(page_indices), window):
+            start = time.perf_counter()
+            doc = fitz.open(work_path)
+            open_seconds += time.perf_counter() - start
+            rewritten = None
+            try:
+                start = time.perf_counter()
+                stamp_pages(doc, page_indices[k:k + window], processed_wms, shared_stamp, stats, on_page, image_xrefs)
+                stamp_seconds += time.perf_counter() - start
+                start = time.perf_counter()
+                if doc.can_save_incrementally():
+                    size_before = os.path.getsize(work_path)
+                    doc.saveIncr()
+                    bytes_written += os.path.getsize(work_path) - size_before
+                else:
+                    # 打开时经过修复的文件先完整重写一次，之后的各段即可增量追加
+                    rewritten = f"{work_path}.{os.getpid()}.full"
+                    doc.save(rewritten)
+            finally:
+                doc.close()
+            if rewritten:
+                bytes_written += os.path.getsize(rewritten)
+                os.replace(rewritten, work_path)
+            save_seconds += time.perf_counter() - start
+            # 清空 MuPDF 的资源缓存，本段用过的字体、图片等不再常驻
+            fitz.TOOLS.store_shrink(100)
+
+        if output_mode == "rewrite" and SAVE_PROFILES[save_profile]:
+            with fitz.open(work_path) as doc:
+                save_document(doc, save_path, save_profile, stats)
+            os.remove(work_path)
+            save_seconds += stats["save_seconds"]
+        else:
+            os.replace(work_path, save_path)
+            stats["save_profile"] = "incremental"
+            stats["output_bytes"] = os.path.getsize(save_path)
+            stats["bytes_written"] = bytes_written
+    except BaseException:
+        try: os.remove(work_path)
+        except OSError: pass
+        raise
+    stats.update(page_window=window, open_seconds=open_seconds, stamp_seconds=stamp_seconds,
+                 save_seconds=save_seconds)
+    return save_path
+
+def process_file(path, processed_wms, mode="全部页面", custom=None,
+                 output_dir=DEFAULT_OUTPUT_DIR, suffix=DEFAULT_SUFFIX, shared_stamp=False,
+                 save_profile=DEFAULT_SAVE_PROFILE, output_mode="rewrite", stats=None, progress=None,
+                 control=None, memory_limit=None, input_root=None):
+    """为单个 PDF 加水印并保存，返回输出文件路径
+
+    stats 字典用于收集统计数据；progress 为 ProgressReporter 时逐页报告进度；
+    control 为 JobControl 时每页之间检查暂停和取消，取消时抛出 JobCancelled 且不写出任何文件。
+    memory_limit（字节）为进程峰值内存上限：整份处理的估算超出上限时改为分段处理，
+    分段也放不下时抛出 MemoryBudgetExceeded。
+    input_root 见 get_output_path。
+    """
+    if output_mode == "inplace":
+        save_path = path
+    else:
+        save_path = get_output_path(path, output_dir, suffix, input_root)
+        os.makedirs(os.path.dirname(save_path) or os.curdir, exist_ok=True)
+
+    def on_page():
+        if progress is not None: progress.page_done(path)
+        if control is not None: control.checkpoint()
+
+    stats = stats if stats is not None else {}
+    window = plan_page_window(path, processed_wms, mode, custom, memory_limit)
+    if window:
+        with fitz.open(path) as doc:
+            page_indices = [i for i in range(len(doc)) if is_page_selected(i, mode, custom)]
+        stats["pages"] = len(page_indices)
+        if progress is not None: progress.file_started(path, len(page_indices))
+        return process_file_windowed(path, save_path, page_indices, processed_wms, window, shared_stamp,
+                                     save_profile, output_mode, stats, on_page)
+
+    work_path = None
+    if output_mode == "incremental":
+        # 复制原文件（尽量写时复制，不经过 PDF 解析）到临时文件，追加完成后再改名为输出文件
+        work_path = temp_output_path(save_path)
+        copy_source(path, work_path, stats)
+
+    finish = None
+    try:
+        start = time.perf_counter()
+        doc = fitz.open(path if output_mode == "rewrite" else (work_path or save_path))
+        stats["open_seconds"] = time.perf_counter() - start
+        try:
+            page_indices = [i for i in range(len(doc)) if is_page_selected(i, mode, custom)]
+            stats["pages"] = len(page_indices)
+            if progress is not None: progress.file_started(path, len(page_indices))
+            start = time.perf_counter()
+            stamp_pages(doc, page_indices, processed_wms, shared_stamp, stats, on_page)
+            stats["stamp_seconds"] = time.perf_counter() - start
+            if output_mode == "rewrite":
+                save_document(doc, save_path, save_profile, stats)
+            else:
+                finish = save_incremental(doc, work_path or save_path, save_profile, stats)
+        finally:
+            doc.close()
+        if finish: finish()
+        if work_path: os.replace(work_path, save_path)
+    except BaseException:
+        if work_path:
+            try: os.remove(work_path)
+            except OSError: pass
+        raise
+    return save_path
+
+def run_file(path, processed_wms, mode="全部页面", custom=None,
+             output_dir=DEFAULT_OUTPUT_DIR, suffix=DEFAULT_SUFFIX, progress=None, control=None, **options):
+    """处理单个文件并返回结果记录（不抛出异常，失败信息写入 error）
+
+    options 原样传给 process_file（如 shared_stamp、save_profile、output_mode）。
+    progress 为 ProgressReporter 时报告逐页进度和文件完成事件；
+    control 为 JobControl 时支持暂停和取消，被取消的文件在结果中标记 cancelled。
+    """
+    start = time.perf_counter()
+    # 每个文件单独统计峰值内存（不支持重置的系统上为进程启动以来的峰值）
+    reset_peak_rss()
+    result = {"path": path, "ok": False, "output": None, "error": None, "images_deduped": 0}
+    try:
+        result["output"] = process_file(path, processed_wms, mode, custom, output_dir, suffix,
+                                        stats=result, progress=progress, control=control, **options)
+        result["ok"] = True
+    except JobCancelled:
+        result["cancelled"] = True
+        result["error"] = "已取消"
+    except Exception as e:
+        result["error"] = str(e)
+    result["seconds"] = time.perf_counter() - start
+    result["peak_rss_bytes"] = peak_rss_bytes()
+    if progress is not None: progress.file_done(result)
+    return result
+
+def iter_batch(paths, processed_wms, mode="全部页面", custom=None,
+               output_dir=DEFAULT_OUTPUT_DIR, suffix=DEFAULT_SUFFIX, progress=None, control=None, **options):
+    """逐个处理文件，每完成一个就产出一条结果记录；取消后不再开始新的文件"""
+    for path in paths:
+        if control is not None:
+            control.wait()
+            if control.cancelled: return
+        result = run_file(path, processed_wms, mode, custom, output_dir, suffix, progress, control, **options)
+        yield result
+        if result.get("cancelled"): return
+
+# --- 模板 ---
+def normalize_template(data):
+    """兼容旧版直接保存的水印列表，统一为 {"watermarks": [...], 其他输出设置} 格式"""
+    if isinstance(data, list):
+        return {"watermarks": data}
+    return data
+
+def load_template(name_or_path, config_file=CONFIG_FILE):
+    """读取模板：可以是导出的 JSON 文件，也可以是配置文件中保存的模板名"""
+    if os.path.isfile(name_or_path):
+        with open(name_or_path, "r", encoding="utf-8") as f:
+            return normalize_template(json.load(f))
+
+    templates = {}
+    if os.path.exists(config_file):
+        with open(config_file, "r", encoding="utf-8") as f:
+            templates = json.load(f).get("templates", {})
+    if name_or_path not in templates:
+        raise ValueError(f"未找到模板: {name_or_path}")
+    return normalize_template(templates[name_or_path])
+
+# --- 命令行入口 ---
+def add_job_arguments(p):
+    """batch 与 watch 共用的模板、输出与编码参数"""
+    p.add_argument("--template", required=True, help="模板名（已保存在配置中）或模板 JSON 文件路径")
+    p.add_argument("--suffix", default=DEFAULT_SUFFIX, help="输出文件名后缀，默认 _marked")
+    p.add_argument("--pages", default="all", help="应用范围：all / odd / even / 指定页码如 1-3,5")
+    p.add_argument("--shared-stamp", action="store_true",
+                   help="每种页面尺寸只生成一次水印层并在各页复用，阵列水印时大幅减小体积")
+    p.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="水印素材缓存目录")
+    p.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_MAX_BYTES // (1024 * 1024),
+                   help="水印素材缓存容量上限 (MB)，默认 256")
+    p.add_argument("--no-cache", action="store_true", help="不使用水印素材缓存")
+    p.add_argument("--image-dpi", type=float, default=None,
+                   help="图片水印在实际绘制尺寸下的目标分辨率 (DPI)，默认保留原始分辨率")
+    p.add_argument("--image-format", type=str.upper, choices=IMAGE_FORMATS, default="PNG",
+                   help="图片水印编码格式：PNG，或 JPEG（透明度另存为蒙版）")
+    p.add_argument("--save-profile", choices=list(SAVE_PROFILES), default=None,
+                   help="保存方案：fast（不清理）/ compact（回收+压缩+对象流）/ web（compact 并清理内容流），默认取模板设置或 fast")
+    p.add_argument("--output-mode", choices=OUTPUT_MODES, default="rewrite",
+                   help="输出方式：rewrite 完整重写（默认）/ incremental 复制原文件后增量追加 / "
+                        "inplace 直接在原文件上增量追加（会修改原文件）")
+    p.add_argument("--memory-limit", type=int, default=None,
+                   help="进程峰值内存上限 (MB)：超出时按页分段处理并逐段写出，仍放不下的文件报错；"
+                        "多进程时由各进程平分，放不下的文件在最后单独串行处理")
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(prog="python -m watermark", description="PDF 批量水印（命令行模式）")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_batch = sub.add_parser("batch", help="按模板批量处理 PDF")
+    add_job_arguments(p_batch)
+    p_batch.add_argument("--in", dest="inputs", action="append", required=True,
+                         help="输入 PDF 文件、目录或通配符（如 'archive/**/*.pdf'），可重复指定")
+    p_batch.add_argument("--recursive", "-r", action="store_true", help="递归处理输入目录的子目录")
+    p_batch.add_argument("--include", action="append", default=[],
+                         help="只处理匹配该模式的文件（匹配文件名或相对路径，如 '2024-*.pdf'），可重复指定")
+    p_batch.add_argument("--exclude", action="append", default=[],
+                         help="跳过匹配该模式的文件或子目录，可重复指定")
+    p_batch.add_argument("--out", dest="output_dir", default=DEFAULT_OUTPUT_DIR, help="输出目录，默认与原文件同目录")
+    p_batch.add_argument("--workers", type=int, default=1, help="并行进程数，0 表示使用全部 CPU 核心，默认 1")
+    p_batch.add_argument("--shard-threshold", type=int, default=None,
+                         help="页数不少于该值的文件拆成页面分片并行处理（需 --workers 不为 1），默认 1000。"
+                              "每个分片各自嵌入一份水印图片和字体，fast 方案下分片输出会比不分片更大，"
+                              "compact / web 方案合并时会去重")
+    p_batch.add_argument("--journal", default=None,
+                         help="断点续跑日志文件：记录已完成的文件，重新运行时跳过内容和设置都未变的文件，只重试失败项")
+    p_batch.add_argument("--progress", action="store_true",
+                         help="在标准错误输出逐页进度、处理速度（页/秒）和预计剩余时间")
+    p_batch.add_argument("--plan", action="store_true",
+                         help="开始前预扫描全部文件的页数、页面尺寸和体积，显示预计耗时；多进程时最大的文件先处理，"
+                              "耗时突出的大文件拆成页面分片")
+    p_batch.add_argument("--report", default=None,
+                         help="运行结束后写出报告：.csv 为逐文件表格，其余为含分阶段耗时、计数和失败列表的 JSON")
+    p_batch.add_argument("--profile", default=None,
+                         help="用 cProfile 采样本进程的热点并保存到该文件（pstats 格式），建议配合 --workers 1")
+
+    p_watch = sub.add_parser("watch", help="监控文件夹，新放入的 PDF 写入完成后自动加水印")
+    add_job_arguments(p_watch)
+    p_watch.add_argument("--in", dest="inputs", action="append", required=True, help="监控的输入目录，可重复指定")
+    p_watch.add_argument("--out", dest="output_dir", required=True, help="输出目录（不能与监控目录相同）")
+    p_watch.add_argument("--workers", type=int, default=0, help="常驻进程数，默认 0 即全部 CPU 核心")
+    p_watch.add_argument("--interval", type=float, default=2.0, help="扫描间隔（秒），默认 2")
+    p_watch.add_argument("--settle", type=float, default=3.0, help="文件大小保持不变多少秒后才开始处理，默认 3")
+    p_watch.add_argument("--max-queue", type=int, default=None, help="在途任务上限，超过后暂停接收新文件，默认为进程数的 2 倍")
+
+    p_bench = sub.add_parser("bench", help="在合成语料上运行标准场景，测量吞吐量、峰值内存和输出体积")
+    p_bench.add_argument("--corpus", choices=["quick", "standard"], default="quick",
+                         help="语料规模：quick 几十页，standard 约两千页（含一个千页文件），默认 quick")
+    p_bench.add_argument("--scenario", action="append", default=None,
+                         choices=["text", "image", "grid-text", "grid-image", "cjk-text"],
+                         help="只运行指定场景，可重复指定，默认全部")
+    p_bench.add_argument("--repeat", type=int, default=1, help="每个场景运行次数，取最快的一次，默认 1")
+    p_bench.add_argument("--bench-dir", default=None, help="语料存放目录，生成后重复使用，默认 ~/.pdf_watermark_bench")
+    p_bench.add_argument("--shared-stamp", action="store_true", help="使用共享水印层")
+    p_bench.add_argument("--save-profile", choices=list(SAVE_PROFILES), default=DEFAULT_SAVE_PROFILE, help="保存方案")
+    p_bench.add_argument("--output", default=None, help="把本次结果写入 JSON 文件")
+    p_bench.add_argument("--baseline", default=None, help="基线 JSON 文件：不存在时保存本次结果，存在时与之比较")
+    p_bench.add_argument("--save-baseline", action="store_true", help="用本次结果覆盖基线")
+    p_bench.add_argument("--threshold", type=float, default=0.10,
+                         help="回退阈值（比例），吞吐量下降或内存、体积增长超过即返回非零，默认 0.10")
+
+    p_report = sub.add_parser("encode-report", help="比较图片水印在不同分辨率与编码格式下的体积和耗时")
+    p_report.add_argument("--template", required=True, help="模板名（已保存在配置中）或模板 JSON 文件路径")
+    p_report.add_argument("--dpi", type=float, nargs="+", default=[300, 150], help="参与比较的目标 DPI")
+    return parser
+
+def run_encode_report(args):
+    watermarks = [wm for wm in load_template(args.template)["watermarks"] if wm['type'] == 'image']
+    if not watermarks:
+        print("模板中没有图片水印")
+        return 0
+    print(f"{'水印':<24}{'DPI':>8}{'格式':>6}{'像素':>14}{'体积(KB)':>12}{'耗时(s)':>10}")
+    for wm in watermarks:
+        img_obj = Image.open(wm['path']).convert("RGBA")
+        name = os.path.basename(wm['path'])[:22]
+        for dpi in [None] + list(args.dpi):
+            factor = image_scale_factor(wm['scale'], dpi)
+            for image_format in IMAGE_FORMATS:
+                start = time.perf_counter()
+                data, mask, w, h = encode_image_watermark(img_obj, wm['angle'], wm['opacity'], factor, image_format)
+                seconds = time.perf_counter() - start
+                size_kb = (len(data) + len(mask or b"")) / 1024
+                print(f"{name:<24}{dpi or '原始':>8}{image_format:>6}{f'{w}x{h}':>14}{size_kb:>12.1f}{seconds:>10.2f}")
+    return 0
+
+def prepare_job(args):
+    """读取模板并预编译水印，返回 (processed_wms, mode, custom, options)"""
+    template = load_template(args.template)
+    cache = None if args.no_cache else AssetCache(args.cache_dir, args.cache_size * 1024 * 1024)
+    processed_wms = prepare_watermarks(template["watermarks"], cache, args.image_dpi, args.image_format)
+    if cache is not None:
+        st = cache.stats()
+        print(f"素材缓存: 命中 {st['hits']}, 未命中 {st['misses']}, 淘汰 {st['evictions']}, "
+              f"共 {st['entries']} 项 {st['bytes'] / 1024 / 1024:.1f} MB")
+
+    mode = CLI_RANGE_MODES.get(args.pages, "指定页面")
+    custom = parse_page_range(args.pages) if mode == "指定页面" else set()
+    options = {"shared_stamp": args.shared_stamp,
+               "save_profile": args.save_profile or template.get("save_profile", DEFAULT_SAVE_PROFILE),
+               "output_mode": args.output_mode}
+    if args.memory_limit:
+        options["memory_limit"] = args.memory_limit * 1024 * 1024
+    return processed_wms, mode, custom, options
+
+def print_result(res):
+    if res["ok"]:
+        dedup = f", 复用图片 {res['images_deduped']} 次" if res.get("images_deduped") else ""
+        window = f", 每 {res['page_window']} 页分段" if res.get("page_window") else ""
+        rss = f", 峰值内存 {res['peak_rss_bytes'] / 1024 / 1024:.0f} MB" if res.get("peak_rss_bytes") else ""
+        linear = f", linearized: {res.get('linearized', False)}" \
+                 if SAVE_PROFILES.get(res.get("save_profile"), {}).get("linear") else ""
+        copied = f", 复制原文件 {res['bytes_copied'] / 1024:.0f} KB ({res['copy_method']})" \
+                 if res.get("copy_method") else ""
+        print(f"完成: {res['path']} -> {res['output']} ({res['seconds']:.2f}s{dedup}, "
+              f"保存 {res.get('save_seconds', 0):.2f}s, 写入 {res.get('bytes_written', 0) / 1024:.0f} KB"
+              f"{linear}{copied}{window}{rss})", flush=True)
+    else:
+        print(f"失败: {res['path']}: {res['error']}", file=sys.stderr, flush=True)
+
+def print_progress_events(reporter, interval=1.0):
+    """消费进度事件流并输出到标准错误，页级事件最多每 interval 秒输出一次"""
+    from watermark_progress import format_progress
+    last = 0.0
+    for event in reporter:
+        if event["type"] not in ("file_start", "page", "file_done", "skipped"):
+            continue
+        now = time.monotonic()
+        if event["type"] != "file_done" and now - last < interval:
+            continue
+        last = now
+        print(f"进度: {format_progress(event)}", file=sys.stderr, flush=True)
+
+def run_batch_command(args):
+    from watermark_report import RunReport, Profiler
+    profiler = Profiler(args.profile)
+    with profiler:
+        code = _run_batch(args, RunReport(settings={k: v for k, v in vars(args).items() if k != "inputs"}))
+    if args.profile:
+        print(f"性能采样: {args.profile}（累计耗时最高的函数如下）", file=sys.stderr)
+        print(profiler.top(), file=sys.stderr)
+    return code
+
+def _run_batch(args, report):
+    start = time.perf_counter()
+    processed_wms, mode, custom, options = prepare_job(args)
+    report.add_stage("prepare_seconds", time.perf_counter() - start)
+    if args.output_dir != DEFAULT_OUTPUT_DIR:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    # 输入边遍历边处理；总文件数在遍历结束后才知道
+    from watermark_inputs import PdfWalker
+    paths = walker = PdfWalker(args.inputs, args.recursive, args.include, args.exclude,
+                               skip=lambda p: is_output_path(p, args.output_dir, args.suffix))
+    # 遍历目录得到的文件在输出目录中保留子目录结构
+    options["input_root"] = walker.output_root
+    progress = printer = None
+    if args.progress:
+        import threading
+        from watermark_progress import ProgressReporter
+        progress = ProgressReporter(len(args.inputs) if walker.is_listing else None)
+        walker.on_done = progress.set_total
+        printer = threading.Thread(target=print_progress_events, args=(progress,), daemon=True)
+        printer.start()
+    journal = None
+    if args.journal:
+        from watermark_journal import BatchJournal, job_hash
+        journal = BatchJournal(args.journal, job_hash(processed_wms, mode, custom, args.output_dir,
+                                                      args.suffix, options))
+        paths = journal.filter(paths, progress.file_skipped if progress else None)
+
+    workers = args.workers or os.cpu_count() or 1
+    shard = ()
+    if args.plan:
+        # 预扫描全部待处理文件，估算耗时后按从大到小的顺序提交
+        from watermark_plan import plan_batch, format_plan
+        start = time.perf_counter()
+        paths = list(paths)
+        plan = plan_batch(paths, mode, custom, workers, args.shard_threshold,
+                          can_shard=options["output_mode"] == "rewrite", processed_wms=processed_wms,
+                          shared_stamp=options["shared_stamp"])
+        report.add_stage("plan_seconds", time.perf_counter() - start)
+        print(f"计划: {format_plan(plan)}", flush=True)
+        if workers > 1:
+            paths = [f["path"] for f in plan["files"]]
+            shard = plan["shard"]
+
+    # 第一次 Ctrl+C 在当前页面完成后停止（不留下半个输出文件），第二次立即退出
+    control = JobControl()
+    def on_interrupt(signum, frame):
+        if control.cancelled: raise KeyboardInterrupt
+        control.cancel()
+        print("正在取消：当前页面完成后停止，再按一次 Ctrl+C 立即退出", file=sys.stderr, flush=True)
+    previous_handler = signal.signal(signal.SIGINT, on_interrupt)
+
+    if args.workers == 1:
+        results = iter_batch(paths, processed_wms, mode, custom, args.output_dir, args.suffix,
+                             progress=progress, control=control, **options)
+    else:
+        from watermark_parallel import iter_batch_parallel, DEFAULT_SHARD_THRESHOLD
+        shard_threshold = args.shard_threshold or DEFAULT_SHARD_THRESHOLD
+        results = iter_batch_parallel(paths, processed_wms, mode, custom, args.output_dir, args.suffix,
+                                      workers=workers, shard_threshold=shard_threshold,
+                                      progress=progress, control=control, shard=shard, **options)
+    count = failed = cancelled = 0
+    try:
+        for res in results:
+            if res.get("cancelled"):
+                cancelled += 1
+                report.add(res)
+                continue
+            print_result(res)
+            report.add(res)
+            if journal: journal.record(res)
+            if res["ok"]: count += 1
+            else: failed += 1
+    finally:
+        signal.signal(signal.SIGINT, previous_handler)
+        if journal: journal.close()
+        if progress:
+            progress.finish()
+            printer.join()
+    skipped = journal.skipped if journal else 0
+    # 直接给出的文件数已知；遍历输入在取消时只统计到已遍历的部分
+    total = len(args.inputs) if walker.is_listing else walker.found
+    report.finish(skipped, control.cancelled)
+    if args.report:
+        os.makedirs(os.path.dirname(os.path.abspath(args.report)), exist_ok=True)
+        print(f"运行报告: {report.write(args.report)}")
+    print(f"成功处理 {count}/{total} 个文件" + (f"，失败 {failed} 个" if failed else "")
+          + (f"，跳过已完成 {skipped} 个" if skipped else ""))
+    unprocessed = total - count - failed - skipped
+    # 取消时全部文件已经处理完的，按正常结束处理
+    if control.cancelled and (cancelled or unprocessed > 0 or not walker.done):
+        print(f"已取消：{unprocessed} 个文件未处理" if walker.done else "已取消：其余文件未处理", file=sys.stderr)
+        return 130
+    return 0 if failed == 0 else 1
+
+def run_watch_command(args):
+    from watermark_watch import watch_folders
+    processed_wms, mode, custom, options = prepare_job(args)
+    print(f"正在监控: {', '.join(args.inputs)} -> {args.output_dir}（Ctrl+C 退出）", flush=True)
+    try:
+        watch_folders(args.inputs, processed_wms, args.output_dir, mode, custom, args.suffix,
+                      workers=args.workers or None, interval=args.interval, settle=args.settle,
+                      max_pending=args.max_queue, on_result=print_result, **options)
+    except KeyboardInterrupt:
+        print("已停止监控")
+    return 0
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    if args.command == "batch":
+        return run_batch_command(args)
+    if args.command == "watch":
+        return run_watch_command(args)
+    if args.command == "bench":
+        from watermark_bench import run_bench_command
+        return run_bench_command(args)
+    if args.command == "encode-report":
+        return run_encode_report(args)
+    return 2
+
+if __name__ == "__main__":
+    sys.exit(main())
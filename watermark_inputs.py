@@ -0,0 +1,145 @@
+"""输入发现：把文件、目录（可递归）和通配符惰性展开为 PDF 路径流，边遍历边交给批处理"""
+import os
+import glob
+import fnmatch
+
+GLOB_CHARS = "*?["
+
+def _matches(rel_path, patterns):
+    """任一模式匹配相对路径（以 / 分隔）或文件名即为真"""
+    rel = rel_path.replace(os.sep, "/")
+    name = rel.rsplit("/", 1)[-1]
+    return any(fnmatch.fnmatch(rel, p) or fnmatch.fnmatch(name, p) for p in patterns)
+
+def glob_base(pattern):
+    """通配符之前的目录部分，即 glob 展开的起点目录"""
+    parts = []
+    for part in pattern.replace(os.sep, "/").split("/")[:-1]:
+        if any(c in part for c in GLOB_CHARS):
+            break
+        parts.append(part)
+    if parts == [""]:
+        return "/" # 形如 /*.pdf 的根目录通配符
+    return "/".join(parts) or os.curdir
+
+def walk_pdfs(folder, recursive=False, include=(), exclude=()):
+    """逐个目录用 os.scandir 遍历并立即产出 PDF 路径，不先列出整棵目录树
+
+    产出顺序即文件系统返回的顺序（不排序）。include 非空时文件需匹配其中一个模式；
+    exclude 同时作用于文件和子目录，被排除的子目录不会进入。不跟随目录的符号链接。
+    """
+    stack = [folder]
+    while stack:
+        current = stack.pop()
+        try:
+            it = os.scandir(current)
+        except OSError:
+            continue # 无权限或遍历过程中被删除的目录
+        with it:
+            for entry in it:
+                rel = os.path.relpath(entry.path, folder)
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                except OSError:
+                    continue
+                if is_dir:
+                    if recursive and not _matches(rel, exclude):
+                        stack.append(entry.path)
+                elif entry.name.lower().endswith(".pdf") and not _matches(rel, exclude) and \
+                     (not include or _matches(rel, include)):
+                    yield entry.path
+
+class PdfWalker:
+    """可重复迭代的输入源：inputs 中每项可以是 PDF 文件、目录或通配符（支持 **）
+
+    直接给出的文件原样保留；目录和通配符匹配到的文件按 include / exclude 过滤，
+    并跳过 skip(path) 为真的文件（如本次批处理写出的输出）。
+    每次迭代都重新遍历；found 为本次迭代已产出的文件数，遍历完时 done 为 True，
+    并调用 on_done(found)，便于在遍历结束后补上进度的总文件数。
+    """
+
+    def __init__(self, inputs, recursive=False, include=(), exclude=(), skip=None, on_done=None):
+        self.inputs = list(inputs)
+        self.recursive = recursive
+        self.include = list(include or ())
+        self.exclude = list(exclude or ())
+        self.skip = skip
+        self.on_done = on_done
+        self.found = 0
+        self.done = False
+
+    @property
+    def output_root(self):
+        """各目录和通配符输入共同的上级目录，输出时在输出目录中保留相对于它的子目录
+
+        只有直接给出的文件时为 None（输出都写在输出目录下）；
+        各输入位于不同驱动器、没有共同上级时也为 None。
+        """
+        roots = [os.path.abspath(item if os.path.isdir(item) else glob_base(item))
+                 for item in self.inputs if os.path.isdir(item) or any(c in item for c in GLOB_CHARS)]
+        if not roots:
+            return None
+        try:
+            return os.path.commonpath(roots)
+        except ValueError:
+            return None
+
+    @property
+    def is_listing(self):
+        """inputs 是否全部是直接给出的文件（文件数已知，无需遍历）"""
+        return all(not os.path.isdir(item) and not any(c in item for c in GLOB_CHARS) for item in self.inputs)
+
+    def iter_paths(self):
+        """不改变 found / done 的遍历，可与正在进行的迭代同时使用（如后台计数）"""
+        for item in self.inputs:
+            if os.path.isdir(item):
+                found = walk_pdfs(item, self.recursive, self.include, self.exclude)
+            elif any(c in item for c in GLOB_CHARS):
+                found = self._expand_glob(item)
+            else:
+                yield item
+                continue
+            for path in found:
+                if self.skip is None or not self.skip(path):
+                    yield path
+
+    def _expand_glob(self, pattern):
+        for match in glob.iglob(pattern, recursive=True):
+            if os.path.isdir(match):
+                yield from walk_pdfs(match, self.recursive, self.include, self.exclude)
+            elif match.lower().endswith(".pdf") and not _matches(match, self.exclude) and \
+                 (not self.include or _matches(match, self.include)):
+                yield match
+
+    def __iter__(self):
+        self.found = 0
+        self.done = False
+        for path in self.iter_paths():
+            self.found += 1
+            yield path
+        self.done = True
+        if self.on_done: self.on_done(self.found)
+
+    def count(self):
+        return sum(1 for _ in self.iter_paths())
+
+class PathCursor:
+    """按序号浏览输入源：只在翻到时才从遍历中取出路径，只保存浏览过的部分"""
+
+    def __init__(self, source):
+        self._it = source.iter_paths()
+        self._seen = []
+        self.exhausted = False
+
+    def get(self, index):
+        """第 index 个文件（从 0 开始），超出范围时返回 None"""
+        while index >= len(self._seen) and not self.exhausted:
+            try:
+                self._seen.append(next(self._it))
+            except StopIteration:
+                self.exhausted = True
+        return self._seen[index] if 0 <= index < len(self._seen) else None
+
+    @property
+    def known(self):
+        return len(self._seen)
@@ -0,0 +1,126 @@
+"""批处理断点续跑：记录每个已完成文件的内容哈希、任务哈希和输出路径"""
+import os
+import json
+import time
+import hashlib
+import tempfile
+
+DEFAULT_JOURNAL_FILE = os.path.join(os.path.expanduser("~"), ".pdf_watermark_journal.jsonl")
+
+def file_sig(path):
+    """文件的 (大小, 修改时间)，不存在时返回 None"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+def hash_file(path, chunk_size=1024 * 1024):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def job_hash(processed_wms, mode, custom, output_dir, suffix, options):
+    """预编译水印数据与全部输出设置的哈希，任何一项改变都会让已完成记录失效"""
+    h = hashlib.sha256()
+    for pwm in processed_wms:
+        for k in sorted(pwm):
+            v = pwm[k]
+            h.update(k.encode())
+            h.update(v if isinstance(v, bytes) else repr(v).encode())
+    h.update(repr((mode, sorted(custom or ()), os.path.abspath(output_dir), suffix,
+                   sorted(options.items()))).encode())
+    return h.hexdigest()
+
+class BatchJournal:
+    """追加写入的 JSON Lines 日志，每完成一个文件写一行并立即落盘
+
+    同一输入文件以最后一条记录为准。重新运行时，任务哈希相同、输入内容未变、
+    输出文件仍是当时写出的那个时跳过；失败的文件会重新处理。
+    """
+
+    def __init__(self, path=DEFAULT_JOURNAL_FILE, job=""):
+        self.path = path
+        self.job = job
+        self.entries = {}
+        self.skipped = 0
+        self._input_hashes = {}
+        self._load()
+        self._f = open(self.path, "a", encoding="utf-8")
+
+    def _load(self):
+        lines = 0
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    lines += 1
+                    try: entry = json.loads(line)
+                    except ValueError: continue # 断电时可能残留半行
+                    self.entries[entry["input"]] = entry
+        except OSError:
+            return
+        # 被覆盖的旧记录过多时压缩日志
+        if lines > 2 * len(self.entries) + 100:
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)), suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                for entry in self.entries.values():
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            os.replace(tmp, self.path)
+
+    def _input_hash(self, path, entry=None):
+        # 大小和修改时间与记录一致时直接沿用记录的哈希，避免重读大文件
+        if entry and file_sig(path) == entry.get("input_sig"):
+            return entry["input_hash"]
+        return hash_file(path)
+
+    def is_done(self, path):
+        key = os.path.abspath(path)
+        entry = self.entries.get(key)
+        if not entry or entry.get("status") != "ok" or entry.get("job") != self.job:
+            return False
+        if file_sig(entry["output"]) != entry.get("output_sig"):
+            return False # 输出已被删除或改动
+        if entry["output"] == key:
+            return True  # 原地追加模式：当前文件本身就是已完成的输出
+        try:
+            input_hash = self._input_hash(path, entry)
+        except OSError:
+            return False
+        self._input_hashes[key] = input_hash
+        return input_hash == entry["input_hash"]
+
+    def filter(self, paths, on_skip=None):
+        """惰性过滤掉已完成的文件（每跳过一个调用 on_skip(path)），并在处理前记下输入文件的哈希"""
+        for path in paths:
+            if self.is_done(path):
+                self.skipped += 1
+                if on_skip: on_skip(path)
+                continue
+            key = os.path.abspath(path)
+            if key not in self._input_hashes:
+                try: self._input_hashes[key] = hash_file(path)
+                except OSError: self._input_hashes[key] = None
+            yield path
+
+    def record(self, result):
+        key = os.path.abspath(result["path"])
+        entry = {
+            "input": key,
+            "input_hash": self._input_hashes.pop(key, None),
+            "input_sig": file_sig(key),
+            "job": self.job,
+            "status": "ok" if result["ok"] else "failed",
+            "output": os.path.abspath(result["output"]) if result.get("output") else None,
+            "output_sig": file_sig(result["output"]) if result.get("output") else None,
+            "error": result.get("error"),
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        self.entries[key] = entry
+        self._f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._f.flush()
+        os.fsync(self._f.fileno())
+
+    def close(self):
+        self._f.close()
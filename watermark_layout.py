@@ -0,0 +1,76 @@
+"""阵列（铺满）水印的格点布局，预览和导出共用，保证两者位置一致"""
+import math
+
+def _axis(origin, gap, lo, hi):
+    """origin + k*gap 落在 [lo, hi] 内的全部 (k, 坐标)，直接由区间端点算出 k 的范围"""
+    k0 = math.ceil((lo - origin) / gap)
+    k1 = math.floor((hi - origin) / gap)
+    return [(k, origin + k * gap) for k in range(k0, k1 + 1)]
+
+def rotated_half_extents(stamp_w, stamp_h, angle=0):
+    """水印旋转 angle 度后外接矩形的半宽、半高"""
+    rad = math.radians(angle)
+    c, s = abs(math.cos(rad)), abs(math.sin(rad))
+    return (stamp_w * c + stamp_h * s) / 2, (stamp_w * s + stamp_h * c) / 2
+
+def text_stamp_size(content, size):
+    """预览中文字水印的保守估计尺寸（正方形边长）
+
+    画布文字以位置为中心绘制且可任意旋转，取覆盖任意角度下整段文字的正方形，
+    按每字一个字号宽估算，只会多保留格点，不会误删可见的水印。导出见 text_extent。
+    """
+    return math.hypot(size * max(1, len(content)), size)
+
+def text_extent(width, size, angle=0):
+    """insert_text 绘制的文字相对插入点（基线起点）的外接矩形 (x0, y0, x1, y1)，y 轴向上
+
+    文字从插入点沿 angle 方向（insert_text 只支持 90 度的整数倍，逆时针）延伸 width；
+    垂直于基线方向向上留一个字号给字身，向下留 0.3 个字号给下伸部分。
+    """
+    rad = math.radians(angle)
+    c, s = math.cos(rad), math.sin(rad)
+    corners = [(x * c - y * s, x * s + y * c) for x in (0, width) for y in (-0.3 * size, size)]
+    xs, ys = [p[0] for p in corners], [p[1] for p in corners]
+    return min(xs), min(ys), max(xs), max(ys)
+
+def grid_settings(wm):
+    """从水印字典中取出阵列参数（带默认值），供预编译数据和模板使用"""
+    return {
+        "grid_mode": wm.get('grid_mode', False),
+        "grid_gap_x": wm.get('grid_gap_x', 150),
+        "grid_gap_y": wm.get('grid_gap_y', 150),
+        "grid_offset_x": wm.get('grid_offset_x', 0),
+        "grid_offset_y": wm.get('grid_offset_y', 0),
+        "grid_stagger": wm.get('grid_stagger', False),
+    }
+
+def grid_positions(page_w, page_h, gap_x, gap_y, stamp_w=0, stamp_h=0, angle=0,
+                   offset_x=0, offset_y=0, stagger=False, extent=None):
+    """阵列模式下需要绘制的全部水印中心点 [(x, y), ...]，单位为点，y 轴向上
+
+    格点为 (offset_x + i*gap_x, offset_y + j*gap_y)；stagger 为 True 时奇数行
+    错开半个横向间距（砖墙排列）。格点向页面四周延伸，水印（stamp_w x stamp_h，
+    旋转 angle 度）的外接矩形与页面相交的格点都会保留，边缘的半个水印也能铺到；
+    完全落在页面外的格点直接由行列范围剔除，不逐个判断。
+    水印不以格点为中心时（如从基线起点绘制的文字），用 extent 给出其相对格点的
+    外接矩形 (x0, y0, x1, y1)，代替由 stamp_w、stamp_h、angle 得到的居中矩形。
+    """
+    gap_x, gap_y = max(1.0, float(gap_x)), max(1.0, float(gap_y))
+    if extent is None:
+        half_w, half_h = rotated_half_extents(stamp_w, stamp_h, angle)
+        extent = (-half_w, -half_h, half_w, half_h)
+    x0, y0, x1, y1 = extent
+    rows = _axis(offset_y, gap_y, -y1, page_h - y0)
+    if not rows:
+        return []
+    cols = [[x for _, x in _axis(offset_x + (gap_x / 2 if stagger and parity else 0), gap_x, -x1, page_w - x0)]
+            for parity in (0, 1)]
+    return [(x, y) for j, y in rows for x in cols[j % 2]]
+
+def wm_positions(page_w, page_h, wm, stamp_w=0, stamp_h=0, angle=0, extent=None):
+    """水印在页面上的全部位置：阵列模式按 grid_positions 布局，否则只有 (x, y) 一处"""
+    if not wm.get('grid_mode'):
+        return [(wm['x'], wm['y'])]
+    g = grid_settings(wm)
+    return grid_positions(page_w, page_h, g['grid_gap_x'], g['grid_gap_y'], stamp_w, stamp_h, angle,
+                          g['grid_offset_x'], g['grid_offset_y'], g['grid_stagger'], extent)
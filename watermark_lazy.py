@@ -0,0 +1,71 @@
+"""延迟导入与字体列表缓存：让界面窗口先出现，重量级模块和系统字体枚举推迟到真正用到时"""
+import os
+import sys
+import json
+import importlib.util
+
+FONT_CACHE_FILE = os.path.join(os.path.expanduser("~"), ".pdf_watermark_fonts.json")
+
+def lazy_import(name):
+    """返回模块 name 的延迟加载代理，第一次访问其属性时才执行模块代码
+
+    用于 PyMuPDF、Pillow 等导入耗时的模块；模块已导入过时直接返回。
+    找不到模块时立即抛出 ImportError，依赖检查不受影响。
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f"No module named {name!r}", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+def font_dirs():
+    """当前系统的字体目录（含用户目录），只返回存在的"""
+    home = os.path.expanduser("~")
+    if sys.platform == "win32":
+        dirs = [os.path.join(os.environ.get("WINDIR", r"C:\Windows"), "Fonts"),
+                os.path.join(os.environ.get("LOCALAPPDATA", ""), "Microsoft", "Windows", "Fonts")]
+    elif sys.platform == "darwin":
+        dirs = ["/System/Library/Fonts", "/Library/Fonts", os.path.join(home, "Library", "Fonts")]
+    else:
+        dirs = ["/usr/share/fonts", "/usr/local/share/fonts", os.path.join(home, ".fonts"),
+                os.path.join(home, ".local", "share", "fonts")]
+    return [d for d in dirs if os.path.isdir(d)]
+
+def font_set_signature():
+    """字体目录及其一级子目录的修改时间和条目数：安装或删除字体后会改变"""
+    sig = []
+    for d in font_dirs():
+        try:
+            with os.scandir(d) as it:
+                entries = list(it)
+            sig.append([d, os.stat(d).st_mtime_ns, len(entries)])
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    sig.append([entry.path, entry.stat(follow_symlinks=False).st_mtime_ns])
+        except OSError:
+            continue
+    return sig
+
+def load_cached_fonts(signature, cache_file=FONT_CACHE_FILE):
+    """字体集未变时返回上次缓存的字体名列表，否则返回 None"""
+    try:
+        with open(cache_file, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if data.get("signature") != signature:
+        return None
+    return data.get("families")
+
+def save_cached_fonts(signature, families, cache_file=FONT_CACHE_FILE):
+    try:
+        with open(cache_file, "w", encoding="utf-8") as f:
+            json.dump({"signature": signature, "families": families}, f, ensure_ascii=False)
+    except OSError:
+        pass
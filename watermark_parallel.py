@@ -0,0 +1,280 @@
+"""多进程批量处理：把文件（以及超大文件的页面分片）分散到多个 CPU 核心上加水印"""
+import os
+import math
+import signal
+import multiprocessing
+import time
+import shutil
+import tempfile
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, CancelledError, wait, FIRST_COMPLETED
+
+from watermark_lazy import lazy_import
+fitz = lazy_import("fitz")  # PyMuPDF
+
+from watermark_engine import (DEFAULT_OUTPUT_DIR, DEFAULT_SUFFIX, DEFAULT_SAVE_PROFILE, MemoryBudgetExceeded,
+                              get_output_path, is_page_selected, plan_page_window, run_file, save_document,
+                              stamp_pages)
+from watermark_progress import JobCancelled, JobControl
+from watermark_report import peak_rss_bytes, reset_peak_rss
+
+# 页数达到此值的文件会被拆成页面分片并行处理
+DEFAULT_SHARD_THRESHOLD = 1000
+
+# 有任务在途时主进程每隔这么多秒检查一次暂停和取消，并转告工作进程
+CONTROL_POLL_SECONDS = 0.2
+
+# 分片统计中按文件累加的字段
+SHARD_SUM_KEYS = ["pages", "images_deduped", "images_inserted", "texts_inserted",
+                  "open_seconds", "stamp_seconds", "save_seconds"]
+
+# 每个工作进程在启动时收到一次的任务参数（预编译水印、页面范围、输出设置及其他选项）
+_worker_job = {}
+
+def init_worker(processed_wms, mode, custom, output_dir, suffix, options, cancel_event=None, running_event=None):
+    # Ctrl+C 由主进程统一处理（取消或停止监控），工作进程不响应，避免进程池被中断
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # 两个事件由主进程按其 JobControl 的状态设置：正在运行的文件和分片在下一页之前暂停或停止
+    control = JobControl(cancel_event, running_event) if cancel_event is not None else None
+    _worker_job.update(processed_wms=processed_wms, mode=mode, custom=custom,
+                       output_dir=output_dir, suffix=suffix, options=options, control=control)
+
+def run_in_worker(path):
+    job = _worker_job
+    result = run_file(path, job["processed_wms"], job["mode"], job["custom"],
+                      job["output_dir"], job["suffix"], control=job["control"], **job["options"])
+    result["worker"] = os.getpid()
+    return result
+
+def _stamp_shard_in_worker(path, start, stop, shard_path):
+    """只为 [start, stop) 范围内的页面加水印，并把这些页面单独保存为分片，返回统计数据"""
+    job = _worker_job
+    stats = {}
+    reset_peak_rss()
+    t0 = time.perf_counter()
+    doc = fitz.open(path)
+    try:
+        doc.select(range(start, stop))
+        stats["open_seconds"] = time.perf_counter() - t0
+        page_indices = [j for j in range(len(doc)) if is_page_selected(start + j, job["mode"], job["custom"])]
+        t0 = time.perf_counter()
+        control = job["control"]
+        stamp_pages(doc, page_indices, job["processed_wms"], job["options"].get("shared_stamp", False), stats,
+                    on_page=control.checkpoint if control is not None else None)
+        stats["stamp_seconds"] = time.perf_counter() - t0
+        stats["pages"] = len(page_indices)
+        # 页码换算回原文件中的位置
+        stats["page_times"] = [[start + j, t] for j, t in stats["page_times"]]
+        t0 = time.perf_counter()
+        # select 只删去页面引用，其余页面的内容和资源仍在文档中；garbage=1 只写出本分片用到的对象
+        doc.save(shard_path, garbage=1)
+        stats["save_seconds"] = time.perf_counter() - t0
+    finally:
+        doc.close()
+    stats["peak_rss_bytes"] = peak_rss_bytes()
+    return stats
+
+# --- 页面分片 ---
+def count_pages(path):
+    try:
+        with fitz.open(path) as doc:
+            return doc.page_count
+    except Exception:
+        # 打不开的文件交给普通流程处理并报告错误
+        return 0
+
+def split_page_ranges(page_count, shards):
+    step = max(1, math.ceil(page_count / shards))
+    return [(a, min(a + step, page_count)) for a in range(0, page_count, step)]
+
+def merge_shards(src_path, shard_paths, save_path, save_profile=DEFAULT_SAVE_PROFILE, stats=None):
+    """按顺序合并分片，并从原文件恢复目录、链接、页码标签和元数据"""
+    src = fitz.open(src_path)
+    out = fitz.open()
+    try:
+        for shard_path in shard_paths:
+            with fitz.open(shard_path) as shard:
+                # 分片中指向其他分片的链接已丢失，这里不复制，统一按原文件重建
+                out.insert_pdf(shard, links=False)
+
+        for i in range(src.page_count):
+            links = src.load_page(i).get_links()
+            if links:
+                page = out.load_page(i)
+                for link in links:
+                    try: page.insert_link(link)
+                    except Exception: pass
+
+        out.set_toc(src.get_toc(simple=False))
+        labels = src.get_page_labels()
+        if labels: out.set_page_labels(labels)
+        out.set_metadata(src.metadata)
+        # 按保存方案写出；各分片重复携带的水印图片、字体等只在 compact / web 方案下去重
+        # （fast 方案的输出因此比不分片时大，见 --shard-threshold 的说明），
+        # 不再强制 garbage=3，以免合并时的全量去重抵消并行带来的收益
+        save_document(out, save_path, save_profile, stats)
+    finally:
+        out.close()
+        src.close()
+    return save_path
+
+# --- 批量调度 ---
+def iter_batch_parallel(paths, processed_wms, mode="全部页面", custom=None,
+                        output_dir=DEFAULT_OUTPUT_DIR, suffix=DEFAULT_SUFFIX, workers=None,
+                        shard_threshold=None, progress=None, control=None, shard=(), lock=None, **options):
+    """用进程池处理文件，按完成顺序产出结果记录
+
+    workers 为空时使用全部 CPU 核心。paths 可以是惰性的迭代器：
+    同时在途的任务数限制为 workers 的数倍，避免一次性提交数万个任务。
+    设置 shard_threshold 后，页数不少于该值的文件按页面范围拆给多个进程，
+    全部分片完成后在当前进程合并为一个输出文件；shard 中的文件（如预扫描计划选出的
+    耗时突出的文件）不论页数都拆成分片。
+    options 与 iter_batch 相同，随初始化参数一次性发给每个工作进程。
+    progress 为 ProgressReporter 时在当前进程中报告进度：整个文件在其完成时计入，
+    分片文件每完成一个分片计入一段页数。
+    control 为 JobControl 时，其状态每隔 CONTROL_POLL_SECONDS 秒转告工作进程：
+    暂停期间不再提交新任务，工作进程在当前页面完成后停下；取消后撤回尚未开始的任务，
+    工作进程在当前页面完成后放弃正在处理的文件和分片（不会留下半个文件）。
+    options 中的 memory_limit 由各工作进程平分；按平分后的额度分段也放不下的文件
+    留到进程池关闭后，在当前进程中以完整额度逐个处理。
+    lock 为当前进程中调用 PyMuPDF（页数统计、内存估算、分片合并、上述逐个处理）前
+    要取得的锁，如界面的渲染锁；等待工作进程期间不持有。
+    """
+    lock = lock or contextlib.nullcontext()
+    workers = workers or os.cpu_count() or 1
+    max_pending = workers * 4
+    paths = iter(paths)
+    memory_limit = options.get("memory_limit")
+    worker_options = dict(options, memory_limit=memory_limit // workers) if memory_limit else options
+    serialized = []  # 超出单个进程内存额度、需要单独处理的文件
+    cancel_event = running_event = None
+    if control is not None:
+        cancel_event, running_event = multiprocessing.Event(), multiprocessing.Event()
+        running_event.set()
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(processed_wms, mode, custom, output_dir, suffix, worker_options,
+                                       cancel_event, running_event)) as pool:
+        pending = {}  # future -> (path, 提交时间, 分片状态或 None)
+
+        def submit(path):
+            now = time.perf_counter()
+            if memory_limit:
+                try:
+                    with lock:
+                        plan_page_window(path, processed_wms, mode, custom, worker_options["memory_limit"])
+                except MemoryBudgetExceeded:
+                    serialized.append(path)
+                    return
+                except Exception:
+                    pass # 打不开的文件交给工作进程报告错误
+            # 增量追加输出无法合并分片，始终按整个文件处理
+            can_shard = (shard_threshold or shard) and workers > 1 and options.get("output_mode", "rewrite") == "rewrite"
+            with lock:
+                page_count = count_pages(path) if can_shard else 0
+            if page_count > 1 and (path in shard or (shard_threshold and page_count >= shard_threshold)):
+                shard_dir = tempfile.mkdtemp(prefix="wm_shards_")
+                ranges = split_page_ranges(page_count, workers)
+                shard_paths = [os.path.join(shard_dir, f"{k}.pdf") for k in range(len(ranges))]
+                group = {"dir": shard_dir, "shards": shard_paths, "remaining": len(ranges),
+                         "error": None, "start": now, "page_times": [],
+                         **{key: 0 for key in SHARD_SUM_KEYS}}
+                if progress is not None:
+                    progress.file_started(path, sum(1 for i in range(page_count) if is_page_selected(i, mode, custom)))
+                for (a, b), shard_path in zip(ranges, shard_paths):
+                    pending[pool.submit(_stamp_shard_in_worker, path, a, b, shard_path)] = (path, now, group)
+            else:
+                pending[pool.submit(run_in_worker, path)] = (path, now, None)
+
+        def finish_group(path, group):
+            result = {"path": path, "ok": False, "output": None, "error": group["error"],
+                      "shards": len(group["shards"]), "page_times": sorted(group["page_times"]),
+                      "peak_rss_bytes": group.get("peak_rss_bytes"),
+                      **{key: group[key] for key in SHARD_SUM_KEYS}}
+            # 各分片在工作进程中的保存耗时单独记录，save_seconds 留给合并后的最终保存
+            result["shard_save_seconds"] = result.pop("save_seconds")
+            if group.get("cancelled"): result["cancelled"] = True
+            try:
+                if not group["error"]:
+                    t0 = time.perf_counter()
+                    save_path = get_output_path(path, output_dir, suffix, options.get("input_root"))
+                    os.makedirs(os.path.dirname(save_path) or os.curdir, exist_ok=True)
+                    with lock:
+                        result["output"] = merge_shards(path, group["shards"], save_path,
+                                                        options.get("save_profile", DEFAULT_SAVE_PROFILE), result)
+                    result["merge_seconds"] = time.perf_counter() - t0
+                    result["ok"] = True
+            except Exception as e:
+                result["error"] = str(e)
+            finally:
+                shutil.rmtree(group["dir"], ignore_errors=True)
+            result["seconds"] = result["elapsed"] = time.perf_counter() - group["start"]
+            return result
+
+        cancel_sent = False
+        while True:
+            if control is not None:
+                if not pending: control.wait() # 暂停且没有在途任务时在此等待
+                if control.paused: running_event.clear()
+                else: running_event.set()
+                if control.cancelled and not cancel_sent:
+                    cancel_sent = True
+                    cancel_event.set()
+                    for fut in pending: fut.cancel()
+            # 补充任务直到在途任务数达到上限
+            if control is None or not (control.cancelled or control.paused):
+                for path in paths:
+                    submit(path)
+                    if len(pending) >= max_pending:
+                        break
+            if not pending:
+                break
+
+            # 有 control 时定时醒来，暂停和取消不必等到某个任务完成才转告工作进程
+            done, _ = wait(pending, timeout=CONTROL_POLL_SECONDS if control is not None else None,
+                           return_when=FIRST_COMPLETED)
+            for fut in done:
+                path, submitted, group = pending.pop(fut)
+                if group is not None:
+                    try:
+                        shard_stats = fut.result()
+                        for key in SHARD_SUM_KEYS:
+                            group[key] += shard_stats.get(key, 0)
+                        group["peak_rss_bytes"] = max(group.get("peak_rss_bytes") or 0,
+                                                      shard_stats.get("peak_rss_bytes") or 0)
+                        group["page_times"].extend(shard_stats.get("page_times", []))
+                        if progress is not None: progress.add_pages(path, shard_stats.get("pages", 0))
+                    except (CancelledError, JobCancelled):
+                        group["error"], group["cancelled"] = group["error"] or "已取消", True
+                    except Exception as e: group["error"] = group["error"] or str(e)
+                    group["remaining"] -= 1
+                    if group["remaining"] == 0:
+                        result = finish_group(path, group)
+                        if progress is not None: progress.file_done(result)
+                        yield result
+                    continue
+
+                try:
+                    result = fut.result()
+                except CancelledError:
+                    result = {"path": path, "ok": False, "output": None, "error": "已取消", "cancelled": True, "seconds": 0.0}
+                except Exception as e:
+                    # 工作进程异常退出等情况
+                    result = {"path": path, "ok": False, "output": None, "error": str(e), "seconds": 0.0}
+                # 含排队等待在内的总耗时
+                result["elapsed"] = time.perf_counter() - submitted
+                if progress is not None: progress.file_done(result)
+                yield result
+
+    # 进程池已关闭，其他进程占用的内存均已释放
+    for path in serialized:
+        if control is not None:
+            control.wait()
+            if control.cancelled: return
+        start = time.perf_counter()
+        with lock:
+            result = run_file(path, processed_wms, mode, custom, output_dir, suffix, progress, control, **options)
+        result["serialized"] = True
+        result["elapsed"] = time.perf_counter() - start
+        yield result
+        if result.get("cancelled"): return
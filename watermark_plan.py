@@ -0,0 +1,142 @@
+"""批处理预扫描与调度：不加水印地读取每个文件的页数、页面尺寸和体积，估算耗时后大文件优先"""
+import os
+import heapq
+import contextlib
+
+from watermark_lazy import lazy_import
+fitz = lazy_import("fitz")  # PyMuPDF
+
+from watermark_engine import is_page_selected, wm_placements
+from watermark_progress import format_duration
+
+# 耗时模型的经验系数（秒），用于排序和粗略预估，不追求精确
+FILE_SECONDS = 0.05             # 每个文件的打开、保存等固定开销
+PAGE_SECONDS = 0.01             # 每个 A4 大小页面读写内容的耗时（不含绘制水印），按面积折算
+IMAGE_SECONDS = 0.001           # 每放置一次图片水印（引用已嵌入的图片）
+TEXT_SECONDS = 0.0015           # 每放置一次文字水印
+BYTE_SECONDS = 1 / (200 * 1024 * 1024)  # 读写每字节的耗时（约 200 MB/s）
+A4_AREA = 595 * 842
+# 页数不少于此值、耗时超过平均每个进程工作量、且按模型估算分片后更快的文件，
+# 即使未达到分片阈值也拆成页面分片
+MIN_SHARD_PAGES = 100
+
+def _page_size(doc, i):
+    # page_cropbox 不构造页面对象，旧版 PyMuPDF 没有时退回 load_page
+    try:
+        rect = doc.page_cropbox(i)
+    except AttributeError:
+        rect = doc.load_page(i).rect
+    return rect.width, rect.height
+
+def stamp_seconds(page_w, page_h, processed_wms, cache=None):
+    """在 page_w x page_h 的页面上绘制全部水印的估算耗时，按实际放置次数（阵列格点数）计
+
+    cache 为 {(宽, 高): 秒} 字典时，同一尺寸只计算一次。
+    """
+    key = (round(page_w), round(page_h))
+    if cache is not None and key in cache:
+        return cache[key]
+    seconds = sum(len(wm_placements(pwm, page_w, page_h)) * (IMAGE_SECONDS if pwm['type'] == 'image' else TEXT_SECONDS)
+                  for pwm in processed_wms)
+    if cache is not None: cache[key] = seconds
+    return seconds
+
+def scan_file(path, mode="全部页面", custom=None, processed_wms=(), shared_stamp=False, cache=None):
+    """读取一个文件的页数、选中页数、页面尺寸分布和体积，并估算单进程处理耗时
+
+    耗时按页面面积和 processed_wms 在各尺寸页面上的放置次数估算；shared_stamp 为 True 时
+    每种页面尺寸只绘制一次水印层。cache 见 stamp_seconds。
+    """
+    info = {"path": path, "pages": 0, "selected": 0, "file_size": 0, "page_sizes": {}, "error": None}
+    cost = FILE_SECONDS
+    try:
+        info["file_size"] = os.path.getsize(path)
+        with fitz.open(path) as doc:
+            info["pages"] = doc.page_count
+            sizes = {}
+            for i in range(doc.page_count):
+                if not is_page_selected(i, mode, custom):
+                    continue
+                w, h = _page_size(doc, i)
+                key = f"{round(w)}x{round(h)}"
+                sizes[key] = sizes.get(key, 0) + 1
+                cost += PAGE_SECONDS * w * h / A4_AREA
+                if not shared_stamp or sizes[key] == 1:
+                    cost += stamp_seconds(w, h, processed_wms, cache)
+                info["selected"] += 1
+        info["page_sizes"] = sizes
+    except Exception as e:
+        # 打不开的文件仍参与处理，由正常流程报告错误
+        info["error"] = str(e)
+    info["cost"] = cost + BYTE_SECONDS * info["file_size"]
+    return info
+
+def merge_cost(info):
+    """分片合并的估算耗时：在主进程中读入全部分片并写出一次"""
+    return 2 * BYTE_SECONDS * info["file_size"]
+
+def sharded_cost(info, workers):
+    """拆成 workers 个分片时该文件的估算耗时
+
+    每个分片都要打开并读取整个原文件，再加上最后的合并。
+    """
+    return info["cost"] / workers + FILE_SECONDS + BYTE_SECONDS * info["file_size"] + merge_cost(info)
+
+def plan_batch(paths, mode="全部页面", custom=None, workers=1, shard_threshold=None, can_shard=True, lock=None,
+               processed_wms=(), shared_stamp=False):
+    """预扫描全部文件并给出调度计划
+
+    返回字典：files 为按估算耗时从大到小排列的扫描结果，shard 为需要拆成页面分片的文件，
+    estimated_seconds 为按“最长任务优先”分配到 workers 个进程后的预计总耗时。
+    lock 为扫描每个文件时要取得的锁（如界面的渲染锁），文件之间释放。
+    processed_wms 与 shared_stamp 与处理时相同，用于按水印的放置次数估算每页耗时。
+    """
+    lock = lock or contextlib.nullcontext()
+    cache = {}
+    def scan(path):
+        with lock:
+            return scan_file(path, mode, custom, processed_wms, shared_stamp, cache)
+    files = sorted((scan(p) for p in paths), key=lambda f: f["cost"], reverse=True)
+    total_cost = sum(f["cost"] for f in files)
+    shard = set()
+    if can_shard and workers > 1:
+        share = total_cost / workers
+        for f in files:
+            if f["error"] or f["pages"] < 2:
+                continue
+            if (shard_threshold and f["pages"] >= shard_threshold) or \
+               (f["pages"] >= MIN_SHARD_PAGES and f["cost"] > share and sharded_cost(f, workers) < f["cost"]):
+                shard.add(f["path"])
+
+    # 模拟最长任务优先调度：每个任务交给当前负载最小的进程，分片文件平均分给所有进程
+    loads = [0.0] * max(1, workers)
+    for f in files:
+        if f["path"] in shard:
+            piece = sharded_cost(f, workers) - merge_cost(f)
+            for _ in range(workers):
+                heapq.heapreplace(loads, loads[0] + piece)
+        else:
+            heapq.heapreplace(loads, loads[0] + f["cost"])
+    # 分片文件最后还要在主进程中合并一次
+    merge = sum(merge_cost(f) for f in files if f["path"] in shard)
+    return {
+        "files": files,
+        "shard": shard,
+        "workers": workers,
+        "total_pages": sum(f["selected"] for f in files),
+        "total_bytes": sum(f["file_size"] for f in files),
+        "largest": files[0] if files else None,
+        "estimated_seconds": max(loads) + merge,
+    }
+
+def format_plan(plan):
+    """一行计划摘要，用于命令行输出和界面状态栏"""
+    parts = [f"{len(plan['files'])} 个文件", f"{plan['total_pages']} 页",
+             f"{plan['total_bytes'] / 1024 / 1024:.0f} MB"]
+    largest = plan["largest"]
+    if largest and len(plan["files"]) > 1:
+        parts.append(f"最大 {os.path.basename(largest['path'])}（{largest['selected']} 页）")
+    if plan["shard"]:
+        parts.append(f"分片 {len(plan['shard'])} 个")
+    parts.append(f"{plan['workers']} 个进程预计约 {format_duration(plan['estimated_seconds'])}")
+    return " · ".join(parts)
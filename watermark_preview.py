@@ -0,0 +1,267 @@
+"""预览相关的缓存：渲染好的页面位图及其后台预取"""
+import time
+import queue
+import threading
+from collections import OrderedDict
+
+from watermark_lazy import lazy_import
+Image = lazy_import("PIL.Image")
+ImageEnhance = lazy_import("PIL.ImageEnhance")
+fitz = lazy_import("fitz")  # PyMuPDF
+
+PREVIEW_DPI = 144
+DEFAULT_PAGE_CACHE_MB = 256
+
+# 预览缩放按此步长（dpi）取整后渲染，避免拖动缩放滑块时产生大量只差一点的缓存条目
+ZOOM_DPI_STEP = 8
+
+# 渲染后像素数超过此值的页面（如大幅面图纸）只渲染可见区域的瓦片
+TILE_MIN_PIXELS = 16 * 1024 * 1024
+TILE_SIZE = 512
+
+DEFAULT_SPRITE_CACHE_MB = 128
+# 拖动旋转/缩放手柄时使用的低质量底图的最大边长（像素）
+SPRITE_BASE_MAX = 512
+
+# 属性连续变化时预览最多每隔这么多毫秒重绘一次（约一帧）
+FRAME_MS = 16
+
+# PyMuPDF 不支持多线程同时调用：界面线程、预取线程和批处理线程调用 PyMuPDF 前都要先取得此锁。
+# 界面线程只用 try_acquire_render_lock 尝试获取，取不到时稍后重试，不会因批处理而卡住；
+# 单进程批处理在每页之间让出（见 RenderLockedControl），多进程批处理的加水印在工作进程中进行
+RENDER_LOCK = threading.RLock()
+# 界面线程取不到渲染锁时，隔这么多毫秒重试
+RENDER_RETRY_MS = 50
+# 界面线程在等锁时，批处理线程每页之间最多让出这么久（秒），覆盖一次重试间隔
+RENDER_YIELD_SECONDS = 2 * RENDER_RETRY_MS / 1000
+_render_wanted = threading.Event()
+
+def try_acquire_render_lock():
+    """界面线程使用：不阻塞地获取 RENDER_LOCK，取到时返回 True（调用方负责 release）
+
+    取不到时登记请求，批处理线程在下一页之前让出锁，界面在下一次重试时即可取得。
+    """
+    if RENDER_LOCK.acquire(blocking=False):
+        _render_wanted.clear()
+        return True
+    _render_wanted.set()
+    return False
+
+class RenderLockedControl:
+    """供单进程批处理线程使用的 JobControl 包装
+
+    调用方在整个批处理期间持有 RENDER_LOCK；每页之间的检查点和暂停等待时让出，
+    界面线程等锁时留出一次重试的时间，翻页和缩放最多等待当前这一页（或当前文件的保存）完成。
+    """
+
+    def __init__(self, control):
+        self._control = control
+
+    @property
+    def cancelled(self):
+        return self._control.cancelled
+
+    @property
+    def paused(self):
+        return self._control.paused
+
+    def wait(self):
+        self._released(self._control.wait)
+
+    def checkpoint(self):
+        self._released(self._control.checkpoint)
+
+    def _released(self, func):
+        RENDER_LOCK.release()
+        try:
+            deadline = time.perf_counter() + RENDER_YIELD_SECONDS
+            while _render_wanted.is_set() and time.perf_counter() < deadline:
+                time.sleep(0.005)
+            func()
+        finally:
+            RENDER_LOCK.acquire()
+
+def zoom_to_dpi(zoom):
+    return max(ZOOM_DPI_STEP, int(round(PREVIEW_DPI * zoom / ZOOM_DPI_STEP)) * ZOOM_DPI_STEP)
+
+def _visual_size(page):
+    rect = page.rect
+    return (rect.height, rect.width) if page.rotation % 180 == 90 else (rect.width, rect.height)
+
+def page_geometry(doc, page_idx, dpi):
+    """不渲染页面，返回 (像素宽, 像素高, 视觉宽度, 视觉高度)"""
+    page = doc.load_page(page_idx)
+    irect = (page.rect * fitz.Matrix(dpi / 72, dpi / 72)).irect
+    vis_w, vis_h = _visual_size(page)
+    return irect.width, irect.height, vis_w, vis_h
+
+def needs_tiles(pixel_w, pixel_h):
+    return pixel_w * pixel_h > TILE_MIN_PIXELS
+
+def _pixmap_to_image(pix):
+    # 直接使用像素数据，省去 PPM 编码再解码的往返
+    return Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+
+def render_page(doc, page_idx, dpi=PREVIEW_DPI):
+    """渲染页面，返回 (PIL 图像, 视觉宽度, 视觉高度)，宽高单位为点并已考虑页面旋转"""
+    page = doc.load_page(page_idx)
+    img = _pixmap_to_image(page.get_pixmap(dpi=dpi))
+    vis_w, vis_h = _visual_size(page)
+    return img, vis_w, vis_h
+
+def render_tile(doc, page_idx, dpi, tx, ty, tile_size=TILE_SIZE):
+    """只渲染第 (tx, ty) 块瓦片，瓦片在整页位图中的左上角为 (tx*tile_size, ty*tile_size)"""
+    page = doc.load_page(page_idx)
+    s = 72 / dpi
+    # 裁剪区域使用与 page.rect 相同的（已旋转的）坐标
+    clip = fitz.Rect(tx * tile_size * s, ty * tile_size * s, (tx + 1) * tile_size * s, (ty + 1) * tile_size * s)
+    return (_pixmap_to_image(page.get_pixmap(dpi=dpi, clip=clip)),)
+
+class PageRenderCache:
+    """按 (文件, 页码, dpi) 缓存渲染结果，总内存超过上限 (MB) 时淘汰最久未用的页面"""
+
+    def __init__(self, max_mb=DEFAULT_PAGE_CACHE_MB):
+        self.max_bytes = max_mb * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _size(item):
+        img = item[0]
+        return img.width * img.height * len(img.getbands())
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._items
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item
+
+    def put(self, key, item):
+        size = self._size(item)
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= self._size(old)
+            self._items[key] = item
+            self._bytes += size
+            while self._bytes > self.max_bytes and len(self._items) > 1:
+                _, evicted = self._items.popitem(last=False)
+                self._bytes -= self._size(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._items),
+                    "bytes": self._bytes, "max_bytes": self.max_bytes}
+
+class PagePrefetcher:
+    """后台线程：预先渲染相邻页面放入缓存，使翻页时直接命中
+
+    线程自己打开一份文档，不与界面线程共用 fitz.Document。
+    新的预取请求会取代尚未开始的旧请求。
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self._queue = queue.Queue()
+        self._doc = None
+        self._doc_path = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def request(self, path, page_indices, dpi=PREVIEW_DPI):
+        try:
+            while True: self._queue.get_nowait()
+        except queue.Empty:
+            pass
+        for idx in page_indices:
+            self._queue.put((path, idx, dpi))
+
+    def _run(self):
+        while True:
+            path, idx, dpi = self._queue.get()
+            if path is None:
+                break
+            key = (path, idx, dpi)
+            if key in self.cache:
+                continue
+            try:
+                with RENDER_LOCK:
+                    if self._doc_path != path:
+                        if self._doc: self._doc.close()
+                        self._doc, self._doc_path = fitz.open(path), path
+                    if not 0 <= idx < self._doc.page_count:
+                        continue
+                    if needs_tiles(*page_geometry(self._doc, idx, dpi)[:2]):
+                        continue # 大幅面页面按需渲染瓦片，不整页预取
+                    item = render_page(self._doc, idx, dpi)
+                self.cache.put(key, item)
+            except Exception:
+                pass
+        with RENDER_LOCK:
+            if self._doc: self._doc.close()
+
+    def close(self):
+        self.request(None, [None])
+
+# --- 水印贴图 ---
+def _apply_opacity(img, opacity):
+    r, g, b, a = img.split()
+    img.putalpha(ImageEnhance.Brightness(a).enhance(opacity))
+    return img
+
+def make_sprite(img_obj, size, angle, opacity):
+    """高质量贴图：从原图缩放到 size，再旋转并应用透明度"""
+    return _apply_opacity(img_obj.resize(size, Image.Resampling.LANCZOS).rotate(angle, expand=True), opacity)
+
+def make_sprite_base(img_obj, opacity, max_side=SPRITE_BASE_MAX):
+    """拖动手柄时使用的底图：缩小到 max_side 以内并预先应用透明度"""
+    base = img_obj.copy()
+    base.thumbnail((max_side, max_side), Image.Resampling.BILINEAR)
+    return _apply_opacity(base, opacity)
+
+def make_fast_sprite(base, size, angle):
+    """由底图快速生成近似贴图，只用于拖动过程中的实时反馈"""
+    return base.resize(size, Image.Resampling.NEAREST).rotate(angle, expand=True)
+
+def composite_grid(sprite, centers, size):
+    """把同一贴图按 centers（贴图中心的像素坐标）合成到一张 size 大小的透明图层上"""
+    overlay = Image.new("RGBA", size, (0, 0, 0, 0))
+    half_w, half_h = sprite.width // 2, sprite.height // 2
+    for cx, cy in centers:
+        x0, y0 = int(round(cx)) - half_w, int(round(cy)) - half_h
+        if x0 >= size[0] or y0 >= size[1] or x0 + sprite.width <= 0 or y0 + sprite.height <= 0:
+            continue
+        # 目标位置不能为负，超出左上边缘的部分从贴图中裁掉
+        overlay.alpha_composite(sprite, (max(0, x0), max(0, y0)), (max(0, -x0), max(0, -y0)))
+    return overlay
+
+class SpriteCache(PageRenderCache):
+    """预览用的水印贴图及阵列合成图层缓存，条目为 (PIL 图像, PhotoImage 或 None, 源图)
+
+    键中用 id(源图) 标识水印图片，条目同时持有源图引用，保证缓存期间该 id 不会被复用。
+    """
+
+    def __init__(self, max_mb=DEFAULT_SPRITE_CACHE_MB):
+        super().__init__(max_mb)
+
+    @staticmethod
+    def _size(item):
+        # PhotoImage 在 Tk 中另有一份像素数据
+        img = item[0]
+        return img.width * img.height * 4 * (2 if item[1] is not None else 1)
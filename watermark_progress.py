@@ -0,0 +1,218 @@
+"""批处理进度事件流（处理线程写入，界面主循环或命令行从队列中读取）与暂停/取消控制"""
+import os
+import time
+import queue
+import threading
+
+# 逐页事件的最小间隔（秒），避免上千页的文件把队列塞满
+PAGE_EVENT_INTERVAL = 0.1
+# 界面读取事件流的间隔（毫秒）
+POLL_INTERVAL_MS = 100
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}小时{seconds % 3600 // 60}分"
+    if seconds >= 60:
+        return f"{seconds // 60}分{seconds % 60}秒"
+    return f"{seconds}秒"
+
+def format_progress(event):
+    """把进度事件格式化为一行状态文字"""
+    parts = []
+    if event.get("file") and event.get("file_pages"):
+        parts.append(f"{event['file_name']} 第 {event['file_pages_done']}/{event['file_pages']} 页")
+    total = event.get("total_files")
+    parts.append(f"文件 {event['files_done']}/{total}" if total else f"文件 {event['files_done']}")
+    if event.get("pages_per_sec"):
+        parts.append(f"{event['pages_per_sec']:.1f} 页/秒")
+    if event.get("eta") is not None:
+        parts.append(f"剩余约 {format_duration(event['eta'])}")
+    return " · ".join(parts)
+
+class ProgressReporter:
+    """线程安全的进度事件流
+
+    生产者（处理线程或批量调度）调用 file_started / page_done / add_pages / file_done /
+    file_skipped / status / finish，每次调用向 events 队列放入一个字典事件：
+    type 为 "file_start"、"page"、"file_done"、"skipped"、"status" 或 "finished"，
+    并附带当前的累计数据（已完成文件数和页数、页/秒、预计剩余秒数、总体完成比例）。
+    消费者用 drain() 非阻塞地取走积压事件（界面用 after 定时调用），
+    或直接迭代本对象，阻塞读取直到 "finished"（无界面调用）。
+    """
+
+    def __init__(self, total_files=None):
+        self.events = queue.Queue()
+        self.total_files = total_files
+        self.files_done = 0
+        self.files_failed = 0
+        self.files_skipped = 0
+        self.pages_done = 0
+        self.pages_finished_files = 0 # 已完成文件的页数合计，用于估算未开始文件的页数
+        self._active = {}  # 处理中的文件 -> [页数, 已完成页数]
+        self._current = None
+        self._start = time.perf_counter()
+        self._last_page_event = 0.0
+        self._lock = threading.Lock()
+
+    # --- 生产者 ---
+    def file_started(self, path, pages):
+        with self._lock:
+            self._active[path] = [pages, 0]
+            self._current = path
+            self._emit("file_start", path)
+
+    def page_done(self, path=None):
+        self.add_pages(path, 1, throttle=True)
+
+    def add_pages(self, path, count, throttle=False):
+        """path 完成了 count 页；多进程分片完成时一次报告整段页数"""
+        with self._lock:
+            path = path or self._current
+            entry = self._active.get(path)
+            if entry is not None:
+                entry[1] += count
+            self.pages_done += count
+            now = time.perf_counter()
+            if throttle and now - self._last_page_event < PAGE_EVENT_INTERVAL:
+                return
+            self._last_page_event = now
+            self._emit("page", path)
+
+    def file_done(self, result):
+        """一个文件处理结束（result 为 run_file 返回的结果记录）；补齐未逐页报告的页数"""
+        with self._lock:
+            path = result["path"]
+            pages, done = self._active.pop(path, [result.get("pages", 0), 0])
+            pages = result.get("pages", pages)
+            if pages > done:
+                self.pages_done += pages - done
+            self.pages_finished_files += pages
+            self.files_done += 1
+            if not result["ok"] and not result.get("cancelled"):
+                self.files_failed += 1
+            self._emit("file_done", path, ok=result["ok"], output=result.get("output"), error=result.get("error"))
+
+    def file_skipped(self, path):
+        with self._lock:
+            self.files_skipped += 1
+            self._emit("skipped", path)
+
+    def set_total(self, total_files):
+        """开始时文件数未知（如边遍历目录边处理），遍历结束后补上总数"""
+        with self._lock:
+            self.total_files = total_files
+
+    def status(self, text, **data):
+        with self._lock:
+            self._emit("status", None, text=text, **data)
+
+    def finish(self, **data):
+        with self._lock:
+            self._emit("finished", None, **data)
+
+    # --- 消费者 ---
+    def drain(self):
+        events = []
+        try:
+            while True: events.append(self.events.get_nowait())
+        except queue.Empty:
+            pass
+        return events
+
+    def __iter__(self):
+        while True:
+            event = self.events.get()
+            yield event
+            if event["type"] == "finished":
+                return
+
+    # --- 统计 ---
+    def snapshot(self):
+        with self._lock:
+            return self._snapshot(self._current)
+
+    def _snapshot(self, path):
+        elapsed = time.perf_counter() - self._start
+        rate = self.pages_done / elapsed if elapsed > 0 else 0.0
+        finished = self.files_done + self.files_skipped
+        active_fraction = sum(done / pages for pages, done in self._active.values() if pages)
+        fraction = None
+        eta = None
+        if self.total_files:
+            fraction = min(1.0, (finished + active_fraction) / self.total_files)
+            # 未开始的文件按已完成文件的平均页数估算
+            remaining_pages = sum(max(0, pages - done) for pages, done in self._active.values())
+            unstarted = max(0, self.total_files - finished - len(self._active))
+            if unstarted and self.files_done:
+                remaining_pages += unstarted * self.pages_finished_files / self.files_done
+            if rate > 0 and (self.files_done or self._active):
+                eta = remaining_pages / rate
+        entry = self._active.get(path)
+        return {
+            "file": path,
+            "file_name": os.path.basename(path) if path else None,
+            "file_pages": entry[0] if entry else None,
+            "file_pages_done": entry[1] if entry else None,
+            "files_done": self.files_done,
+            "files_failed": self.files_failed,
+            "files_skipped": self.files_skipped,
+            "total_files": self.total_files,
+            "pages_done": self.pages_done,
+            "pages_per_sec": rate,
+            "elapsed": elapsed,
+            "eta": eta,
+            "fraction": fraction,
+        }
+
+    def _emit(self, kind, path, **data):
+        event = self._snapshot(path)
+        event.update(data, type=kind)
+        self.events.put(event)
+
+class JobCancelled(Exception):
+    """任务在页面之间的检查点被取消"""
+
+class JobControl:
+    """协作式暂停与取消：处理流程在每页之间调用 checkpoint()
+
+    暂停时 checkpoint() 阻塞直到继续或取消；取消后 checkpoint() 抛出 JobCancelled，
+    当前文件放弃写出，之后的文件不再开始。
+    cancel_event / running_event 可传入 multiprocessing.Event，使工作进程中的检查点
+    也能看到主进程的取消和暂停（running_event 清除时为暂停）。
+    """
+
+    def __init__(self, cancel_event=None, running_event=None):
+        self._cancel = cancel_event if cancel_event is not None else threading.Event()
+        if running_event is None:
+            running_event = threading.Event()
+            running_event.set()
+        self._running = running_event
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    @property
+    def paused(self):
+        return not self._running.is_set()
+
+    def cancel(self):
+        self._cancel.set()
+        self._running.set()  # 唤醒暂停中的处理线程
+
+    def pause(self):
+        if not self.cancelled:
+            self._running.clear()
+
+    def resume(self):
+        self._running.set()
+
+    def wait(self):
+        """暂停时阻塞，直到继续或取消"""
+        self._running.wait()
+
+    def checkpoint(self):
+        self._running.wait()
+        if self._cancel.is_set():
+            raise JobCancelled()
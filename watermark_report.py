@@ -0,0 +1,226 @@
+"""批处理运行报告：汇总各阶段耗时与计数，写出 JSON / CSV，并可选用 cProfile 采样热点"""
+import io
+import os
+import sys
+import csv
+import json
+import time
+import cProfile
+import pstats
+
+DEFAULT_REPORT_DIR = os.path.join(os.path.expanduser("~"), ".pdf_watermark_reports")
+
+# 每个文件结果中按阶段累计的耗时字段
+STAGE_KEYS = ["open_seconds", "stamp_seconds", "save_seconds", "merge_seconds"]
+# 每个文件结果中累加的计数字段
+COUNTER_KEYS = ["pages", "images_inserted", "images_deduped", "texts_inserted", "output_bytes", "bytes_written",
+                "bytes_copied"]
+
+CSV_FIELDS = ["path", "ok", "cancelled", "error", "output", "pages", "seconds"] + STAGE_KEYS + \
+             ["page_mean_ms", "page_max_ms", "slowest_page"] + COUNTER_KEYS[1:] + \
+             ["copy_method", "peak_rss_bytes", "page_window", "worker", "shards"]
+
+def _proc_status_bytes(field):
+    """读取 Linux /proc/self/status 中以 kB 为单位的字段，不可用时返回 None"""
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+def current_rss_bytes():
+    """本进程当前的常驻内存（字节），无法获取时返回 None"""
+    rss = _proc_status_bytes("VmRSS")
+    if rss is not None:
+        return rss
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss
+
+def reset_peak_rss():
+    """把峰值常驻内存重置为当前值，之后的 peak_rss_bytes() 只反映此后的峰值
+
+    只有 Linux 支持（写 /proc/self/clear_refs），成功时返回 True；
+    其他系统返回 False，此时峰值是进程启动以来的最大值。
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def peak_rss_bytes():
+    """本进程的峰值常驻内存（字节），无法获取时返回 None"""
+    peak = _proc_status_bytes("VmHWM")
+    if peak is not None:
+        return peak
+    try:
+        import resource
+    except ImportError:
+        # Windows 没有 resource 模块，安装了 psutil 时读取峰值工作集
+        try:
+            import psutil
+        except ImportError:
+            return None
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 以字节为单位，Linux 以 KB 为单位
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[k]
+
+def summarize_page_times(page_times):
+    """[[页码, 秒], ...] -> 单页耗时统计（毫秒）及最慢的页码（从 1 开始）"""
+    if not page_times:
+        return {"count": 0}
+    values = sorted(t for _, t in page_times)
+    slowest = max(page_times, key=lambda item: item[1])
+    return {
+        "count": len(values),
+        "mean_ms": sum(values) / len(values) * 1000,
+        "p50_ms": _percentile(values, 0.5) * 1000,
+        "p95_ms": _percentile(values, 0.95) * 1000,
+        "max_ms": values[-1] * 1000,
+        "slowest_page": slowest[0] + 1,
+    }
+
+class RunReport:
+    """收集一次批处理的全部结果记录，结束时写出报告
+
+    每条结果（run_file / iter_batch_parallel 的返回值）自带分阶段耗时和计数，
+    逐页耗时在加入时汇总为统计值后丢弃，报告大小只与文件数有关。
+    """
+
+    def __init__(self, settings=None):
+        self.settings = settings or {}
+        self.started = time.time()
+        self.finished = None
+        self.stages = {}  # 整个运行级别的阶段耗时，如水印预处理
+        self.files = []
+        self.skipped = 0
+        self.cancelled = False
+        self._all_page_times = []
+
+    def add_stage(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def add(self, result):
+        record = {k: v for k, v in result.items() if k != "page_times"}
+        page_times = result.get("page_times") or []
+        record["page_stats"] = summarize_page_times(page_times)
+        self._all_page_times.extend(t for _, t in page_times)
+        self.files.append(record)
+
+    def finish(self, skipped=0, cancelled=False):
+        self.finished = time.time()
+        self.skipped = skipped
+        self.cancelled = cancelled
+
+    def summary(self):
+        wall = (self.finished or time.time()) - self.started
+        stages = dict(self.stages)
+        for key in STAGE_KEYS:
+            stages[key] = sum(f.get(key, 0.0) for f in self.files)
+        counters = {key: sum(f.get(key, 0) for f in self.files) for key in COUNTER_KEYS}
+        counters.update(
+            files=len(self.files),
+            ok=sum(1 for f in self.files if f.get("ok")),
+            failed=sum(1 for f in self.files if not f.get("ok") and not f.get("cancelled")),
+            cancelled=sum(1 for f in self.files if f.get("cancelled")),
+            skipped=self.skipped,
+            peak_rss_bytes=max((f.get("peak_rss_bytes") or 0 for f in self.files), default=0),
+        )
+        values = sorted(self._all_page_times)
+        page_seconds = {"count": len(values)}
+        if values:
+            page_seconds.update(mean_ms=sum(values) / len(values) * 1000, p50_ms=_percentile(values, 0.5) * 1000,
+                                p95_ms=_percentile(values, 0.95) * 1000, max_ms=values[-1] * 1000)
+        return {
+            "started": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started)),
+            "wall_seconds": wall,
+            "cancelled": self.cancelled,
+            "pages_per_sec": counters["pages"] / wall if wall > 0 else 0.0,
+            "stages": stages,
+            "counters": counters,
+            "page_seconds": page_seconds,
+        }
+
+    def to_dict(self):
+        return {
+            "settings": self.settings,
+            "summary": self.summary(),
+            "failures": [{"path": f["path"], "error": f.get("error")} for f in self.files
+                         if not f.get("ok") and not f.get("cancelled")],
+            "files": self.files,
+        }
+
+    def write_json(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2, default=str)
+        return path
+
+    def write_csv(self, path):
+        """每个文件一行，便于在表格软件中排序查找慢文件"""
+        with open(path, "w", encoding="utf-8-sig", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=CSV_FIELDS, extrasaction="ignore")
+            writer.writeheader()
+            for record in self.files:
+                row = dict(record)
+                stats = record.get("page_stats", {})
+                row["page_mean_ms"] = round(stats.get("mean_ms", 0.0), 3)
+                row["page_max_ms"] = round(stats.get("max_ms", 0.0), 3)
+                row["slowest_page"] = stats.get("slowest_page", "")
+                writer.writerow(row)
+        return path
+
+    def write(self, path):
+        """按扩展名写出：.csv 写逐文件表格，其余写完整 JSON"""
+        if path.lower().endswith(".csv"):
+            return self.write_csv(path)
+        return self.write_json(path)
+
+    def write_default(self, report_dir=DEFAULT_REPORT_DIR):
+        """在报告目录中同时写出 JSON 与 CSV，返回 JSON 路径"""
+        os.makedirs(report_dir, exist_ok=True)
+        base = os.path.join(report_dir, time.strftime("run-%Y%m%d-%H%M%S", time.localtime(self.started)))
+        self.write_csv(base + ".csv")
+        return self.write_json(base + ".json")
+
+class Profiler:
+    """可选的 cProfile 采样；path 为空时什么也不做
+
+    只覆盖当前进程：多进程运行时工作进程中的加水印过程不在采样范围内，需配合单进程运行。
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._profile = cProfile.Profile() if path else None
+
+    def __enter__(self):
+        if self._profile: self._profile.enable()
+        return self
+
+    def __exit__(self, *exc):
+        if self._profile:
+            self._profile.disable()
+            self._profile.dump_stats(self.path)
+        return False
+
+    def top(self, limit=15):
+        """累计耗时最高的函数，格式同 pstats 输出"""
+        if not self._profile:
+            return ""
+        out = io.StringIO()
+        pstats.Stats(self._profile, stream=out).sort_stats("cumulative").print_stats(limit)
+        return out.getvalue()
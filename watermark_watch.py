@@ -0,0 +1,161 @@
+"""热文件夹监控：扫描仪或文档系统放入 PDF 后自动加水印并移到输出目录"""
+import os
+import time
+import shutil
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from watermark_engine import DEFAULT_OUTPUT_DIR, DEFAULT_SUFFIX
+from watermark_parallel import init_worker, run_in_worker
+
+# 可选依赖：安装 watchdog 后用系统通知（Linux 上为 inotify）及时唤醒扫描，否则定时轮询
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+
+PROCESSED_DIR = "processed"
+FAILED_DIR = "failed"
+
+def _move_unique(path, target_dir):
+    """移动文件到 target_dir，同名文件已存在时在文件名后加时间戳"""
+    os.makedirs(target_dir, exist_ok=True)
+    name = os.path.basename(path)
+    target = os.path.join(target_dir, name)
+    if os.path.exists(target):
+        base, ext = os.path.splitext(name)
+        target = os.path.join(target_dir, f"{base}_{time.strftime('%Y%m%d%H%M%S')}{ext}")
+    shutil.move(path, target)
+    return target
+
+def scan_ready_files(folder, state, settle, now, skip=()):
+    """返回大小和修改时间已保持 settle 秒不变的 PDF
+
+    state 在多次扫描之间保存 {path: ((大小, 修改时间), 首次观察到该状态的时间)}。
+    """
+    ready = []
+    try:
+        with os.scandir(folder) as it:
+            for entry in it:
+                if not entry.name.lower().endswith(".pdf") or entry.path in skip:
+                    continue
+                try:
+                    if not entry.is_file(): continue
+                    st = entry.stat()
+                except OSError:
+                    continue
+                sig = (st.st_size, st.st_mtime_ns)
+                prev = state.get(entry.path)
+                if prev is None or prev[0] != sig:
+                    # 文件仍在写入（或刚出现），重新计时
+                    state[entry.path] = (sig, now)
+                elif now - prev[1] >= settle:
+                    ready.append(entry.path)
+    except OSError:
+        pass
+    return ready
+
+def watch_folders(folders, processed_wms, output_dir, mode="全部页面", custom=None, suffix=DEFAULT_SUFFIX,
+                  workers=None, interval=2.0, settle=3.0, max_pending=None, on_result=None,
+                  stop_event=None, **options):
+    """持续监控 folders，直到 stop_event 被设置
+
+    文件稳定后交给常驻进程池处理：输出写入 output_dir，原文件移到所在目录的
+    processed/（失败时为 failed/）子目录。在途任务达到 max_pending 时暂停接收新文件，
+    多出的文件留在原目录等待下一轮。每完成一个文件调用一次 on_result(result)。
+    工作进程异常退出时重建进程池，当时在途的文件留在原目录重试一次；
+    原文件无法归档的不再重复处理，直到它被移走。
+    """
+    if output_dir == DEFAULT_OUTPUT_DIR:
+        raise ValueError("监控模式需要指定独立的输出目录")
+    out_abs = os.path.abspath(output_dir)
+    if any(os.path.abspath(f) == out_abs for f in folders):
+        raise ValueError("输出目录不能与监控目录相同")
+    os.makedirs(output_dir, exist_ok=True)
+
+    workers = workers or os.cpu_count() or 1
+    max_pending = max_pending or workers * 2
+    stop_event = stop_event or threading.Event()
+    wake = threading.Event()
+
+    observer = None
+    if Observer is not None:
+        class _WakeHandler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                wake.set()
+        observer = Observer()
+        for folder in folders:
+            observer.schedule(_WakeHandler(), folder, recursive=False)
+        observer.start()
+
+    def new_pool():
+        return ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                   initargs=(processed_wms, mode, custom, output_dir, suffix, options))
+
+    state = {}
+    pending = {}  # future -> 原文件路径
+    crashes = {}  # 原文件路径 -> 在途时遇到工作进程异常退出的次数
+    unarchived = set()  # 已处理但无法移走的原文件
+    pool = new_pool()
+    try:
+        while not stop_event.is_set():
+            broken = False
+            for fut in [f for f in pending if f.done()]:
+                path = pending.pop(fut)
+                try:
+                    result = fut.result()
+                except BrokenProcessPool as e:
+                    # 进程池中的全部在途任务都会失败，分不清是哪个文件导致的：
+                    # 第一次留在原目录等文件稳定后重试，再次遇到时按失败归档
+                    broken = True
+                    crashes[path] = crashes.get(path, 0) + 1
+                    if crashes[path] < 2:
+                        state.pop(path, None)
+                        continue
+                    result = {"path": path, "ok": False, "output": None,
+                              "error": f"工作进程异常退出: {e}", "seconds": 0.0}
+                except Exception as e:
+                    result = {"path": path, "ok": False, "output": None, "error": str(e), "seconds": 0.0}
+                crashes.pop(path, None)
+                try:
+                    sub = PROCESSED_DIR if result["ok"] else FAILED_DIR
+                    result["archived"] = _move_unique(path, os.path.join(os.path.dirname(path), sub))
+                except OSError as e:
+                    result["error"] = result["error"] or f"移动原文件失败: {e}"
+                    unarchived.add(path)
+                state.pop(path, None)
+                if on_result: on_result(result)
+            if broken:
+                pool.shutdown(wait=False)
+                pool = new_pool()
+            # 无法归档的原文件被手动移走后不再跳过
+            unarchived = {p for p in unarchived if os.path.exists(p)}
+
+            # 背压：在途任务已满时不再接收新文件
+            if len(pending) < max_pending:
+                now = time.monotonic()
+                skip = set(pending.values()) | unarchived
+                for folder in folders:
+                    for path in scan_ready_files(folder, state, settle, now, skip=skip):
+                        try:
+                            fut = pool.submit(run_in_worker, path)
+                        except BrokenProcessPool:
+                            # 进程池在上一轮检查之后才损坏，在途任务下一轮再按上面的方式处理
+                            pool.shutdown(wait=False)
+                            pool = new_pool()
+                            fut = pool.submit(run_in_worker, path)
+                        pending[fut] = path
+                        skip.add(path)
+                        if len(pending) >= max_pending: break
+                    if len(pending) >= max_pending: break
+
+            # 有任务在途时缩短等待，以便及时归档完成的文件
+            wake.wait(min(interval, 0.5) if pending else interval)
+            wake.clear()
+    finally:
+        pool.shutdown()
+        if observer is not None:
+            observer.stop()
+            observer.join()